@@ -1,23 +1,38 @@
+import time
+import logging
+import importlib
 import streamlit as st
-from modules import xml_reader, cadastro_clientes, mercadorias, sefaz_integration, database
+from modules import database
 
-st.set_page_config(page_title="Leitor NF-e & CT-e", page_icon="📦", layout="wide")
+inicio_execucao = time.perf_counter()
 
-database.init_db()
+st.set_page_config(page_title="Leitor NF-e & CT-e", page_icon="📦", layout="wide")
 
-menu = st.sidebar.radio("📋 Menu", ["Leitor XML", "Cadastro de Clientes", "Mercadorias", "Integração SEFAZ"])
+# Páginas são importadas apenas quando selecionadas no menu (pandas, OpenSSL,
+# e requests só são carregados quando realmente usados)
+PAGINAS = {
+    "Leitor XML": "modules.xml_reader",
+    "Cadastro de Clientes": "modules.cadastro_clientes",
+    "Mercadorias": "modules.mercadorias",
+    "Auditoria de Totais": "modules.painel_auditoria",
+    "Integração SEFAZ": "modules.sefaz_integration",
+}
 
-if menu == "Leitor XML":
-    xml_reader.render()
+@st.cache_resource(show_spinner=False)
+def inicializar_banco():
+    """Inicializa o banco uma única vez por processo, e não a cada rerun"""
+    database.init_db()
+    return True
 
-elif menu == "Cadastro de Clientes":
-    cadastro_clientes.render()
+inicializar_banco()
 
-elif menu == "Mercadorias":
-    mercadorias.render()
+menu = st.sidebar.radio("📋 Menu", list(PAGINAS))
 
-elif menu == "Integração SEFAZ":
-    sefaz_integration.render()
+importlib.import_module(PAGINAS[menu]).render()
 
 st.sidebar.markdown("---")
 st.sidebar.caption("🧠 Sistema desenvolvido em Python + Streamlit")
+
+logging.getLogger("fiscal.app").debug(
+    "Execução de '%s' em %.1f ms", menu, (time.perf_counter() - inicio_execucao) * 1000
+)
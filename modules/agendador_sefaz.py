@@ -0,0 +1,184 @@
+# modules/agendador_sefaz.py
+"""
+Agendador adaptativo das chamadas à SEFAZ, por CNPJ e endpoint.
+
+A partir das respostas (cStat 138/137/656, HTTP 5xx, timeouts) ajusta o
+intervalo entre chamadas: acelera enquanto há documentos, respeita a espera
+de 1 hora após 137 ("nenhum documento") e 656 ("consumo indevido"), aplica
+espera exponencial com jitter em falhas transitórias e abre um circuito
+após falhas consecutivas, liberando uma única chamada de teste depois do
+período de resfriamento.
+"""
+import os
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+
+INTERVALO_MINIMO = float(os.environ.get("SEFAZ_INTERVALO_MINIMO", "2"))
+INTERVALO_MAXIMO = 60.0
+ESPERA_BASE = 2.0
+ESPERA_MAXIMA_BACKOFF = 300.0
+# Regra da SEFAZ: após 137 ou 656, aguardar 1 hora antes de consultar novamente
+ESPERA_SEM_DOCUMENTOS = 3600.0
+ESPERA_CONSUMO_INDEVIDO = 3600.0
+LIMITE_FALHAS = 5
+RESFRIAMENTO_CIRCUITO = 300.0
+
+FECHADO, ABERTO, MEIO_ABERTO = "fechado", "aberto", "meio-aberto"
+
+# Códigos registrados para falhas de transporte
+TIMEOUT = "timeout"
+ERRO_REDE = "erro_rede"
+ERRO_SERVIDOR = "http_5xx"
+TRANSITORIOS = (TIMEOUT, ERRO_REDE, ERRO_SERVIDOR)
+
+# Consultas da DistribuicaoDFe
+DIST_NSU = "distNSU"
+CONS_CHAVE = "consChNFe"
+
+
+class ConsultaAdiada(Exception):
+    """A próxima chamada permitida está além da espera aceita por quem chamou"""
+
+    def __init__(self, cnpj, endpoint, liberada_em, motivo):
+        self.cnpj = cnpj
+        self.endpoint = endpoint
+        self.liberada_em = liberada_em
+        self.motivo = motivo
+        horario = datetime.now() + timedelta(seconds=max(0.0, liberada_em - time.monotonic()))
+        super().__init__(f"Consulta adiada até {horario.strftime('%d/%m/%Y %H:%M')} ({motivo})")
+
+
+class AgendadorSefaz:
+    def __init__(self, intervalo_minimo=INTERVALO_MINIMO):
+        self.intervalo_minimo = intervalo_minimo
+        self._estados = {}
+        self._lock = threading.Lock()
+
+    def _estado(self, cnpj, endpoint):
+        chave = (cnpj, endpoint)
+        if chave not in self._estados:
+            self._estados[chave] = {
+                "intervalo": self.intervalo_minimo,
+                "proxima": 0.0,
+                "motivo": "",
+                "falhas": 0,
+                "circuito": FECHADO,
+                "resfriamento": RESFRIAMENTO_CIRCUITO,
+                "sondando": False,
+            }
+        return self._estados[chave]
+
+    def aguardar(self, cnpj, endpoint, espera_maxima=120.0):
+        """
+        Bloqueia até a próxima chamada permitida. Levanta ConsultaAdiada se a
+        espera necessária passar de `espera_maxima` segundos.
+        """
+        while True:
+            with self._lock:
+                estado = self._estado(cnpj, endpoint)
+                agora = time.monotonic()
+
+                if estado["circuito"] == ABERTO and agora >= estado["proxima"]:
+                    estado["circuito"] = MEIO_ABERTO
+                    estado["sondando"] = False
+
+                if estado["circuito"] == MEIO_ABERTO and estado["sondando"]:
+                    # Apenas uma chamada de teste por vez com o circuito meio-aberto
+                    espera = self.intervalo_minimo
+                    liberada_em = agora + espera
+                else:
+                    liberada_em = estado["proxima"]
+                    espera = liberada_em - agora
+
+                if espera > espera_maxima:
+                    raise ConsultaAdiada(cnpj, endpoint, liberada_em, estado["motivo"] or estado["circuito"])
+
+                if espera <= 0:
+                    if estado["circuito"] == MEIO_ABERTO:
+                        estado["sondando"] = True
+                    estado["proxima"] = agora + estado["intervalo"]
+                    return
+
+            time.sleep(espera)
+
+    def registrar(self, cnpj, endpoint, codigo):
+        """Ajusta o agendamento conforme o cStat da resposta ou a falha de transporte"""
+        with self._lock:
+            estado = self._estado(cnpj, endpoint)
+            agora = time.monotonic()
+            estado["sondando"] = False
+
+            if codigo in TRANSITORIOS:
+                estado["falhas"] += 1
+                espera = min(ESPERA_MAXIMA_BACKOFF, ESPERA_BASE * 2 ** estado["falhas"])
+                espera = random.uniform(espera / 2, espera)
+                motivo = f"{codigo}, {estado['falhas']} falha(s) seguida(s)"
+
+                if estado["circuito"] == MEIO_ABERTO:
+                    # Teste falhou: reabre com resfriamento dobrado
+                    estado["resfriamento"] = min(estado["resfriamento"] * 2, ESPERA_SEM_DOCUMENTOS)
+                    self._abrir(estado, agora, motivo)
+                elif estado["falhas"] >= LIMITE_FALHAS:
+                    self._abrir(estado, agora, motivo)
+                else:
+                    estado["proxima"] = max(estado["proxima"], agora + espera)
+                    estado["motivo"] = motivo
+                return
+
+            # A SEFAZ respondeu: o transporte está saudável
+            estado["falhas"] = 0
+            estado["circuito"] = FECHADO
+            estado["resfriamento"] = RESFRIAMENTO_CIRCUITO
+
+            if codigo == "656":
+                # Consumo indevido vale para todos os serviços do CNPJ
+                for outro_endpoint in (DIST_NSU, CONS_CHAVE):
+                    self._estado(cnpj, outro_endpoint)
+                for (outro_cnpj, _), outro in self._estados.items():
+                    if outro_cnpj == cnpj:
+                        outro["intervalo"] = min(outro["intervalo"] * 2, INTERVALO_MAXIMO)
+                        outro["proxima"] = max(outro["proxima"], agora + ESPERA_CONSUMO_INDEVIDO)
+                        outro["motivo"] = "consumo indevido (656)"
+            elif codigo == "137":
+                estado["proxima"] = max(estado["proxima"], agora + ESPERA_SEM_DOCUMENTOS)
+                estado["motivo"] = "nenhum documento localizado (137)"
+            elif codigo == "138":
+                # Há documentos pendentes: reduz o intervalo até o mínimo
+                estado["intervalo"] = max(self.intervalo_minimo, estado["intervalo"] / 2)
+                estado["motivo"] = ""
+
+    def liberar(self, cnpj, endpoint):
+        """
+        Devolve a vez da chamada de teste quando a chamada terminou sem resposta
+        que diga algo sobre a SEFAZ (HTTP 4xx, erro local): o circuito não muda.
+        """
+        with self._lock:
+            self._estado(cnpj, endpoint)["sondando"] = False
+
+    def _abrir(self, estado, agora, motivo):
+        estado["circuito"] = ABERTO
+        estado["proxima"] = agora + estado["resfriamento"]
+        estado["motivo"] = f"circuito aberto: {motivo}"
+
+    def situacao(self):
+        """Estado atual de cada (cnpj, endpoint), para diagnóstico"""
+        with self._lock:
+            agora = time.monotonic()
+            return [
+                {
+                    "cnpj": cnpj,
+                    "endpoint": endpoint,
+                    "circuito": estado["circuito"],
+                    "intervalo": estado["intervalo"],
+                    "falhas": estado["falhas"],
+                    "espera": max(0.0, estado["proxima"] - agora),
+                    "motivo": estado["motivo"],
+                }
+                for (cnpj, endpoint), estado in self._estados.items()
+            ]
+
+
+# Instância compartilhada por todas as threads do processo
+agendador = AgendadorSefaz()
@@ -0,0 +1,315 @@
+# modules/arquivamento.py
+"""
+Arquivamento das notas antigas em bancos SQLite por ano.
+
+As notas com data de emissão (ou, sem ela, de sincronização) anterior ao
+horizonte de MESES_ATIVOS são movidas, com itens, totais, auditoria,
+eventos e dados de CT-e, para PASTA_ARQUIVO/notas_<ano>.sqlite3. Cada
+arquivo anual recebe as mesmas migrações do banco principal, então as
+tabelas têm as mesmas colunas.
+
+A movimentação é feita em lotes, cada um em uma transação BEGIN IMMEDIATE
+que copia para o arquivo anual e remove do banco principal: nenhuma
+gravação concorrente entra entre a cópia e a remoção. Com o banco
+principal em WAL, o commit não é atômico entre os dois arquivos; se o
+processo cair no meio dele, a nota fica nos dois bancos até a próxima
+execução, que refaz a cópia (INSERT OR REPLACE) e termina a remoção; nada
+se perde.
+
+Para consultar o histórico, conectar(inicio, fim) anexa só os anos do
+período e cria as visões temporárias historico_<tabela> (banco principal
+UNION ALL arquivos anexados). Os filtros da consulta descem para cada
+parte da união e usam os índices de cada banco.
+
+Eventos que chegarem depois do arquivamento (raros com o horizonte
+padrão de 24 meses) ficam no banco principal e aparecem na visão
+historico_eventos, mas não alteram a situação da nota arquivada.
+
+Uso: python -m modules.arquivamento [--meses N] [--lote N] [--vacuum] [--listar]
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import date
+from modules import database, migracoes, travas
+
+logger = logging.getLogger("fiscal.arquivamento")
+
+PASTA_ARQUIVO = os.environ.get("FISCAL_PASTA_ARQUIVO", "data/arquivo")
+# Notas emitidas nos últimos MESES_ATIVOS meses ficam no banco principal
+MESES_ATIVOS = int(os.environ.get("FISCAL_ARQUIVO_MESES", "24"))
+TAMANHO_LOTE = 2000
+
+# Tabelas que acompanham a nota -> coluna com a chave de acesso
+TABELAS_DEPENDENTES = {
+    "nfe_itens": "chave",
+    "nfe_totais": "chave",
+    "auditoria_totais": "chave",
+    "eventos": "chave",
+    "ctes": "chave",
+    "cte_componentes": "chave_cte",
+    "cte_cargas": "chave_cte",
+    "cte_nfes": "chave_cte",
+}
+TABELAS = ("notas", *TABELAS_DEPENDENTES)
+
+DATA_NOTA = "COALESCE(data_emissao, data_sincronizacao)"
+_RE_ARQUIVO = re.compile(r"^notas_(\d{4})\.sqlite3$")
+
+# Arquivos anuais já migrados neste processo
+_preparadas = set()
+_preparadas_lock = threading.Lock()
+
+
+def caminho_particao(ano):
+    return os.path.join(PASTA_ARQUIVO, f"notas_{int(ano)}.sqlite3")
+
+
+def particoes(inicio=None, fim=None):
+    """{ano: caminho} dos arquivos anuais existentes entre os anos de `inicio` e `fim` (inclusive)"""
+    if not os.path.isdir(PASTA_ARQUIVO):
+        return {}
+    primeiro = _ano(inicio) if inicio else None
+    ultimo = _ano(fim) if fim else None
+    encontrados = {}
+    for nome in os.listdir(PASTA_ARQUIVO):
+        correspondencia = _RE_ARQUIVO.match(nome)
+        if not correspondencia:
+            continue
+        ano = int(correspondencia.group(1))
+        if (primeiro is None or ano >= primeiro) and (ultimo is None or ano <= ultimo):
+            encontrados[ano] = os.path.join(PASTA_ARQUIVO, nome)
+    return dict(sorted(encontrados.items()))
+
+
+def _ano(valor):
+    """Ano de 2024, "2024", "2024-05-10", "2024-05-10T10:00:00-03:00" ou date"""
+    return int(str(valor)[:4])
+
+
+def ano_da_chave(chave):
+    """Ano de emissão pela chave de acesso (cUF + AAMM + ...)"""
+    return 2000 + int(chave[2:4])
+
+
+def limite_arquivamento(meses=MESES_ATIVOS, hoje=None):
+    """Primeiro dia do mês que abre a janela ativa ("AAAA-MM-01"); notas anteriores são arquivadas"""
+    hoje = hoje or date.today()
+    total = hoje.year * 12 + hoje.month - 1 - meses
+    return f"{total // 12:04d}-{total % 12 + 1:02d}-01"
+
+
+def periodo_arquivado(inicio, fim):
+    """Se algum arquivo anual tem notas com data em [inicio, fim) (datas ISO ou "AAAA-MM")"""
+    for caminho in particoes(inicio, fim).values():
+        conn = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+        try:
+            if conn.execute(
+                f"SELECT 1 FROM notas WHERE {DATA_NOTA} >= ? AND {DATA_NOTA} < ? LIMIT 1", (inicio, fim)
+            ).fetchone():
+                return True
+        finally:
+            conn.close()
+    return False
+
+
+def preparar_particao(ano):
+    """
+    Cria o arquivo anual, se preciso, e aplica as migrações pendentes nele.
+    Só a primeira chamada por arquivo no processo abre o banco; as demais
+    retornam direto o caminho.
+    """
+    caminho = caminho_particao(ano)
+    with _preparadas_lock:
+        if os.path.abspath(caminho) in _preparadas:
+            return caminho
+        os.makedirs(PASTA_ARQUIVO, exist_ok=True)
+        conn = sqlite3.connect(caminho, timeout=database.BUSY_TIMEOUT)
+        try:
+            migracoes.aplicar_migracoes(conn)
+        finally:
+            conn.close()
+        _preparadas.add(os.path.abspath(caminho))
+    return caminho
+
+
+def _colunas(conn, tabela):
+    """Colunas da tabela no banco principal, na ordem da definição"""
+    return ", ".join(linha[1] for linha in conn.execute(f"PRAGMA main.table_info({tabela})"))
+
+
+def _mover_lote(conn, colunas):
+    """Copia as notas de temp._lote para o arquivo anexado e as remove do banco principal, na mesma transação"""
+    # Trava de escrita desde a cópia: nada muda no principal entre o INSERT e o DELETE
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            f"INSERT OR REPLACE INTO arquivo.notas ({colunas['notas']}) "
+            f"SELECT {colunas['notas']} FROM main.notas WHERE id IN (SELECT id FROM temp._lote)"
+        )
+        for tabela, coluna in TABELAS_DEPENDENTES.items():
+            conn.execute(
+                f"INSERT OR REPLACE INTO arquivo.{tabela} ({colunas[tabela]}) "
+                f"SELECT {colunas[tabela]} FROM main.{tabela} WHERE {coluna} IN (SELECT numero FROM temp._lote)"
+            )
+        for tabela, coluna in TABELAS_DEPENDENTES.items():
+            conn.execute(f"DELETE FROM main.{tabela} WHERE {coluna} IN (SELECT numero FROM temp._lote)")
+        conn.execute("DELETE FROM main.notas WHERE id IN (SELECT id FROM temp._lote)")
+        conn.execute("DELETE FROM temp._arquivar WHERE id IN (SELECT id FROM temp._lote)")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def arquivar(meses=MESES_ATIVOS, tamanho_lote=TAMANHO_LOTE, hoje=None, parar=None):
+    """
+    Move as notas anteriores ao horizonte para os arquivos anuais; retorna
+    {ano: notas movidas}. Se o evento `parar` (trava perdida) for sinalizado,
+    para entre um lote e outro: cada lote é movido em uma transação.
+    """
+    inicio = time.perf_counter()
+    limite = limite_arquivamento(meses, hoje)
+    movidas = {}
+
+    conn = database.get_connection()
+    # Controle manual das transações (BEGIN/COMMIT explícitos)
+    conn.isolation_level = None
+    try:
+        conn.execute("CREATE TEMP TABLE _arquivar (id INTEGER PRIMARY KEY, numero TEXT, ano TEXT)")
+        conn.execute("CREATE TEMP TABLE _lote (id INTEGER PRIMARY KEY, numero TEXT)")
+        conn.execute(
+            f"INSERT INTO temp._arquivar SELECT id, numero, substr({DATA_NOTA}, 1, 4) "
+            f"FROM main.notas WHERE {DATA_NOTA} < ?",
+            (limite,)
+        )
+        colunas = {tabela: _colunas(conn, tabela) for tabela in TABELAS}
+        anos = [linha[0] for linha in conn.execute("SELECT DISTINCT ano FROM temp._arquivar ORDER BY ano")]
+
+        for ano in anos:
+            if parar is not None and parar.is_set():
+                break
+            conn.execute("ATTACH DATABASE ? AS arquivo", (preparar_particao(ano),))
+            try:
+                while not (parar is not None and parar.is_set()):
+                    conn.execute("DELETE FROM temp._lote")
+                    lote = conn.execute(
+                        "INSERT INTO temp._lote SELECT id, numero FROM temp._arquivar WHERE ano = ? ORDER BY id LIMIT ?",
+                        (ano, tamanho_lote)
+                    ).rowcount
+                    if not lote:
+                        break
+                    _mover_lote(conn, colunas)
+                    movidas[int(ano)] = movidas.get(int(ano), 0) + lote
+            finally:
+                conn.execute("DETACH DATABASE arquivo")
+            logger.info("%s: %d nota(s) arquivada(s) em %s", ano, movidas.get(int(ano), 0), caminho_particao(ano))
+    finally:
+        conn.close()
+
+    if parar is not None and parar.is_set():
+        logger.error("Trava perdida: arquivamento interrompido com %d nota(s) movida(s)", sum(movidas.values()))
+    logger.info(
+        "Arquivamento anterior a %s concluído em %.1fs: %d nota(s)",
+        limite, time.perf_counter() - inicio, sum(movidas.values())
+    )
+    return movidas
+
+
+def conectar(inicio=None, fim=None):
+    """
+    Conexão com o banco principal e os arquivos anuais de `inicio` a `fim`
+    (anos, datas ou datas ISO; sem limites, todos) anexados, com as visões
+    temporárias historico_<tabela> unindo os dois. Quem chama fecha a conexão.
+    """
+    anexos = particoes(inicio, fim)
+    conn = database.get_connection()
+    try:
+        limite = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(anexos) > limite:
+            raise ValueError(
+                f"Período com {len(anexos)} anos arquivados; o SQLite anexa no máximo {limite} bancos. "
+                "Restrinja o período da consulta."
+            )
+        for ano, caminho in anexos.items():
+            preparar_particao(ano)
+            conn.execute("ATTACH DATABASE ? AS ?", (caminho, f"arquivo_{ano}"))
+
+        for tabela in TABELAS:
+            colunas = _colunas(conn, tabela)
+            partes = [f"SELECT {colunas} FROM main.{tabela}"]
+            partes += [f"SELECT {colunas} FROM arquivo_{ano}.{tabela}" for ano in anexos]
+            conn.execute(f"CREATE TEMP VIEW historico_{tabela} AS " + " UNION ALL ".join(partes))
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def consultar(sql, parametros=(), inicio=None, fim=None):
+    """Executa `sql` (que usa as visões historico_<tabela>) sobre os bancos do período e retorna as linhas"""
+    conn = conectar(inicio, fim)
+    try:
+        return conn.execute(sql, parametros).fetchall()
+    finally:
+        conn.close()
+
+
+def resumo():
+    """[(ano, notas, tamanho em MB)] dos arquivos anuais"""
+    linhas = []
+    for ano, caminho in particoes().items():
+        conn = sqlite3.connect(caminho)
+        try:
+            total = conn.execute("SELECT COUNT(*) FROM notas").fetchone()[0]
+        finally:
+            conn.close()
+        linhas.append((ano, total, round(os.path.getsize(caminho) / 1024 / 1024, 1)))
+    return linhas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Arquiva as notas antigas em bancos SQLite por ano")
+    parser.add_argument("--meses", type=int, default=MESES_ATIVOS, help="meses mantidos no banco principal")
+    parser.add_argument("--lote", type=int, default=TAMANHO_LOTE, help="notas movidas por transação")
+    parser.add_argument("--vacuum", action="store_true", help="compacta o banco principal no final (bloqueia as gravações)")
+    parser.add_argument("--listar", action="store_true", help="só lista os arquivos anuais existentes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.listar:
+        for ano, total, tamanho in resumo():
+            print(f"{ano}: {total} nota(s), {tamanho} MB")
+        return 0
+
+    database.init_db()
+    # Agendado (cron/systemd timer): uma execução por vez, mesmo com várias réplicas
+    trava = travas.Trava("arquivamento")
+    if not trava.adquirir():
+        print(trava.motivo)
+        return 1
+    try:
+        movidas = arquivar(args.meses, args.lote, parar=trava.perdida)
+        if args.vacuum and movidas and not trava.perdida.is_set():
+            conn = database.get_connection()
+            try:
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+    finally:
+        trava.liberar()
+
+    for ano, total in sorted(movidas.items()):
+        print(f"{ano}: {total} nota(s) arquivada(s)")
+    if not movidas:
+        print(f"Nenhuma nota anterior a {limite_arquivamento(args.meses)} para arquivar.")
+    return 1 if trava.perdida.is_set() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+# modules/assinatura.py
+"""
+Verificação da assinatura digital (XMLDSig) de NF-e, CT-e e eventos.
+
+Cada Signature precisa referenciar (Reference URI="#Id") o elemento
+assinado ao lado dela (infNFe, infCte, infEvento...), e o infNFe/infCte
+que é importado tem de estar entre os assinados. O elemento é
+canonicalizado (C14N, sem a própria assinatura) e o DigestValue
+conferido; depois o SignedInfo canonicalizado é verificado com a chave
+pública do certificado de X509Certificate. O CNPJ do certificado
+(ICP-Brasil: otherName 2.16.76.1.3.3, ou o sufixo do CN) precisa ter a
+mesma raiz (8 dígitos) do CNPJ do emitente, como a SEFAZ exige
+(rejeição 213); para emitente pessoa física, o CPF (2.16.76.1.3.1).
+
+A cadeia do certificado é validada contra as ACs da pasta PASTA_CADEIA
+(ICP-Brasil, arquivos PEM ou DER) uma única vez por certificado: o
+resultado fica em cache pela impressão digital SHA-256, então 100 mil
+documentos de algumas centenas de emitentes validam algumas centenas de
+cadeias. Sem ACs na pasta só a assinatura é conferida.
+
+A ingestão confere os lotes grandes no pool de processos de
+modules.paralelo (cada processo mantém o próprio cache de certificados).
+"""
+import os
+import re
+import copy
+import base64
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from lxml import etree
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from OpenSSL import crypto
+
+logger = logging.getLogger("fiscal.assinatura")
+
+PASTA_CADEIA = os.environ.get("FISCAL_CADEIA_CERTIFICADOS", "data/certificados/cadeia")
+VERIFICAR_ASSINATURA = os.environ.get("FISCAL_VERIFICAR_ASSINATURA", "1") != "0"
+
+NS_DS = "http://www.w3.org/2000/09/xmldsig#"
+_C14N = {
+    "http://www.w3.org/TR/2001/REC-xml-c14n-20010315": {"exclusive": False, "with_comments": False},
+    "http://www.w3.org/TR/2001/REC-xml-c14n-20010315#WithComments": {"exclusive": False, "with_comments": True},
+    "http://www.w3.org/2001/10/xml-exc-c14n#": {"exclusive": True, "with_comments": False},
+    "http://www.w3.org/2001/10/xml-exc-c14n#WithComments": {"exclusive": True, "with_comments": True},
+}
+_ENVELOPED = "http://www.w3.org/2000/09/xmldsig#enveloped-signature"
+_DIGEST = {
+    "http://www.w3.org/2000/09/xmldsig#sha1": hashes.SHA1,
+    "http://www.w3.org/2001/04/xmlenc#sha256": hashes.SHA256,
+}
+_ASSINATURA = {
+    "http://www.w3.org/2000/09/xmldsig#rsa-sha1": hashes.SHA1,
+    "http://www.w3.org/2001/04/xmldsig-more#rsa-sha256": hashes.SHA256,
+}
+# Data do documento, para conferir se o certificado estava válido quando assinou
+_DATAS_DOCUMENTO = ("dhEmi", "dEmi", "dhEvento")
+# Elementos importados: precisam estar cobertos por uma assinatura
+_PRINCIPAIS = ("infNFe", "infCte")
+# otherName da ICP-Brasil com o CNPJ (pessoa jurídica) e com nascimento + CPF (pessoa física)
+_OID_CNPJ = x509.ObjectIdentifier("2.16.76.1.3.3")
+_OID_CPF = x509.ObjectIdentifier("2.16.76.1.3.1")
+_RE_DIGITOS = re.compile(rb"\d{11,}")
+_RE_DOCUMENTO_CN = re.compile(r":(\d{14}|\d{11})$")
+
+# Sem entidades externas nem rede: o XML vem de terceiros
+_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=False)
+
+
+@dataclass(slots=True)
+class ResultadoAssinatura:
+    valida: bool
+    motivo: str | None = None
+    impressao_digital: str | None = None
+    titular: str | None = None
+    cadeia_verificada: bool = False
+
+
+@dataclass(slots=True)
+class _Certificado:
+    chave: object
+    titular: str
+    valido_de: datetime
+    valido_ate: datetime
+    cadeia_valida: bool | None
+    motivo: str | None
+    # CNPJ ou CPF do titular, só dígitos
+    documento: str | None
+
+
+# impressão digital -> _Certificado (por processo)
+_certificados = {}
+_cadeia = None
+_cadeia_lock = threading.Lock()
+
+
+def _ds(tag):
+    return f"{{{NS_DS}}}{tag}"
+
+
+def _carregar_cadeia():
+    """X509Store com as ACs de PASTA_CADEIA, ou None se a pasta estiver vazia"""
+    global _cadeia
+    if _cadeia is None:
+        loja = crypto.X509Store()
+        total = 0
+        if os.path.isdir(PASTA_CADEIA):
+            for nome in sorted(os.listdir(PASTA_CADEIA)):
+                with open(os.path.join(PASTA_CADEIA, nome), "rb") as f:
+                    dados = f.read()
+                try:
+                    certificados = (x509.load_pem_x509_certificates(dados) if b"-----BEGIN" in dados
+                                    else [x509.load_der_x509_certificate(dados)])
+                except ValueError:
+                    logger.warning("Ignorando %s: não é um certificado", nome)
+                    continue
+                for certificado in certificados:
+                    loja.add_cert(crypto.X509.from_cryptography(certificado))
+                    total += 1
+        if not total:
+            logger.warning("Nenhuma AC em %s: a cadeia dos certificados não será verificada", PASTA_CADEIA)
+        _cadeia = loja if total else False
+    return _cadeia or None
+
+
+def _validar_cadeia(certificado):
+    with _cadeia_lock:
+        loja = _carregar_cadeia()
+        if loja is None:
+            return None, None
+        # A data do documento é conferida à parte; aqui vale só a cadeia, no início da validade
+        loja.set_time(certificado.not_valid_before_utc + timedelta(minutes=1))
+        try:
+            crypto.X509StoreContext(loja, crypto.X509.from_cryptography(certificado)).verify_certificate()
+            return True, None
+        except crypto.X509StoreContextError as e:
+            return False, f"cadeia do certificado inválida: {e}"
+
+
+def _documento_titular(cert):
+    """CNPJ (ou CPF) do titular pelos otherName da ICP-Brasil, ou pelo sufixo ":<número>" do CN"""
+    try:
+        nomes = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        for outro in nomes.get_values_for_type(x509.OtherName):
+            digitos = _RE_DIGITOS.search(outro.value)
+            if digitos and outro.type_id == _OID_CNPJ:
+                return digitos.group()[:14].decode()
+            if digitos and outro.type_id == _OID_CPF and len(digitos.group()) >= 19:
+                # Data de nascimento (8) + CPF (11) + ...
+                return digitos.group()[8:19].decode()
+    except x509.ExtensionNotFound:
+        pass
+    nomes_comuns = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+    correspondencia = _RE_DOCUMENTO_CN.search(nomes_comuns[0].value) if nomes_comuns else None
+    return correspondencia.group(1) if correspondencia else None
+
+
+def _certificado(der):
+    impressao_digital = hashlib.sha256(der).hexdigest()
+    certificado = _certificados.get(impressao_digital)
+    if certificado is None:
+        cert = x509.load_der_x509_certificate(der)
+        cadeia_valida, motivo = _validar_cadeia(cert)
+        certificado = _Certificado(
+            chave=cert.public_key(),
+            titular=cert.subject.rfc4514_string(),
+            valido_de=cert.not_valid_before_utc,
+            valido_ate=cert.not_valid_after_utc,
+            cadeia_valida=cadeia_valida,
+            motivo=motivo,
+            documento=_documento_titular(cert),
+        )
+        _certificados[impressao_digital] = certificado
+    return impressao_digital, certificado
+
+
+def _caminho(ancestral, elem):
+    """Posições dos filhos de `ancestral` até `elem`, ou None se elem não estiver dentro dele"""
+    posicoes = []
+    while elem is not ancestral:
+        pai = elem.getparent()
+        if pai is None:
+            return None
+        posicoes.append(pai.index(elem))
+        elem = pai
+    return posicoes[::-1]
+
+
+def _canonicalizar(elem, algoritmo, retirar=None):
+    """
+    C14N de `elem` como raiz de um documento novo, com os namespaces herdados
+    dos ancestrais (nsmap). Canonicalizar o subelemento direto no documento
+    original faz o libxml2 emitir xmlns="" nos netos. `retirar` (posições
+    a partir de elem) é a Signature do transform enveloped-signature.
+    """
+    opcoes = _C14N.get(algoritmo)
+    if opcoes is None:
+        raise ValueError(f"canonicalização não suportada: {algoritmo}")
+    if elem.getparent() is None and not retirar:
+        return etree.tostring(elem, method="c14n", **opcoes)
+
+    copia = etree.Element(elem.tag, attrib=dict(elem.attrib), nsmap=elem.nsmap)
+    copia.text = elem.text
+    copia.extend(copy.deepcopy(filho) for filho in elem)
+    if retirar:
+        alvo = copia
+        for posicao in retirar:
+            alvo = alvo[posicao]
+        # Só o elemento sai; o texto depois dele continua no documento
+        pai, anterior = alvo.getparent(), alvo.getprevious()
+        if alvo.tail:
+            if anterior is not None:
+                anterior.tail = (anterior.tail or "") + alvo.tail
+            else:
+                pai.text = (pai.text or "") + alvo.tail
+        pai.remove(alvo)
+    return etree.tostring(copia, method="c14n", **opcoes)
+
+
+def _data_documento(raiz):
+    for tag in _DATAS_DOCUMENTO:
+        texto = raiz.findtext(f".//{{*}}{tag}")
+        if texto:
+            try:
+                data = datetime.fromisoformat(texto.strip())
+            except ValueError:
+                return None
+            return data if data.tzinfo else data.replace(tzinfo=timezone.utc)
+    return None
+
+
+def _assinado(assinatura):
+    """Elemento com Id ao lado da Signature (infNFe em NFe, infEvento em evento...), ou None"""
+    pai = assinatura.getparent()
+    if pai is None:
+        return None
+    return next((e for e in pai if e is not assinatura and isinstance(e.tag, str) and e.get("Id")), None)
+
+
+def _documento_emitente(alvo):
+    """CNPJ/CPF de quem deveria ter assinado: emit de infNFe/infCte, autor de infEvento"""
+    emitente = alvo.find("{*}emit")
+    origem = emitente if emitente is not None else alvo
+    return (origem.findtext("{*}CNPJ") or origem.findtext("{*}CPF") or "").strip() or None
+
+
+def _mesmo_titular(documento_emitente, documento_certificado):
+    if not documento_certificado:
+        return False
+    if len(documento_emitente) == 14:
+        # A SEFAZ aceita certificado de outro estabelecimento da mesma empresa (raiz do CNPJ)
+        return len(documento_certificado) == 14 and documento_emitente[:8] == documento_certificado[:8]
+    return documento_emitente == documento_certificado
+
+
+def _verificar_assinatura(assinatura, data_documento):
+    info = assinatura.find(_ds("SignedInfo"))
+    referencia = info.find(_ds("Reference")) if info is not None else None
+    if referencia is None:
+        return ResultadoAssinatura(False, "Signature sem SignedInfo/Reference")
+
+    uri = referencia.get("URI", "")
+    alvo = _assinado(assinatura)
+    if alvo is None:
+        return ResultadoAssinatura(False, "Signature sem elemento assinado ao lado")
+    if uri != f"#{alvo.get('Id')}":
+        return ResultadoAssinatura(
+            False, f"Reference {uri or '(vazia)'} não aponta para {etree.QName(alvo).localname} {alvo.get('Id')}"
+        )
+
+    transformacoes = [t.get("Algorithm") for t in referencia.iterfind(f"{_ds('Transforms')}/{_ds('Transform')}")]
+    metodo_digest = _DIGEST.get(referencia.find(_ds("DigestMethod")).get("Algorithm"))
+    metodo_assinatura = _ASSINATURA.get(info.find(_ds("SignatureMethod")).get("Algorithm"))
+    if metodo_digest is None or metodo_assinatura is None:
+        return ResultadoAssinatura(False, "algoritmo de assinatura não suportado")
+
+    c14n = next((t for t in transformacoes if t in _C14N), "http://www.w3.org/TR/2001/REC-xml-c14n-20010315")
+    retirar = _caminho(alvo, assinatura) if _ENVELOPED in transformacoes else None
+    dados = _canonicalizar(alvo, c14n, retirar)
+
+    resumo = hashes.Hash(metodo_digest())
+    resumo.update(dados)
+    digest_informado = "".join((referencia.findtext(_ds("DigestValue")) or "").split())
+    if base64.b64encode(resumo.finalize()).decode() != digest_informado:
+        return ResultadoAssinatura(False, f"conteúdo de {uri or 'documento'} alterado após a assinatura")
+
+    certificado_b64 = assinatura.findtext(f".//{_ds('X509Certificate')}")
+    if not certificado_b64:
+        return ResultadoAssinatura(False, "assinatura sem X509Certificate")
+    impressao_digital, certificado = _certificado(base64.b64decode("".join(certificado_b64.split())))
+    # NF-e/CT-e só admitem RSA (rsa-sha1/rsa-sha256); chaves EC/DSA nem chegam ao verify
+    if not isinstance(certificado.chave, rsa.RSAPublicKey):
+        return ResultadoAssinatura(
+            False, f"certificado com chave {type(certificado.chave).__name__} (só RSA é aceito)",
+            impressao_digital, certificado.titular
+        )
+
+    try:
+        certificado.chave.verify(
+            base64.b64decode("".join((assinatura.findtext(_ds("SignatureValue")) or "").split())),
+            _canonicalizar(info, info.find(_ds("CanonicalizationMethod")).get("Algorithm")),
+            padding.PKCS1v15(),
+            metodo_assinatura(),
+        )
+    except InvalidSignature:
+        return ResultadoAssinatura(False, "SignatureValue não confere", impressao_digital, certificado.titular)
+
+    documento_emitente = _documento_emitente(alvo)
+    if documento_emitente and not _mesmo_titular(documento_emitente, certificado.documento):
+        return ResultadoAssinatura(
+            False, f"certificado de {certificado.documento or 'titular sem CNPJ/CPF'} não pertence ao emitente "
+                   f"{documento_emitente}", impressao_digital, certificado.titular
+        )
+
+    if certificado.cadeia_valida is False:
+        return ResultadoAssinatura(False, certificado.motivo, impressao_digital, certificado.titular)
+    if data_documento and not certificado.valido_de <= data_documento <= certificado.valido_ate:
+        return ResultadoAssinatura(
+            False, "certificado fora da validade na data do documento", impressao_digital, certificado.titular
+        )
+    return ResultadoAssinatura(
+        True, None, impressao_digital, certificado.titular, cadeia_verificada=certificado.cadeia_valida is True
+    )
+
+
+def verificar(conteudo):
+    """Confere todas as assinaturas do XML (bytes); o resultado é o da primeira (a do emitente)"""
+    try:
+        raiz = etree.fromstring(conteudo, _PARSER)
+    except etree.XMLSyntaxError as e:
+        return ResultadoAssinatura(False, f"XML inválido: {e}")
+
+    assinaturas = list(raiz.iter(_ds("Signature")))
+    if not assinaturas:
+        return ResultadoAssinatura(False, "documento sem assinatura digital")
+
+    data_documento = _data_documento(raiz)
+    resultado = None
+    for assinatura in assinaturas:
+        try:
+            atual = _verificar_assinatura(assinatura, data_documento)
+        except (ValueError, AttributeError, TypeError, UnsupportedAlgorithm) as e:
+            # ValueError: base64/certificado/C14N inválidos; AttributeError: Signature incompleta;
+            # TypeError/UnsupportedAlgorithm: chave ou algoritmo do certificado não suportados
+            atual = ResultadoAssinatura(False, f"assinatura malformada: {e}")
+        if not atual.valida:
+            return atual
+        resultado = resultado or atual
+
+    # O infNFe/infCte que a importação lê (o primeiro do documento) precisa ser o assinado
+    principal = next(raiz.iter(*(f"{{*}}{tag}" for tag in _PRINCIPAIS)), None)
+    if principal is not None and not any(_assinado(a) is principal for a in assinaturas):
+        return ResultadoAssinatura(False, f"{etree.QName(principal).localname} importado não está assinado")
+    return resultado
+
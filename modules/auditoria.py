@@ -0,0 +1,182 @@
+# modules/auditoria.py
+"""
+Auditoria dos totais da NF-e (ICMSTot) contra a soma dos itens.
+
+Os itens são lidos de nfe_itens em lotes colunares (DataFrames de
+TAMANHO_LOTE linhas), somados por chave com groupby e comparados com
+nfe_totais de uma vez, em arrays NumPy. Só as divergências acima da
+tolerância são gravadas em auditoria_totais, uma linha por nota e campo.
+
+A auditoria roda só sobre o banco ativo: um mês com notas já arquivadas
+(modules.arquivamento) é recusado com ValueError. A listagem das
+divergências lê também os arquivos anuais do período.
+
+A página do Streamlit fica em modules.painel_auditoria; este módulo não
+depende do Streamlit.
+
+Uso: python -m modules.auditoria [AAAA-MM] [--tolerancia centavos]
+"""
+import sys
+import time
+import argparse
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+from modules import database, arquivamento
+
+TAMANHO_LOTE = 200_000
+# Diferença aceita por campo, em centavos (arredondamento do emissor)
+TOLERANCIA_CENTAVOS = 1
+# Campo do ICMSTot -> (coluna de nfe_itens, coluna de nfe_totais)
+CAMPOS = {
+    "vProd": ("valor_produto", "valor_produtos"),
+    "vFrete": ("valor_frete", "valor_frete"),
+    "vICMS": ("valor_icms", "valor_icms"),
+    "vST": ("valor_icms_st", "valor_icms_st"),
+    "vIPI": ("valor_ipi", "valor_ipi"),
+    "vPIS": ("valor_pis", "valor_pis"),
+    "vCOFINS": ("valor_cofins", "valor_cofins"),
+}
+COLUNAS_ITENS = [coluna for coluna, _ in CAMPOS.values()]
+COLUNAS_TOTAIS = [coluna for _, coluna in CAMPOS.values()]
+
+SQL_DIVERGENCIA = """
+    INSERT INTO auditoria_totais (chave, campo, valor_itens, valor_declarado, diferenca, auditado_em)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def validar_mes(mes):
+    """Primeiro dia do mês "AAAA-MM"; ValueError se o formato ou o mês forem inválidos"""
+    return datetime.strptime(mes.strip(), "%Y-%m").date()
+
+
+def _periodo(mes):
+    """("AAAA-MM" do mês, "AAAA-MM" do seguinte); ValueError se o mês for inválido"""
+    inicio = validar_mes(mes)
+    seguinte = date(inicio.year + inicio.month // 12, inicio.month % 12 + 1, 1)
+    return inicio.strftime("%Y-%m"), seguinte.strftime("%Y-%m")
+
+
+def _filtro_mes(mes, alias):
+    """Condição por data de emissão ("AAAA-MM") sobre notas `alias`; sem mês, todas as notas"""
+    if not mes:
+        return "", ()
+    return f" WHERE {alias}.data_emissao >= ? AND {alias}.data_emissao < ?", _periodo(mes)
+
+
+def carregar_totais(conn, mes=None):
+    filtro, parametros = _filtro_mes(mes, "n")
+    return pd.read_sql_query(
+        f"SELECT t.chave, {', '.join('t.' + c for c in COLUNAS_TOTAIS)} "
+        f"FROM nfe_totais t JOIN notas n ON n.numero = t.chave{filtro}",
+        conn, params=parametros, index_col="chave"
+    )
+
+
+def somar_itens(conn, mes=None, tamanho_lote=TAMANHO_LOTE):
+    """Soma dos itens por chave, lendo nfe_itens em lotes de `tamanho_lote` linhas"""
+    filtro, parametros = _filtro_mes(mes, "n")
+    sql = f"SELECT i.chave, {', '.join('i.' + c for c in COLUNAS_ITENS)} FROM nfe_itens i"
+    if filtro:
+        sql += " JOIN notas n ON n.numero = i.chave" + filtro
+
+    # Uma nota pode ficar dividida entre dois lotes: as somas parciais são somadas de novo no final
+    parciais = [
+        lote.groupby("chave", sort=False).sum()
+        for lote in pd.read_sql_query(sql, conn, params=parametros, chunksize=tamanho_lote)
+    ]
+    if not parciais:
+        return pd.DataFrame(columns=COLUNAS_ITENS, dtype="int64")
+    return pd.concat(parciais).groupby(level=0, sort=False).sum()
+
+
+def auditar(mes=None, tolerancia=TOLERANCIA_CENTAVOS, tamanho_lote=TAMANHO_LOTE):
+    """
+    Audita as notas do mês (ou todas as do banco ativo) e substitui o
+    resultado anterior delas em auditoria_totais. Notas sem linha em
+    nfe_totais (gravadas antes dos totais serem guardados) ficam de fora.
+    ValueError se o mês tiver notas arquivadas.
+    """
+    if mes and arquivamento.periodo_arquivado(*_periodo(mes)):
+        raise ValueError(f"{mes} tem notas arquivadas; a auditoria roda só sobre o banco ativo")
+    inicio = time.perf_counter()
+    conn = database.get_connection()
+    try:
+        totais = carregar_totais(conn, mes)
+        somas = somar_itens(conn, mes, tamanho_lote).reindex(totais.index, fill_value=0)
+
+        valores_itens = somas[COLUNAS_ITENS].to_numpy(dtype=np.int64)
+        valores_declarados = totais[COLUNAS_TOTAIS].to_numpy(dtype=np.int64)
+        diferencas = valores_itens - valores_declarados
+        linhas, colunas = np.nonzero(np.abs(diferencas) > tolerancia)
+
+        nomes_campos = np.array(list(CAMPOS))
+        agora = datetime.now().isoformat()
+        divergencias = zip(
+            totais.index.to_numpy()[linhas].tolist(),
+            nomes_campos[colunas].tolist(),
+            valores_itens[linhas, colunas].tolist(),
+            valores_declarados[linhas, colunas].tolist(),
+            diferencas[linhas, colunas].tolist(),
+            [agora] * len(linhas),
+        )
+
+        filtro, parametros = _filtro_mes(mes, "n")
+        conn.execute(
+            "DELETE FROM auditoria_totais WHERE chave IN "
+            f"(SELECT t.chave FROM nfe_totais t JOIN notas n ON n.numero = t.chave{filtro})",
+            parametros
+        )
+        conn.executemany(SQL_DIVERGENCIA, divergencias)
+        conn.commit()
+
+        return {
+            "notas": len(totais),
+            "notas_divergentes": len(np.unique(linhas)),
+            "divergencias": len(linhas),
+            "tempo": round(time.perf_counter() - inicio, 2),
+        }
+    finally:
+        conn.close()
+
+
+def listar_divergencias(mes=None, limite=500):
+    """Divergências gravadas das notas do mês (ou de todas), inclusive as já arquivadas"""
+    filtro, parametros = _filtro_mes(mes, "n")
+    # Divergências arquivadas acompanham a nota no arquivo do ano
+    conn = arquivamento.conectar(*parametros)
+    try:
+        return pd.read_sql_query(
+            "SELECT n.numero AS chave, n.nome_emitente, n.data_emissao, a.campo, "
+            "a.valor_itens / 100.0 AS valor_itens, a.valor_declarado / 100.0 AS valor_declarado, "
+            "a.diferenca / 100.0 AS diferenca "
+            f"FROM historico_auditoria_totais a JOIN historico_notas n ON n.numero = a.chave{filtro} "
+            f"ORDER BY ABS(a.diferenca) DESC LIMIT {int(limite)}",
+            conn, params=parametros
+        )
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audita os totais da NF-e contra a soma dos itens")
+    parser.add_argument("mes", nargs="?", help="mês de emissão (AAAA-MM); sem ele, todas as notas")
+    parser.add_argument("--tolerancia", type=int, default=TOLERANCIA_CENTAVOS, help="diferença aceita, em centavos")
+    args = parser.parse_args(argv)
+
+    if args.mes:
+        try:
+            validar_mes(args.mes)
+        except ValueError:
+            parser.error("mês no formato AAAA-MM")
+    database.init_db()
+    resultado = auditar(args.mes, args.tolerancia)
+    print(
+        f"{resultado['notas']} nota(s) auditada(s) em {resultado['tempo']:.2f}s: "
+        f"{resultado['notas_divergentes']} com divergência ({resultado['divergencias']} campo(s))"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+# modules/backup.py
+"""
+Backup online do banco SQLite, sem parar a sincronização.
+
+A cópia usa a API de backup do SQLite em passos de PAGINAS_POR_PASSO
+páginas, com uma pausa entre os passos para os gravadores não ficarem
+esperando. Durante a cópia a conexão de origem mantém uma transação de
+leitura aberta: em WAL isso fixa um retrato do banco, então gravações
+concorrentes não fazem o backup recomeçar do zero (só o checkpoint do WAL
+espera até o fim da cópia).
+
+A cópia é conferida com PRAGMA integrity_check (ou quick_check), comprimida
+com gzip e só então aparece em PASTA_BACKUP com o nome definitivo; os
+MANTER backups mais recentes são mantidos e os demais removidos.
+
+Os arquivos anuais de modules.arquivamento só mudam quando o arquivamento
+roda e podem ser copiados normalmente.
+
+Uso: python -m modules.backup [--sem-compressao] [--rapido] [--verificar arquivo]
+"""
+import os
+import sys
+import gzip
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timedelta
+from modules import database, travas
+
+logger = logging.getLogger("fiscal.backup")
+
+PASTA_BACKUP = os.environ.get("FISCAL_PASTA_BACKUP", "data/backups")
+MANTER = int(os.environ.get("FISCAL_BACKUP_MANTER", "7"))
+# Intervalo mínimo entre backups agendados (o cron pode chamar de hora em hora)
+INTERVALO_HORAS = float(os.environ.get("FISCAL_BACKUP_INTERVALO_HORAS", "24"))
+# 256 páginas de 4 KiB = 1 MiB por passo; passos maiores saturam o disco e atrasam os commits
+PAGINAS_POR_PASSO = 256
+PAUSA_ENTRE_PASSOS = 0.01
+NIVEL_COMPRESSAO = 6
+PREFIXO = "db_"
+
+
+def _nome_backup(agora, comprimir):
+    return f"{PREFIXO}{agora.strftime('%Y%m%d_%H%M%S')}.sqlite3" + (".gz" if comprimir else "")
+
+
+def listar_backups():
+    """Caminhos dos backups existentes, do mais antigo para o mais recente"""
+    if not os.path.isdir(PASTA_BACKUP):
+        return []
+    return [
+        os.path.join(PASTA_BACKUP, nome) for nome in sorted(os.listdir(PASTA_BACKUP))
+        if nome.startswith(PREFIXO) and nome.endswith((".sqlite3", ".sqlite3.gz"))
+    ]
+
+
+def rotacionar(manter=MANTER):
+    """Remove os backups mais antigos, mantendo os `manter` mais recentes; retorna os removidos"""
+    backups = listar_backups()
+    removidos = backups[:-manter] if manter > 0 else []
+    for caminho in removidos:
+        os.remove(caminho)
+        logger.info("Backup antigo removido: %s", caminho)
+    return removidos
+
+
+def _conferir_trava(parar):
+    if parar is not None and parar.is_set():
+        raise ValueError("Backup interrompido: trava perdida")
+
+
+def copiar(destino, paginas=PAGINAS_POR_PASSO, pausa=PAUSA_ENTRE_PASSOS, parar=None):
+    """
+    Copia o banco para `destino` com a API de backup, em passos de `paginas`
+    páginas. Retorna (passos, páginas copiadas). Se o evento `parar` for
+    sinalizado, a cópia é abortada entre dois passos com ValueError.
+    """
+    passos = [0, 0]
+
+    def progresso(status, restantes, total):
+        passos[0] += 1
+        passos[1] = total
+        _conferir_trava(parar)
+        # Cede o banco aos gravadores entre um passo e outro
+        if restantes and pausa:
+            time.sleep(pausa)
+
+    origem = sqlite3.connect(database.DB_PATH, timeout=database.BUSY_TIMEOUT)
+    copia = sqlite3.connect(destino)
+    try:
+        # Transação de leitura aberta até o fim: retrato fixo do banco (WAL), sem reinícios do backup
+        origem.execute("BEGIN")
+        origem.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        origem.backup(copia, pages=paginas, progress=progresso)
+        origem.rollback()
+        # A cópia fica em modo rollback journal: é um arquivo só, pronto para restaurar
+        copia.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        copia.close()
+        origem.close()
+    return passos[0], passos[1]
+
+
+def verificar(caminho, rapido=False):
+    """Erros do integrity_check (ou quick_check) do banco em `caminho`, .gz ou não; lista vazia se íntegro"""
+    temporario = None
+    if caminho.endswith(".gz"):
+        temporario = caminho[:-3] + ".verificando"
+        with gzip.open(caminho, "rb") as entrada, open(temporario, "wb") as saida:
+            shutil.copyfileobj(entrada, saida, 1024 * 1024)
+    conn = sqlite3.connect(f"file:{temporario or caminho}?mode=ro", uri=True)
+    try:
+        linhas = conn.execute("PRAGMA quick_check" if rapido else "PRAGMA integrity_check").fetchall()
+    except sqlite3.DatabaseError as e:
+        linhas = [(str(e),)]
+    finally:
+        conn.close()
+        if temporario:
+            os.remove(temporario)
+    erros = [linha[0] for linha in linhas]
+    return [] if erros == ["ok"] else erros
+
+
+def comprimir(origem, destino, nivel=NIVEL_COMPRESSAO):
+    with open(origem, "rb") as entrada, gzip.open(destino, "wb", compresslevel=nivel) as saida:
+        shutil.copyfileobj(entrada, saida, 1024 * 1024)
+
+
+def executar_backup(comprimir_copia=True, rapido=False, manter=MANTER,
+                    paginas=PAGINAS_POR_PASSO, pausa=PAUSA_ENTRE_PASSOS, parar=None):
+    """
+    Gera um backup verificado em PASTA_BACKUP e aplica a rotação.
+    Retorna as métricas; se a verificação falhar, a cópia é descartada e
+    ValueError é lançado com os erros do integrity_check. O mesmo acontece
+    se o evento `parar` (trava perdida) for sinalizado entre as etapas.
+    """
+    os.makedirs(PASTA_BACKUP, exist_ok=True)
+    agora = datetime.now()
+    final = os.path.join(PASTA_BACKUP, _nome_backup(agora, comprimir_copia))
+    # Nome sem o prefixo: uma cópia interrompida não entra na rotação
+    parcial = os.path.join(PASTA_BACKUP, f"parcial_{agora.strftime('%Y%m%d_%H%M%S')}.sqlite3")
+    metricas = {"arquivo": final, "tamanho_banco": os.path.getsize(database.DB_PATH)}
+
+    try:
+        inicio = time.perf_counter()
+        metricas["passos"], metricas["paginas"] = copiar(parcial, paginas, pausa, parar)
+        metricas["tempo_copia"] = round(time.perf_counter() - inicio, 2)
+        _conferir_trava(parar)
+
+        inicio = time.perf_counter()
+        erros = verificar(parcial, rapido)
+        metricas["tempo_verificacao"] = round(time.perf_counter() - inicio, 2)
+        if erros:
+            raise ValueError(f"Backup reprovado no {'quick_check' if rapido else 'integrity_check'}: {'; '.join(erros[:5])}")
+        _conferir_trava(parar)
+
+        inicio = time.perf_counter()
+        if comprimir_copia:
+            comprimir(parcial, parcial + ".gz")
+            os.replace(parcial + ".gz", final)
+        else:
+            os.replace(parcial, final)
+        metricas["tempo_compressao"] = round(time.perf_counter() - inicio, 2)
+    finally:
+        for resto in (parcial, parcial + ".gz", parcial + "-journal"):
+            if os.path.exists(resto):
+                os.remove(resto)
+
+    metricas["tamanho_backup"] = os.path.getsize(final)
+    metricas["removidos"] = len(rotacionar(manter))
+    logger.info(
+        "Backup %s: %.1f MB -> %.1f MB, %d passos, cópia %.2fs, verificação %.2fs, compressão %.2fs",
+        final, metricas["tamanho_banco"] / 1024 / 1024, metricas["tamanho_backup"] / 1024 / 1024,
+        metricas["passos"], metricas["tempo_copia"], metricas["tempo_verificacao"], metricas["tempo_compressao"]
+    )
+    return metricas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backup online do banco SQLite")
+    parser.add_argument("--sem-compressao", action="store_true", help="grava a cópia sem gzip")
+    parser.add_argument("--rapido", action="store_true", help="verifica com quick_check em vez de integrity_check")
+    parser.add_argument("--manter", type=int, default=MANTER, help="quantos backups manter")
+    parser.add_argument("--paginas", type=int, default=PAGINAS_POR_PASSO, help="páginas copiadas por passo")
+    parser.add_argument("--pausa", type=float, default=PAUSA_ENTRE_PASSOS, help="pausa entre passos, em segundos")
+    parser.add_argument("--agendado", action="store_true",
+                        help=f"respeita o intervalo mínimo de {INTERVALO_HORAS:g} h desde o último backup (cron)")
+    parser.add_argument("--verificar", metavar="ARQUIVO", help="só confere um backup existente")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.verificar:
+        erros = verificar(args.verificar, args.rapido)
+        print("\n".join(erros) if erros else f"{args.verificar}: íntegro")
+        return 1 if erros else 0
+
+    database.init_db()
+    trava = travas.Trava("backup", intervalo_minimo=timedelta(hours=INTERVALO_HORAS) if args.agendado else None)
+    if not trava.adquirir():
+        print(trava.motivo)
+        return 0 if args.agendado else 1
+
+    concluido = False
+    try:
+        metricas = executar_backup(
+            not args.sem_compressao, args.rapido, args.manter, args.paginas, args.pausa, parar=trava.perdida
+        )
+        concluido = True
+    except ValueError as e:
+        print(e)
+        return 1
+    finally:
+        trava.liberar(concluida=concluido)
+
+    print(
+        f"Backup gravado em {metricas['arquivo']} "
+        f"({metricas['tamanho_banco'] / 1024 / 1024:.1f} MB -> {metricas['tamanho_backup'] / 1024 / 1024:.1f} MB): "
+        f"cópia {metricas['tempo_copia']:.2f}s em {metricas['passos']} passos, "
+        f"verificação {metricas['tempo_verificacao']:.2f}s, compressão {metricas['tempo_compressao']:.2f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# modules/busca_clientes.py
+"""
+Autocomplete de clientes por nome ou CNPJ.
+
+O índice é montado uma vez por processo (compartilhado por todas as sessões
+do Streamlit) a partir da tabela clientes: uma lista ordenada de nomes
+normalizados e outra de CNPJs só com dígitos, consultadas por prefixo com
+bisect. Cada cliente salvo entra no índice com `registrar`, sem recarregar
+a tabela.
+
+Uso (medição com clientes sintéticos): python -m modules.busca_clientes --benchmark 500000
+"""
+import re
+import sys
+import time
+import bisect
+import random
+import argparse
+import threading
+from modules import database
+from modules.texto import somente_digitos, normalizar, faixa_prefixo
+
+LIMITE_SUGESTOES = 10
+# Separa o nome do CNPJ na lista de nomes: homônimos continuam distintos e em ordem
+_SEPARADOR = "\x00"
+# Termo que parece CNPJ: só dígitos e pontuação de CNPJ
+_RE_TERMO_CNPJ = re.compile(r"^[\d./\-\s]+$")
+
+
+class IndiceClientes:
+    def __init__(self, linhas=()):
+        # digitos do CNPJ -> (cnpj como gravado, nome)
+        self.clientes = {}
+        for cnpj, nome in linhas:
+            digitos = somente_digitos(cnpj)
+            if digitos:
+                self.clientes[digitos] = (cnpj, nome or "")
+        self.nomes = sorted(normalizar(nome) + _SEPARADOR + digitos for digitos, (_, nome) in self.clientes.items())
+        self.cnpjs = sorted(self.clientes)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.clientes)
+
+    def buscar(self, cnpj):
+        """(cnpj, nome) do cliente já cadastrado, ou None"""
+        return self.clientes.get(somente_digitos(cnpj))
+
+    def registrar(self, cnpj, nome):
+        """Inclui ou atualiza um cliente (mesma semântica do INSERT OR REPLACE)"""
+        digitos = somente_digitos(cnpj)
+        if not digitos:
+            return
+        with self._lock:
+            anterior = self.clientes.get(digitos)
+            if anterior is not None:
+                chave = normalizar(anterior[1]) + _SEPARADOR + digitos
+                i = bisect.bisect_left(self.nomes, chave)
+                if i < len(self.nomes) and self.nomes[i] == chave:
+                    del self.nomes[i]
+            else:
+                bisect.insort(self.cnpjs, digitos)
+            self.clientes[digitos] = (cnpj, nome or "")
+            bisect.insort(self.nomes, normalizar(nome) + _SEPARADOR + digitos)
+
+    def sugerir(self, termo, limite=LIMITE_SUGESTOES):
+        """
+        Até `limite` (cnpj, nome): pelo início do CNPJ quando o termo só tem
+        dígitos e pontuação, senão pelo início do nome (sem acentos e caixa).
+        """
+        termo = (termo or "").strip()
+        if not termo:
+            return []
+
+        with self._lock:
+            if _RE_TERMO_CNPJ.match(termo):
+                prefixo = somente_digitos(termo)
+                if not prefixo:
+                    # Só pontuação ("./-"): nenhum prefixo de CNPJ para buscar
+                    return []
+                inicio, fim = faixa_prefixo(self.cnpjs, prefixo)
+                digitos = self.cnpjs[inicio:min(fim, inicio + limite)]
+            else:
+                inicio, fim = faixa_prefixo(self.nomes, normalizar(termo))
+                digitos = [chave.rsplit(_SEPARADOR, 1)[1] for chave in self.nomes[inicio:min(fim, inicio + limite)]]
+            return [self.clientes[d] for d in digitos]
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def indice():
+    """Índice compartilhado pelo processo, carregado na primeira chamada"""
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                conn = database.get_connection()
+                linhas = conn.execute("SELECT cnpj, nome FROM clientes").fetchall()
+                conn.close()
+                _indice = IndiceClientes(linhas)
+    return _indice
+
+
+def registrar(cnpj, nome):
+    """Atualiza o índice depois de gravar o cliente (só se ele já foi carregado)"""
+    if _indice is not None:
+        _indice.registrar(cnpj, nome)
+
+
+def sugerir(termo, limite=LIMITE_SUGESTOES):
+    return indice().sugerir(termo, limite)
+
+
+_PALAVRAS = ("comercio", "industria", "transportes", "alimentos", "sao", "joao", "maria", "brasil",
+             "distribuidora", "materiais", "construcao", "servicos", "paulista", "norte", "sul", "ltda")
+
+
+def medir(clientes=500_000, consultas=10_000, inclusoes=1_000, semente=42):
+    """
+    Custo do índice com `clientes` sintéticos: carga única, consulta de até
+    LIMITE_SUGESTOES por prefixo (nome e CNPJ, em partes iguais) e inclusão.
+    """
+    aleatorio = random.Random(semente)
+
+    def cliente():
+        nome = " ".join(aleatorio.choice(_PALAVRAS) for _ in range(3)).title()
+        return f"{aleatorio.randrange(10 ** 14):014d}", nome
+
+    linhas = [cliente() for _ in range(clientes)]
+    inicio = time.perf_counter()
+    indice_teste = IndiceClientes(linhas)
+    carga = time.perf_counter() - inicio
+
+    termos = []
+    for i in range(consultas):
+        cnpj, nome = aleatorio.choice(linhas)
+        termos.append(cnpj[:aleatorio.randint(2, 8)] if i % 2 else nome[:aleatorio.randint(2, 12)])
+    inicio = time.perf_counter()
+    for termo in termos:
+        indice_teste.sugerir(termo)
+    por_consulta = (time.perf_counter() - inicio) / consultas
+
+    novos = [cliente() for _ in range(inclusoes)]
+    inicio = time.perf_counter()
+    for cnpj, nome in novos:
+        indice_teste.registrar(cnpj, nome)
+    por_inclusao = (time.perf_counter() - inicio) / inclusoes
+
+    return {
+        "clientes": len(indice_teste) - inclusoes,
+        "carga_s": round(carga, 2),
+        "por_consulta_us": round(por_consulta * 1_000_000, 1),
+        "por_inclusao_ms": round(por_inclusao * 1000, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Índice de autocomplete de clientes")
+    parser.add_argument("--benchmark", type=int, metavar="N", default=500_000,
+                        help="mede carga, consulta e inclusão com N clientes sintéticos")
+    args = parser.parse_args(argv)
+    print(medir(args.benchmark))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
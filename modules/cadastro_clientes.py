@@ -1,8 +1,16 @@
+import html
 import streamlit as st
 import pandas as pd
-from modules import database
+from modules import database, busca_clientes
 from modules.cnpj_consulta import consultar_cnpj, validar_cnpj, formatar_cnpj
 
+def sugestoes_html(sugestoes):
+    itens = "".join(
+        f'<div class="autocomplete-suggestion"><b>{html.escape(nome)}</b> — {html.escape(cnpj)}</div>'
+        for cnpj, nome in sugestoes
+    )
+    return f'<div class="autocomplete-suggestions">{itens}</div>'
+
 def render():
     st.title("👥 Cadastro de Clientes")
 
@@ -46,6 +54,10 @@ def render():
             if validar_cnpj(cnpj_input):
                 cnpj_formatado = formatar_cnpj(cnpj_input)
                 
+                existente = busca_clientes.indice().buscar(cnpj_input)
+                if existente:
+                    st.info(f"ℹ️ Cliente já cadastrado como **{existente[1]}**; salvar atualiza o cadastro.")
+                
                 # Consulta automática
                 with st.spinner("🔍 Consultando dados na Receita Federal..."):
                     dados_cnpj = consultar_cnpj(cnpj_input)
@@ -105,6 +117,7 @@ def render():
                         VALUES (?, ?, ?, ?, ?)
                     """, (cnpj, nome, endereco, telefone, email))
                     conn.commit()
+                    busca_clientes.registrar(cnpj, nome)
                     st.success("✅ Cliente cadastrado com sucesso!")
                     
                     # Limpa os dados da sessão
@@ -129,6 +142,12 @@ def render():
     with col_search2:
         filtro_tipo = st.selectbox("Filtrar por:", ["Todos", "Nome", "CNPJ", "Telefone", "Email"])
     
+    # Sugestões pelo início do nome ou do CNPJ, direto do índice em memória
+    if termo and filtro_tipo in ("Todos", "Nome", "CNPJ"):
+        sugestoes = busca_clientes.sugerir(termo)
+        if sugestoes:
+            st.markdown(sugestoes_html(sugestoes), unsafe_allow_html=True)
+    
     # Query de busca com autocomplete
     if termo:
         if filtro_tipo == "Todos":
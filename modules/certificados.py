@@ -0,0 +1,95 @@
+# modules/certificados.py
+"""
+Registro de certificados A1 por estabelecimento (um .pfx por CNPJ).
+
+As senhas não são gravadas no banco: vêm da variável de ambiente
+CERT_PASSWORD_<CNPJ com 14 dígitos> ou, na falta dela, de CERT_PASSWORD.
+"""
+import os
+from datetime import datetime
+from modules import database
+from modules.texto import somente_digitos
+
+CERT_DIR = "data/certificados"
+
+
+def senha_certificado(cnpj):
+    cnpj = somente_digitos(cnpj)
+    return os.environ.get(f"CERT_PASSWORD_{cnpj}") or os.environ.get("CERT_PASSWORD")
+
+
+def registrar_certificado(pfx_bytes, senha, apelido=None, uf="35"):
+    """Valida o .pfx, grava em data/certificados/<cnpj>.pfx e registra no banco"""
+    from modules.sefaz_connector import carregar_certificado, extrair_cnpj_certificado
+
+    cert_pem_path, certificado = carregar_certificado(pfx_bytes, senha)
+    try:
+        cnpj = somente_digitos(extrair_cnpj_certificado(certificado))
+        validade = datetime.strptime(certificado.get_notAfter().decode(), "%Y%m%d%H%M%SZ").isoformat()
+    finally:
+        if os.path.exists(cert_pem_path):
+            os.unlink(cert_pem_path)
+
+    if not cnpj:
+        raise ValueError("Não foi possível extrair CNPJ do certificado")
+
+    os.makedirs(CERT_DIR, exist_ok=True)
+    caminho = os.path.join(CERT_DIR, f"{cnpj}.pfx")
+    with open(caminho, "wb") as f:
+        f.write(pfx_bytes)
+
+    conn = database.get_connection()
+    conn.execute("""
+        INSERT INTO certificados (cnpj, apelido, caminho, uf, validade, ativo, atualizado_em)
+        VALUES (?, ?, ?, ?, ?, 1, ?)
+        ON CONFLICT(cnpj) DO UPDATE SET
+            apelido = COALESCE(excluded.apelido, certificados.apelido),
+            caminho = excluded.caminho,
+            uf = excluded.uf,
+            validade = excluded.validade,
+            ativo = 1,
+            atualizado_em = excluded.atualizado_em
+    """, (cnpj, apelido, caminho, uf, validade, datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+    return cnpj
+
+
+def listar_certificados(somente_ativos=True):
+    conn = database.get_connection()
+    sql = "SELECT cnpj, apelido, caminho, uf, validade, ativo FROM certificados"
+    if somente_ativos:
+        sql += " WHERE ativo = 1"
+    linhas = conn.execute(sql + " ORDER BY apelido, cnpj").fetchall()
+    conn.close()
+    colunas = ("cnpj", "apelido", "caminho", "uf", "validade", "ativo")
+    return [dict(zip(colunas, linha)) for linha in linhas]
+
+
+def definir_ativo(cnpj, ativo):
+    conn = database.get_connection()
+    conn.execute("UPDATE certificados SET ativo = ? WHERE cnpj = ?", (1 if ativo else 0, somente_digitos(cnpj)))
+    conn.commit()
+    conn.close()
+
+
+def obter_ultimo_nsu(cnpj):
+    conn = database.get_connection()
+    linha = conn.execute("SELECT ultimo_nsu FROM nsu_controle WHERE cnpj = ?", (somente_digitos(cnpj),)).fetchone()
+    conn.close()
+    return linha[0] if linha else "000000000000000"
+
+
+def salvar_nsu(cnpj, ultimo_nsu, max_nsu):
+    """Checkpoint por CNPJ: a próxima consulta continua de onde esta parou"""
+    conn = database.get_connection()
+    conn.execute("""
+        INSERT INTO nsu_controle (cnpj, ultimo_nsu, max_nsu, atualizado_em)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(cnpj) DO UPDATE SET
+            ultimo_nsu = excluded.ultimo_nsu,
+            max_nsu = excluded.max_nsu,
+            atualizado_em = excluded.atualizado_em
+    """, (somente_digitos(cnpj), ultimo_nsu, max_nsu, datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
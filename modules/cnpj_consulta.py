@@ -1,4 +1,3 @@
-import requests
 import streamlit as st
 import json
 
@@ -6,6 +5,8 @@ def consultar_cnpj(cnpj):
     """
     Consulta dados do CNPJ na API da ReceitaWS (gratuita)
     """
+    import requests
+
     # Remove caracteres especiais do CNPJ
     cnpj_limpo = ''.join(filter(str.isdigit, cnpj))
     
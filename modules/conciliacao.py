@@ -0,0 +1,254 @@
+# modules/conciliacao.py
+"""
+Conciliação dos itens de NF-e (cProd/xProd/NCM do fornecedor) com o
+catálogo de mercadorias.
+
+O de-para confirmado fica em mapa_produtos_fornecedor, com chave primária
+(cnpj_fornecedor, codigo_fornecedor): um produto que já foi conciliado é
+resolvido por uma busca na chave, sem comparar descrições. A gravação dos
+itens (modules.nfe) já faz essa busca e guarda a mercadoria em
+nfe_itens.codigo_mercadoria; confirmar um de-para atualiza os itens já
+gravados. Os pendentes saem do índice (codigo_mercadoria, codigo_produto)
+com prefixo NULL, sem percorrer os itens conciliados. Para os demais,
+o catálogo é indexado em memória por NCM e por trigramas da descrição
+(blocking); só os poucos candidatos que compartilham NCM ou trigramas com o
+item são comparados com difflib.
+
+Uso: python -m modules.conciliacao [--automatico 0.95]
+"""
+import re
+import sys
+import argparse
+import difflib
+from collections import Counter, defaultdict
+from datetime import datetime
+from modules import database
+from modules.texto import somente_digitos, normalizar
+
+# Candidatos (pelos trigramas em comum) que passam para a comparação com difflib
+CANDIDATOS = 20
+# Trigramas presentes em mais que esta fração do catálogo não discriminam nada
+FRACAO_MAXIMA_TRIGRAMA = 0.05
+LIMITE_SUGESTOES = 3
+# Peso da descrição na nota final; o restante vem do NCM (8 dígitos = 1, posição de 4 dígitos = 0,5)
+PESO_DESCRICAO = 0.8
+_RE_NAO_ALFANUMERICO = re.compile(r"[^a-z0-9]+")
+
+SQL_PENDENTES = """
+    SELECT n.cnpj_emitente, i.codigo_produto, MIN(i.descricao), MIN(i.ncm), COUNT(*)
+    FROM nfe_itens i
+    JOIN notas n ON n.numero = i.chave
+    WHERE i.codigo_mercadoria IS NULL AND i.codigo_produto IS NOT NULL
+      AND n.cnpj_emitente IS NOT NULL
+      AND NOT EXISTS (
+          SELECT 1 FROM mapa_produtos_fornecedor m
+          WHERE m.cnpj_fornecedor = n.cnpj_emitente AND m.codigo_fornecedor = i.codigo_produto
+      )
+    GROUP BY n.cnpj_emitente, i.codigo_produto
+    ORDER BY COUNT(*) DESC
+"""
+
+# Itens já gravados do produto: os pendentes e os que apontavam para o de-para anterior
+SQL_ATRIBUIR = """
+    UPDATE nfe_itens SET codigo_mercadoria = ?
+    WHERE (codigo_mercadoria IS NULL OR codigo_mercadoria = ?) AND codigo_produto = ?
+      AND EXISTS (SELECT 1 FROM notas n WHERE n.numero = nfe_itens.chave AND n.cnpj_emitente = ?)
+"""
+
+SQL_CONFIRMAR = """
+    INSERT INTO mapa_produtos_fornecedor
+    (cnpj_fornecedor, codigo_fornecedor, codigo_mercadoria, similaridade, origem, confirmado_em)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(cnpj_fornecedor, codigo_fornecedor) DO UPDATE SET
+        codigo_mercadoria = excluded.codigo_mercadoria,
+        similaridade = excluded.similaridade,
+        origem = excluded.origem,
+        confirmado_em = excluded.confirmado_em
+"""
+
+
+def normalizar_descricao(texto):
+    """'Parafuso Sext. 1/4" Zincado' -> 'parafuso sext 1 4 zincado'"""
+    return _RE_NAO_ALFANUMERICO.sub(" ", normalizar(texto)).strip()
+
+
+def trigramas(texto):
+    texto = f" {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceCatalogo:
+    """Catálogo de mercadorias com blocos por NCM e índice invertido de trigramas"""
+
+    def __init__(self, mercadorias):
+        self.codigos = []
+        self.descricoes = []
+        self.ncms = []
+        self.por_ncm = defaultdict(list)
+        self.por_posicao = defaultdict(list)
+        self.por_trigrama = defaultdict(list)
+
+        for codigo, descricao, ncm in mercadorias:
+            i = len(self.codigos)
+            descricao = normalizar_descricao(descricao)
+            ncm = somente_digitos(ncm)
+            self.codigos.append(codigo)
+            self.descricoes.append(descricao)
+            self.ncms.append(ncm)
+            if ncm:
+                self.por_ncm[ncm].append(i)
+                self.por_posicao[ncm[:4]].append(i)
+            for trigrama in trigramas(descricao):
+                self.por_trigrama[trigrama].append(i)
+
+        # Trigramas comuns demais ("ao ", " de") só inflariam as listas de candidatos
+        maximo = max(10, int(len(self.codigos) * FRACAO_MAXIMA_TRIGRAMA))
+        self.por_trigrama = {t: posicoes for t, posicoes in self.por_trigrama.items() if len(posicoes) <= maximo}
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def _candidatos(self, descricao, ncm):
+        contagem = Counter()
+        for trigrama in trigramas(descricao):
+            contagem.update(self.por_trigrama.get(trigrama, ()))
+        candidatos = [i for i, _ in contagem.most_common(CANDIDATOS)]
+        # Mesmo NCM entra sempre, ainda que a descrição seja bem diferente
+        if ncm:
+            bloco = self.por_ncm.get(ncm) or self.por_posicao.get(ncm[:4], ())
+            candidatos.extend(bloco[:CANDIDATOS])
+        return dict.fromkeys(candidatos)
+
+    def _nota_ncm(self, i, ncm):
+        if ncm and self.ncms[i] == ncm:
+            return 1.0
+        if ncm and self.ncms[i][:4] == ncm[:4]:
+            return 0.5
+        return 0.0
+
+    def sugerir(self, descricao, ncm=None, limite=LIMITE_SUGESTOES):
+        """Até `limite` (codigo_mercadoria, similaridade de 0 a 1), da mais parecida para a menos"""
+        descricao = normalizar_descricao(descricao)
+        ncm = somente_digitos(ncm)
+        comparador = difflib.SequenceMatcher(autojunk=False)
+        comparador.set_seq2(descricao)
+
+        notas = []
+        for i in self._candidatos(descricao, ncm):
+            comparador.set_seq1(self.descricoes[i])
+            nota_ncm = (1 - PESO_DESCRICAO) * self._nota_ncm(i, ncm)
+            # quick_ratio é um limite superior barato de ratio: descarta quem não entra no top
+            if len(notas) >= limite and PESO_DESCRICAO * comparador.quick_ratio() + nota_ncm <= notas[-1][0]:
+                continue
+            nota = round(PESO_DESCRICAO * comparador.ratio() + nota_ncm, 4)
+            notas.append((nota, self.codigos[i]))
+            notas.sort(reverse=True)
+            del notas[limite:]
+
+        return [(codigo, nota) for nota, codigo in notas]
+
+
+def carregar_catalogo(conn):
+    return IndiceCatalogo(conn.execute("SELECT codigo, descricao, ncm FROM mercadorias WHERE codigo IS NOT NULL"))
+
+
+def mercadoria_do_fornecedor(conn, cnpj_fornecedor, codigo_fornecedor):
+    """codigo da mercadoria já conciliada (busca pela chave primária) ou None"""
+    linha = conn.execute(
+        "SELECT codigo_mercadoria FROM mapa_produtos_fornecedor WHERE cnpj_fornecedor = ? AND codigo_fornecedor = ?",
+        (cnpj_fornecedor, codigo_fornecedor)
+    ).fetchone()
+    return linha[0] if linha else None
+
+
+def confirmar(conn, cnpj_fornecedor, codigo_fornecedor, codigo_mercadoria, similaridade=None, origem="manual"):
+    """Grava o de-para e atualiza os itens já gravados (o commit fica a cargo de quem chama)"""
+    anterior = mercadoria_do_fornecedor(conn, cnpj_fornecedor, codigo_fornecedor)
+    conn.execute(SQL_CONFIRMAR, (
+        cnpj_fornecedor, codigo_fornecedor, codigo_mercadoria, similaridade, origem, datetime.now().isoformat()
+    ))
+    conn.execute(SQL_ATRIBUIR, (codigo_mercadoria, anterior, codigo_fornecedor, cnpj_fornecedor))
+
+
+def pendentes(conn, limite=None):
+    """
+    Produtos de fornecedor ainda sem de-para, um por (cnpj, cProd) com a
+    quantidade de itens: (cnpj, codigo, descricao, ncm, itens), os mais frequentes primeiro.
+    """
+    sql = SQL_PENDENTES + (f" LIMIT {int(limite)}" if limite else "")
+    return conn.execute(sql).fetchall()
+
+
+def conciliar(automatico=None, limite=None, indice=None):
+    """
+    Sugere mercadorias para os produtos pendentes. Com `automatico`, as
+    sugestões com similaridade >= automatico são confirmadas (origem
+    'automatico'); as demais ficam só como sugestão.
+    """
+    conn = database.get_connection()
+    try:
+        indice = indice or carregar_catalogo(conn)
+        resultado = {"pendentes": 0, "confirmados": 0, "sem_candidato": 0, "sugestoes": []}
+        if not len(indice):
+            return resultado
+
+        confirmados = []
+        # Fornecedores diferentes costumam repetir a mesma descrição
+        ja_calculadas = {}
+        for cnpj, codigo, descricao, ncm, itens in pendentes(conn, limite):
+            resultado["pendentes"] += 1
+            if (descricao, ncm) not in ja_calculadas:
+                ja_calculadas[(descricao, ncm)] = indice.sugerir(descricao, ncm)
+            sugestoes = ja_calculadas[(descricao, ncm)]
+            if not sugestoes:
+                resultado["sem_candidato"] += 1
+                continue
+            melhor, similaridade = sugestoes[0]
+            if automatico is not None and similaridade >= automatico:
+                confirmados.append((cnpj, codigo, melhor, similaridade))
+            else:
+                resultado["sugestoes"].append({
+                    "cnpj_fornecedor": cnpj,
+                    "codigo_fornecedor": codigo,
+                    "descricao": descricao,
+                    "ncm": ncm,
+                    "itens": itens,
+                    "sugestoes": sugestoes,
+                })
+
+        agora = datetime.now().isoformat()
+        conn.executemany(SQL_CONFIRMAR, (
+            (cnpj, codigo, mercadoria, similaridade, "automatico", agora)
+            for cnpj, codigo, mercadoria, similaridade in confirmados
+        ))
+        # Pendentes não tinham de-para anterior
+        conn.executemany(SQL_ATRIBUIR, (
+            (mercadoria, None, codigo, cnpj) for cnpj, codigo, mercadoria, _ in confirmados
+        ))
+        conn.commit()
+        resultado["confirmados"] = len(confirmados)
+        return resultado
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concilia itens de NF-e com o catálogo de mercadorias")
+    parser.add_argument("--automatico", type=float, help="confirma sugestões com similaridade maior ou igual (0 a 1)")
+    parser.add_argument("--limite", type=int, help="máximo de produtos pendentes a processar")
+    args = parser.parse_args(argv)
+
+    database.init_db()
+    resultado = conciliar(args.automatico, args.limite)
+    print(
+        f"{resultado['pendentes']} produto(s) pendente(s), {resultado['confirmados']} confirmado(s) "
+        f"automaticamente, {resultado['sem_candidato']} sem candidato"
+    )
+    for pendente in resultado["sugestoes"][:20]:
+        melhor, similaridade = pendente["sugestoes"][0]
+        print(f"  {pendente['cnpj_fornecedor']} {pendente['codigo_fornecedor']} "
+              f"{pendente['descricao']!r} -> {melhor} ({similaridade:.2f})")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# modules/cte.py
+"""
+Extração completa de CT-e (partes, municípios, componentes da prestação,
+quantidades de carga e NF-e referenciadas) com parser em streaming, e
+gravação em tabelas normalizadas para auditoria de frete.
+"""
+import io
+import xml.etree.ElementTree as ET
+from modules.texto import local
+from modules.registros import CTe, centavos, chave_acesso, quantidade, reais
+
+# Códigos de ide/toma3/toma (ou toma4/toma) -> parte que é o tomador
+TOMADORES = {"0": "remetente", "1": "expedidor", "2": "recebedor", "3": "destinatario"}
+
+_PARTES = ("emit", "rem", "exped", "receb", "dest", "toma4")
+_CAMPOS_IDE = {
+    "nCT": "numero",
+    "serie": "serie",
+    "dhEmi": "data_emissao",
+    "cMunIni": "cmun_origem",
+    "xMunIni": "mun_origem",
+    "UFIni": "uf_origem",
+    "cMunFim": "cmun_destino",
+    "xMunFim": "mun_destino",
+    "UFFim": "uf_destino",
+}
+
+
+def extrair_cte(origem):
+    """
+    Extrai o CT-e (registro CTe) com ET.iterparse, sem montar a árvore inteira.
+    `origem` pode ser um caminho, bytes ou um arquivo binário aberto.
+    """
+    if isinstance(origem, (bytes, bytearray)):
+        origem = io.BytesIO(origem)
+
+    dados = CTe(chave=None)
+    partes = {parte: {} for parte in _PARTES}
+
+    caminho = []
+    grupo = None
+    for evento, elem in ET.iterparse(origem, events=("start", "end")):
+        tag = local(elem.tag)
+
+        if evento == "start":
+            caminho.append(tag)
+            if tag == "infCte" and dados.chave is None:
+                dados.chave = chave_acesso(elem.get("Id"))
+            elif tag in ("Comp", "infQ"):
+                grupo = {}
+            continue
+
+        caminho.pop()
+        pai = caminho[-1] if caminho else None
+        texto = elem.text.strip() if elem.text else None
+
+        if tag == "Comp" and grupo is not None:
+            dados.componentes.append((grupo.get("xNome"), centavos(grupo.get("vComp"))))
+            grupo = None
+        elif tag == "infQ" and grupo is not None:
+            dados.cargas.append((grupo.get("cUnid"), grupo.get("tpMed"), quantidade(grupo.get("qCarga"))))
+            grupo = None
+        elif pai in ("Comp", "infQ") and grupo is not None:
+            grupo[tag] = texto
+        elif pai == "ide" and tag in _CAMPOS_IDE:
+            setattr(dados, _CAMPOS_IDE[tag], texto)
+        elif tag == "toma" and pai in ("toma3", "toma03", "toma4"):
+            dados.codigo_tomador = texto
+        elif pai in partes and tag in ("CNPJ", "CPF", "xNome"):
+            partes[pai][tag] = texto
+        elif pai == "vPrest" and tag == "vTPrest":
+            dados.valor_prestacao_centavos = centavos(texto)
+        elif pai == "vPrest" and tag == "vRec":
+            dados.valor_receber_centavos = centavos(texto)
+        elif pai == "infCarga" and tag == "vCarga":
+            dados.valor_carga_centavos = centavos(texto)
+        elif pai == "infCarga" and tag == "proPred":
+            dados.produto_predominante = texto
+        elif pai == "infNFe" and tag == "chave":
+            dados.nfes.append(texto)
+
+        # Libera a memória dos elementos já processados
+        if tag not in _PARTES:
+            elem.clear()
+
+    def documento(parte):
+        return partes[parte].get("CNPJ") or partes[parte].get("CPF")
+
+    dados.cnpj_emitente = documento("emit")
+    dados.nome_emitente = partes["emit"].get("xNome")
+    dados.cnpj_remetente = documento("rem")
+    dados.nome_remetente = partes["rem"].get("xNome")
+    dados.cnpj_destinatario = documento("dest")
+    dados.nome_destinatario = partes["dest"].get("xNome")
+
+    # toma4 traz o tomador explicitamente; toma3 aponta para uma das partes
+    if partes["toma4"]:
+        dados.tipo_tomador = "outros"
+        dados.cnpj_tomador = documento("toma4")
+        dados.nome_tomador = partes["toma4"].get("xNome")
+    else:
+        tipo = TOMADORES.get(dados.codigo_tomador)
+        parte = {"remetente": "rem", "expedidor": "exped", "recebedor": "receb", "destinatario": "dest"}.get(tipo)
+        dados.tipo_tomador = tipo
+        dados.cnpj_tomador = documento(parte) if parte else None
+        dados.nome_tomador = partes[parte].get("xNome") if parte else None
+
+    if dados.chave is None:
+        raise ValueError("XML sem infCte ou com chave de acesso inválida")
+
+    return dados
+
+
+def salvar_cte(conn, dados):
+    """Grava o CT-e e suas tabelas filhas (o commit fica a cargo de quem chama)"""
+    chave = dados.chave
+    conn.execute("""
+        INSERT OR REPLACE INTO ctes (
+            chave, numero, serie, data_emissao,
+            cnpj_emitente, nome_emitente, cnpj_remetente, nome_remetente,
+            cnpj_destinatario, nome_destinatario, cnpj_tomador, nome_tomador, tipo_tomador,
+            cmun_origem, mun_origem, uf_origem, cmun_destino, mun_destino, uf_destino,
+            valor_prestacao, valor_receber, valor_carga, produto_predominante, qtd_nfes
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, dados.como_linha())
+
+    for tabela in ("cte_componentes", "cte_cargas", "cte_nfes"):
+        conn.execute(f"DELETE FROM {tabela} WHERE chave_cte = ?", (chave,))
+
+    # As tabelas filhas guardam valores em reais, como ctes
+    conn.executemany(
+        "INSERT INTO cte_componentes (chave_cte, nome, valor) VALUES (?, ?, ?)",
+        ((chave, nome, reais(valor)) for nome, valor in dados.componentes)
+    )
+    conn.executemany(
+        "INSERT INTO cte_cargas (chave_cte, unidade, tipo_medida, quantidade) VALUES (?, ?, ?, ?)",
+        ((chave, unidade, tipo, qtd) for unidade, tipo, qtd in dados.cargas)
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO cte_nfes (chave_nfe, chave_cte) VALUES (?, ?)",
+        ((chave_nfe, chave) for chave_nfe in dados.nfes)
+    )
+
+
+def custo_frete_por_nfe(conn, chaves_nfe, historico=False):
+    """
+    Frete por NF-e em uma única consulta indexada. O valor de cada CT-e é
+    rateado igualmente entre as NF-e que ele transporta (ctes.qtd_nfes).
+    Com `historico`, `conn` vem de arquivamento.conectar e a consulta
+    inclui os CT-e já arquivados (visões historico_*).
+    """
+    chaves_nfe = list(chaves_nfe)
+    if not chaves_nfe:
+        return []
+    prefixo = "historico_" if historico else ""
+    marcadores = ", ".join("?" * len(chaves_nfe))
+    return conn.execute(f"""
+        SELECT cn.chave_nfe,
+               COUNT(*) AS qtd_ctes,
+               SUM(c.valor_prestacao) AS frete_total,
+               SUM(c.valor_prestacao / MAX(c.qtd_nfes, 1)) AS frete_rateado
+        FROM {prefixo}cte_nfes cn
+        JOIN {prefixo}ctes c ON c.chave = cn.chave_cte
+        WHERE cn.chave_nfe IN ({marcadores})
+        GROUP BY cn.chave_nfe
+    """, chaves_nfe).fetchall()
@@ -1,53 +1,234 @@
 import sqlite3
 import os
+import re
+import time
+import logging
+import threading
+from modules import migracoes
 
 DB_PATH = "data/db.sqlite3"
 
+# Instruções mais lentas que este limite (ms) são registradas com o plano de execução
+SLOW_QUERY_MS = float(os.environ.get("FISCAL_SLOW_QUERY_MS", "100"))
+
+logger = logging.getLogger("fiscal.sql")
+
+_estatisticas = {}
+_estatisticas_lock = threading.Lock()
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LISTA = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_RE_ESPACOS = re.compile(r"\s+")
+_EXPLICAVEIS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def normalizar_consulta(sql):
+    """Normaliza o SQL para agregação: literais viram ? e listas IN são colapsadas"""
+    sql = _RE_STRING.sub("?", sql)
+    sql = _RE_NUMERO.sub("?", sql)
+    sql = _RE_ESPACOS.sub(" ", sql).strip()
+    return _RE_LISTA.sub("IN (?, ...)", sql)
+
+
+def _formato_parametros(parametros):
+    """Descreve o formato dos parâmetros sem expor os valores"""
+    if isinstance(parametros, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parametros.items()) + "}"
+    if not parametros:
+        return "()"
+    return "(" + ", ".join(type(v).__name__ for v in parametros) + ")"
+
+
+def _plano_execucao(conn, sql, parametros):
+    """Executa EXPLAIN QUERY PLAN com um cursor sem monitoramento"""
+    if not sql.lstrip().upper().startswith(_EXPLICAVEIS):
+        return []
+    try:
+        cur = conn.cursor(sqlite3.Cursor)
+        linhas = cur.execute("EXPLAIN QUERY PLAN " + sql, parametros).fetchall()
+        cur.close()
+        return [linha[-1] for linha in linhas]
+    except sqlite3.Error as e:
+        return [f"plano indisponível: {e}"]
+
+
+def _registrar(conn, sql, parametros, duracao, linhas=None):
+    """Agrega a execução por consulta normalizada e registra as lentas"""
+    duracao_ms = duracao * 1000
+    chave = normalizar_consulta(sql)
+    lenta = duracao_ms >= SLOW_QUERY_MS
+
+    plano = None
+    if lenta:
+        plano = _plano_execucao(conn, sql, parametros)
+        formato = _formato_parametros(parametros)
+        if linhas is not None:
+            formato = f"{linhas} x {formato}"
+        logger.warning(
+            "Consulta lenta (%.1f ms): %s | parâmetros: %s | plano: %s",
+            duracao_ms, chave, formato, " ; ".join(plano) or "N/A"
+        )
+
+    with _estatisticas_lock:
+        est = _estatisticas.get(chave)
+        if est is None:
+            est = _estatisticas[chave] = {
+                "consulta": chave,
+                "execucoes": 0,
+                "lentas": 0,
+                "tempo_total_ms": 0.0,
+                "tempo_max_ms": 0.0,
+                "plano": None,
+                "varredura_completa": False,
+            }
+        est["execucoes"] += 1
+        est["tempo_total_ms"] += duracao_ms
+        est["tempo_max_ms"] = max(est["tempo_max_ms"], duracao_ms)
+        if lenta:
+            est["lentas"] += 1
+            est["plano"] = plano
+            # "SCAN tabela" sem índice indica candidato a novo índice
+            est["varredura_completa"] = any(
+                p.startswith("SCAN") and "USING" not in p for p in plano
+            )
+
+
+def estatisticas_consultas(ordenar_por="tempo_total_ms", limite=20):
+    """Retorna as consultas agregadas, das mais custosas para as menos custosas"""
+    with _estatisticas_lock:
+        dados = [dict(est) for est in _estatisticas.values()]
+    for est in dados:
+        est["tempo_medio_ms"] = est["tempo_total_ms"] / est["execucoes"]
+    dados.sort(key=lambda est: est[ordenar_por], reverse=True)
+    return dados[:limite] if limite else dados
+
+
+def limpar_estatisticas():
+    with _estatisticas_lock:
+        _estatisticas.clear()
+
+
+class CursorMonitorado(sqlite3.Cursor):
+    """
+    Cursor que cronometra cada instrução, incluindo a leitura das linhas.
+    A medição termina ao esgotar as linhas, no primeiro fetchone (execute +
+    primeira linha, o uso comum), no próximo execute, no close ou quando o
+    cursor é descartado.
+    """
+
+    _consulta = None
+
+    def _finalizar(self):
+        if self._consulta is not None:
+            sql, parametros, duracao, linhas = self._consulta
+            self._consulta = None
+            _registrar(self.connection, sql, parametros, duracao, linhas)
+
+    def _acumular(self, inicio, concluida):
+        if self._consulta is not None:
+            sql, parametros, duracao, linhas = self._consulta
+            self._consulta = (sql, parametros, duracao + time.perf_counter() - inicio, linhas)
+            if concluida:
+                self._finalizar()
+
+    def execute(self, sql, parameters=()):
+        self._finalizar()
+        inicio = time.perf_counter()
+        super().execute(sql, parameters)
+        self._consulta = (sql, parameters, time.perf_counter() - inicio, None)
+        # Instruções sem linhas de retorno já terminaram
+        if self.description is None:
+            self._finalizar()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finalizar()
+        contagem = [0, ()]
+
+        def contar(seq):
+            for parametros in seq:
+                if not contagem[0]:
+                    contagem[1] = parametros
+                contagem[0] += 1
+                yield parametros
+
+        inicio = time.perf_counter()
+        super().executemany(sql, contar(seq_of_parameters))
+        _registrar(self.connection, sql, contagem[1], time.perf_counter() - inicio, contagem[0])
+        return self
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        linha = super().fetchone()
+        self._acumular(inicio, True)
+        return linha
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        tamanho = self.arraysize if size is None else size
+        linhas = super().fetchmany(tamanho)
+        self._acumular(inicio, len(linhas) < tamanho)
+        return linhas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        linhas = super().fetchall()
+        self._acumular(inicio, True)
+        return linhas
+
+    def __next__(self):
+        inicio = time.perf_counter()
+        try:
+            linha = super().__next__()
+        except StopIteration:
+            self._acumular(inicio, True)
+            raise
+        self._acumular(inicio, False)
+        return linha
+
+    def close(self):
+        self._finalizar()
+        super().close()
+
+    def __del__(self):
+        # Cursor abandonado antes de ler todas as linhas (ex.: iteração interrompida)
+        try:
+            self._finalizar()
+        except sqlite3.Error:
+            pass
+
+
+class ConexaoMonitorada(sqlite3.Connection):
+    """Conexão cujos cursores registram o tempo de cada instrução"""
+
+    def cursor(self, factory=CursorMonitorado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Espera pelo lock de escrita quando várias threads/processos gravam ao mesmo tempo
+BUSY_TIMEOUT = 30
+
 def get_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    return sqlite3.connect(DB_PATH, check_same_thread=False, timeout=BUSY_TIMEOUT, factory=ConexaoMonitorada)
 
 # Alias para compatibilidade com código existente
 def conectar():
     return get_connection()
 
 def init_db():
+    """Cria o banco, se necessário, e aplica as migrações pendentes"""
     os.makedirs("data", exist_ok=True)
     conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS clientes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            cnpj TEXT UNIQUE,
-            nome TEXT,
-            endereco TEXT,
-            telefone TEXT,
-            email TEXT
-        )
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS mercadorias (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            codigo TEXT UNIQUE,
-            descricao TEXT,
-            ncm TEXT,
-            unidade TEXT,
-            valor_unit REAL
-        )
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS notas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tipo TEXT,
-            numero TEXT,
-            cnpj_emitente TEXT,
-            nome_emitente TEXT,
-            valor_total REAL,
-            data_sincronizacao TEXT
-        )
-    """)
-
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    try:
+        # WAL: leitores não bloqueiam o gravador (sincronizações em paralelo)
+        conn.execute("PRAGMA journal_mode=WAL")
+        migracoes.aplicar_migracoes(conn)
+    finally:
+        conn.close()
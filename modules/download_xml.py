@@ -0,0 +1,277 @@
+# modules/download_xml.py
+"""
+Fila de download do XML completo (procNFe) das notas que chegaram apenas
+como resumo (resNFe), via consChNFe da DistribuicaoDFe.
+
+As chaves são baixadas em paralelo, respeitando o limite de taxa de cada
+CNPJ (agendador_sefaz), e as notas são atualizadas em lotes. Só erros
+de fato contam como tentativa (até MAX_TENTATIVAS, com espera
+exponencial); adiamentos da SEFAZ (656, circuito aberto, 5xx) e notas
+ainda sem manifestação são reagendados com espera longa, sem gastar
+tentativas.
+
+Uso em segundo plano: python -m modules.download_xml [--enfileirar-resumos CNPJ]
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from modules import database, certificados, travas, nfe, texto
+
+MAX_PARALELO = int(os.environ.get("SEFAZ_DOWNLOAD_PARALELO", "4"))
+TAMANHO_LOTE = 50
+MAX_TENTATIVAS = 5
+# Consumo indevido (656) bloqueia o CNPJ por 1 hora
+ESPERA_ADIADO = timedelta(hours=1)
+# O destinatário costuma manifestar em dias, não em minutos
+ESPERA_MANIFESTACAO = timedelta(hours=12)
+XML_DIR = "data/xmls"
+
+
+def enfileirar(conn, chaves_cnpj):
+    """Adiciona (chave, cnpj_interessado) à fila, ignorando chaves já enfileiradas"""
+    conn.executemany("""
+        INSERT OR IGNORE INTO fila_download (chave, cnpj, status, tentativas, proxima_tentativa)
+        VALUES (?, ?, 'pendente', 0, ?)
+    """, (
+        (chave, texto.somente_digitos(cnpj), datetime.now().isoformat())
+        for chave, cnpj in chaves_cnpj
+        if chave and chave != "N/A"
+    ))
+
+
+def enfileirar_resumos_pendentes(cnpj):
+    """Enfileira todos os resumos já gravados em notas para o CNPJ informado"""
+    conn = database.get_connection()
+    cur = conn.execute("""
+        INSERT OR IGNORE INTO fila_download (chave, cnpj, status, tentativas, proxima_tentativa)
+        SELECT numero, ?, 'pendente', 0, ?
+        FROM notas
+        WHERE tipo = 'NFe_Resumo' AND situacao = 'autorizada'
+    """, (texto.somente_digitos(cnpj), datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+    return cur.rowcount
+
+
+def contagem_por_status():
+    conn = database.get_connection()
+    linhas = conn.execute("SELECT status, COUNT(*) FROM fila_download GROUP BY status").fetchall()
+    conn.close()
+    return dict(linhas)
+
+
+def listar_pendentes(limite=1000):
+    conn = database.get_connection()
+    linhas = conn.execute("""
+        SELECT chave, cnpj, tentativas FROM fila_download
+        WHERE status IN ('pendente', 'erro', 'adiado', 'aguardando_manifestacao')
+          AND proxima_tentativa <= ? AND tentativas < ?
+        ORDER BY proxima_tentativa
+        LIMIT ?
+    """, (datetime.now().isoformat(), MAX_TENTATIVAS, limite)).fetchall()
+    conn.close()
+    return linhas
+
+
+def _espera(tentativa):
+    """Espera exponencial após um erro: 2, 4, 8... minutos (máx. 60)"""
+    return timedelta(minutes=min(2 ** tentativa, 60))
+
+
+def reagendar(status, tentativas, agora):
+    """(status na fila, tentativas, próxima tentativa) para o resultado de baixar_chave"""
+    if status == "erro":
+        return "erro", tentativas + 1, agora + _espera(tentativas + 1)
+    if status == "transitorio":
+        return "adiado", tentativas, agora + ESPERA_ADIADO
+    if status == "aguardando_manifestacao":
+        return status, tentativas, agora + ESPERA_MANIFESTACAO
+    # baixado, cancelada, denegada: saem da fila
+    return status, tentativas, agora
+
+
+def baixar_chave(cert_pem_path, cnpj, chave, ambiente="producao", uf="35"):
+    """
+    Consulta uma chave e retorna (status, dados). status é "baixado" (dados =
+    (NotaFiscal, xml)), "aguardando_manifestacao", "cancelada", "denegada",
+    "transitorio" ou "erro" (dados = mensagem).
+    """
+    import requests
+    import xml.etree.ElementTree as ET
+    from modules.agendador_sefaz import ConsultaAdiada, CONS_CHAVE
+    from modules.sefaz_connector import (
+        requisitar_distribuicao_dfe, descompactar_doczip, processar_nfe_completa, _buscar, _texto
+    )
+
+    try:
+        xml_resposta = requisitar_distribuicao_dfe(
+            cert_pem_path, cnpj, f"<consChNFe><chNFe>{chave}</chNFe></consChNFe>", ambiente, uf, CONS_CHAVE
+        )
+    except ConsultaAdiada as e:
+        return "transitorio", str(e)
+    except requests.exceptions.HTTPError as e:
+        status_http = e.response.status_code if e.response is not None else 0
+        return ("transitorio" if status_http >= 500 else "erro"), f"HTTP {status_http}"
+    except requests.exceptions.RequestException as e:
+        return "transitorio", f"Erro na requisição: {e}"
+
+    try:
+        ret = _buscar(ET.fromstring(xml_resposta), 'retDistDFeInt')
+        if ret is None:
+            return "transitorio", "Resposta inválida da SEFAZ"
+        codigo_status = _texto(ret, 'cStat')
+        if codigo_status == "656":
+            return "transitorio", "Consumo indevido (656)"
+        if codigo_status == "653":
+            return "cancelada", "NF-e cancelada, arquivo indisponível (653)"
+        if codigo_status == "654":
+            return "denegada", "NF-e denegada, arquivo indisponível (654)"
+        if codigo_status != "138":
+            return "erro", f"{codigo_status} - {_texto(ret, 'xMotivo')}"
+
+        for doc in ret.iter():
+            if not doc.tag.endswith("docZip") or not doc.text:
+                continue
+            if 'procNFe' in doc.get('schema', ''):
+                conteudo_xml = descompactar_doczip(doc.text)
+                return "baixado", (processar_nfe_completa(conteudo_xml, salvar=False), conteudo_xml)
+
+        # Sem manifestação do destinatário a SEFAZ devolve apenas o resumo
+        return "aguardando_manifestacao", "Apenas resumo disponível (manifestação pendente)"
+
+    except Exception as e:
+        return "erro", f"Erro ao processar resposta: {e}"
+
+
+def _baixar(cert_pem_path, certificado, chave, ambiente):
+    # Retentativas de transporte e espera entre chamadas ficam com o agendador_sefaz
+    status, dados = baixar_chave(cert_pem_path, certificado["cnpj"], chave, ambiente, certificado.get("uf") or "35")
+    return chave, status, dados
+
+
+def _gravar_lote(resultados):
+    """Atualiza notas e fila em uma única transação"""
+    agora = datetime.now()
+    baixados = [(chave, dados) for chave, status, dados, _ in resultados if status == "baixado"]
+
+    os.makedirs(XML_DIR, exist_ok=True)
+    for chave, (_, conteudo_xml) in baixados:
+        with open(os.path.join(XML_DIR, f"{chave}-procNFe.xml"), "w", encoding="utf-8") as f:
+            f.write(conteudo_xml)
+
+    conn = database.get_connection()
+    try:
+        nfe.salvar_lote(conn, [nota for _, (nota, _) in baixados], agora.isoformat())
+        conn.executemany(
+            "UPDATE notas SET situacao = ? WHERE numero = ?",
+            ((status, chave) for chave, status, _, _ in resultados if status in ("cancelada", "denegada"))
+        )
+        linhas_fila = []
+        for chave, status, dados, tentativas in resultados:
+            status_fila, tentativas, proxima = reagendar(status, tentativas, agora)
+            linhas_fila.append((
+                status_fila, tentativas, proxima.isoformat(),
+                None if status == "baixado" else dados, agora.isoformat(), chave,
+            ))
+        conn.executemany("""
+            UPDATE fila_download SET
+                status = ?,
+                tentativas = ?,
+                proxima_tentativa = ?,
+                ultimo_erro = ?,
+                atualizado_em = ?
+            WHERE chave = ?
+        """, linhas_fila)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def executar_downloads(ambiente="producao", limite=1000, max_paralelo=MAX_PARALELO):
+    """Baixa os XMLs pendentes em paralelo e retorna a contagem por status"""
+    # Uma execução por vez, mesmo com várias réplicas usando o mesmo banco
+    trava = travas.Trava("download_xml")
+    if not trava.adquirir():
+        return {"contagem": {}, "tempo": 0.0, "erro": trava.motivo}
+    try:
+        return _executar_downloads(ambiente, limite, max_paralelo, parar=trava.perdida)
+    finally:
+        trava.liberar()
+
+
+def _executar_downloads(ambiente, limite, max_paralelo, parar=None):
+    from modules.sefaz_connector import carregar_certificado
+
+    inicio = time.perf_counter()
+    pendentes = listar_pendentes(limite)
+    registros = {r["cnpj"]: r for r in certificados.listar_certificados()}
+    contagem = {}
+
+    # Um PEM temporário por CNPJ, compartilhado pelas threads
+    pems = {}
+    try:
+        for cnpj in {p[1] for p in pendentes}:
+            senha = certificados.senha_certificado(cnpj)
+            if cnpj in registros and senha:
+                with open(registros[cnpj]["caminho"], "rb") as f:
+                    pems[cnpj], _ = carregar_certificado(f.read(), senha)
+
+        tentativas = {chave: t for chave, _, t in pendentes}
+        lote = []
+        with ThreadPoolExecutor(max_workers=max_paralelo) as executor:
+            futuros = [
+                executor.submit(_baixar, pems[cnpj], registros[cnpj], chave, ambiente)
+                for chave, cnpj, _ in pendentes
+                if cnpj in pems
+            ]
+            for futuro in as_completed(futuros):
+                chave, status, dados = futuro.result()
+                contagem[status] = contagem.get(status, 0) + 1
+                lote.append((chave, status, dados, tentativas[chave]))
+                if len(lote) >= TAMANHO_LOTE:
+                    _gravar_lote(lote)
+                    lote = []
+                if parar is not None and parar.is_set():
+                    # Outra réplica assumiu a fila: o que não foi baixado continua pendente
+                    for pendente in futuros:
+                        pendente.cancel()
+                    break
+        if lote:
+            _gravar_lote(lote)
+
+    finally:
+        for caminho in pems.values():
+            if os.path.exists(caminho):
+                os.unlink(caminho)
+
+    sem_certificado = len([p for p in pendentes if p[1] not in pems])
+    if sem_certificado:
+        contagem["sem_certificado"] = sem_certificado
+    resultado = {"contagem": contagem, "tempo": time.perf_counter() - inicio}
+    if parar is not None and parar.is_set():
+        resultado["erro"] = "Downloads interrompidos: trava perdida"
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download do XML completo das notas resumidas")
+    parser.add_argument("--enfileirar-resumos", metavar="CNPJ",
+                        help="antes, enfileira os resumos já gravados, consultando pelo certificado deste CNPJ")
+    args = parser.parse_args(argv)
+
+    database.init_db()
+    if args.enfileirar_resumos:
+        print(f"{enfileirar_resumos_pendentes(args.enfileirar_resumos)} resumo(s) enfileirado(s)")
+    resultado = executar_downloads()
+    if resultado.get("erro"):
+        print(resultado["erro"])
+    print(f"Downloads concluídos em {resultado['tempo']:.1f}s: {resultado['contagem']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
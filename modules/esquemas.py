@@ -0,0 +1,198 @@
+# modules/esquemas.py
+"""
+Validação dos XMLs contra os esquemas XSD oficiais (pacotes de liberação da
+NF-e, do CT-e e da DistribuicaoDFe).
+
+Os pacotes são descompactados em PASTA_ESQUEMAS (em qualquer subpasta; os
+xs:include são resolvidos a partir do próprio arquivo). O registro é
+único por processo: cada XSD é compilado na primeira vez que um documento
+daquele tipo e versão aparece e fica em memória. Sem o XSD correspondente
+o documento não é validado (a etapa é opcional), mas XML malformado é
+sempre rejeitado.
+
+Uso: python -m modules.esquemas arquivo.xml [...] [--benchmark N]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from dataclasses import dataclass, field
+from lxml import etree
+
+logger = logging.getLogger("fiscal.esquemas")
+
+PASTA_ESQUEMAS = os.environ.get("FISCAL_PASTA_ESQUEMAS", "data/esquemas")
+VALIDAR_ESQUEMA = os.environ.get("FISCAL_VALIDAR_ESQUEMA", "1") != "0"
+MAXIMO_ERROS = 5
+# (elemento raiz, versão) -> XSD do pacote oficial
+ESQUEMAS = {
+    ("nfeProc", "4.00"): "procNFe_v4.00.xsd",
+    ("NFe", "4.00"): "nfe_v4.00.xsd",
+    ("resNFe", "1.01"): "resNFe_v1.01.xsd",
+    ("resEvento", "1.01"): "resEvento_v1.01.xsd",
+    ("procEventoNFe", "1.00"): "procEventoNFe_v1.00.xsd",
+    ("cteProc", "3.00"): "procCTe_v3.00.xsd",
+    ("cteProc", "4.00"): "procCTe_v4.00.xsd",
+    ("CTe", "4.00"): "cte_v4.00.xsd",
+    ("retDistDFeInt", "1.01"): "retDistDFeInt_v1.01.xsd",
+}
+
+# Sem entidades externas nem rede: o XML vem de terceiros
+_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=False)
+
+
+@dataclass(slots=True)
+class ResultadoValidacao:
+    esquema: str | None = None
+    validado: bool = False
+    erros: list = field(default_factory=list)
+
+    @property
+    def valido(self):
+        return not self.erros
+
+
+class RegistroEsquemas:
+    """XSDs compilados por nome de arquivo (um por tipo e versão), carregados sob demanda"""
+
+    def __init__(self, pasta=PASTA_ESQUEMAS):
+        self.pasta = pasta
+        self._arquivos = None
+        # nome do XSD -> (XMLSchema, lock) ou None se não existir/não compilar
+        self._compilados = {}
+        self._lock = threading.Lock()
+
+    def _indexar(self):
+        arquivos = {}
+        for pasta, _, nomes in os.walk(self.pasta):
+            for nome in nomes:
+                if nome.lower().endswith(".xsd"):
+                    arquivos.setdefault(nome.lower(), os.path.join(pasta, nome))
+        if not arquivos:
+            logger.warning("Nenhum XSD em %s: os documentos não serão validados contra o esquema", self.pasta)
+        return arquivos
+
+    def esquema(self, nome):
+        """(XMLSchema, lock) do XSD `nome`, compilado uma única vez; None se indisponível"""
+        if nome in self._compilados:
+            return self._compilados[nome]
+        with self._lock:
+            if nome not in self._compilados:
+                if self._arquivos is None:
+                    self._arquivos = self._indexar()
+                caminho = self._arquivos.get(nome.lower())
+                compilado = None
+                if caminho:
+                    inicio = time.perf_counter()
+                    try:
+                        # O lock é por esquema: o mesmo XMLSchema não valida em duas threads ao mesmo tempo
+                        compilado = (etree.XMLSchema(etree.parse(caminho)), threading.Lock())
+                        logger.info("Esquema %s compilado em %.0f ms", nome, (time.perf_counter() - inicio) * 1000)
+                    except (etree.XMLSchemaParseError, etree.XMLSyntaxError, OSError) as e:
+                        logger.error("Não foi possível compilar %s: %s", caminho, e)
+                self._compilados[nome] = compilado
+        return self._compilados[nome]
+
+
+_registro = None
+_registro_lock = threading.Lock()
+
+
+def registro():
+    """Registro compartilhado pelo processo"""
+    global _registro
+    if _registro is None:
+        with _registro_lock:
+            if _registro is None:
+                _registro = RegistroEsquemas()
+    return _registro
+
+
+def identificar(raiz):
+    """Nome do XSD para o elemento raiz, pela tag e pelo atributo versao (dele ou do primeiro filho)"""
+    tag = etree.QName(raiz).localname
+    versao = raiz.get("versao") or (raiz[0].get("versao") if len(raiz) else None)
+    return ESQUEMAS.get((tag, versao))
+
+
+def validar(conteudo, nome_esquema=None):
+    """
+    Valida o XML (bytes ou str) contra o XSD informado ou identificado pela
+    raiz. `nome_esquema` aceita o atributo schema do docZip ("procNFe_v4.00.xsd").
+    """
+    if isinstance(conteudo, str):
+        # lxml recusa str com declaração de encoding
+        conteudo = conteudo.encode("utf-8")
+    try:
+        raiz = etree.fromstring(conteudo, _PARSER)
+    except etree.XMLSyntaxError as e:
+        return ResultadoValidacao(erros=[f"XML malformado: {e}"])
+
+    nome = nome_esquema or identificar(raiz)
+    compilado = registro().esquema(nome) if nome else None
+    if compilado is None:
+        return ResultadoValidacao(esquema=nome)
+
+    esquema, lock = compilado
+    with lock:
+        esquema.validate(raiz)
+        erros = [f"linha {erro.line}: {erro.message}" for erro in esquema.error_log][:MAXIMO_ERROS]
+    return ResultadoValidacao(esquema=nome, validado=True, erros=erros)
+
+
+def medir(conteudo, repeticoes=1000):
+    """
+    Custo da validação de um documento: compilação do esquema (cache frio)
+    e média de leitura + validação por documento com o esquema em cache.
+    """
+    nome = identificar(etree.fromstring(conteudo, _PARSER))
+    # Registro novo só para medir a compilação; o do processo aquece na primeira validação
+    inicio = time.perf_counter()
+    if nome:
+        RegistroEsquemas().esquema(nome)
+    carga = time.perf_counter() - inicio
+
+    validar(conteudo)
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        resultado = validar(conteudo)
+    por_documento = (time.perf_counter() - inicio) / repeticoes
+    return {
+        "esquema": nome,
+        "validado": resultado.validado,
+        "compilacao_ms": round(carga * 1000, 1),
+        "por_documento_ms": round(por_documento * 1000, 3),
+        "documentos_por_segundo": round(1 / por_documento) if por_documento else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Valida XMLs de NF-e/CT-e contra os XSD oficiais")
+    parser.add_argument("arquivos", nargs="+")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="mede a validação do primeiro arquivo N vezes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    if args.benchmark:
+        with open(args.arquivos[0], "rb") as f:
+            print(medir(f.read(), args.benchmark))
+        return 0
+
+    invalidos = 0
+    for caminho in args.arquivos:
+        with open(caminho, "rb") as f:
+            resultado = validar(f.read())
+        if not resultado.valido:
+            invalidos += 1
+            print(f"{caminho}: inválido ({resultado.esquema or 'sem esquema'})")
+            for erro in resultado.erros:
+                print(f"  {erro}")
+        else:
+            print(f"{caminho}: {'válido' if resultado.validado else 'sem XSD para validar'} ({resultado.esquema or '-'})")
+    return 1 if invalidos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+# modules/eventos.py
+"""
+Eventos de NF-e (cancelamento, carta de correção, manifestação) persistidos
+na tabela `eventos` e aplicados à coluna notas.situacao.
+"""
+
+# Eventos que alteram a situação da nota
+CANCELAMENTO = ("110111", "110112")  # cancelamento e cancelamento por substituição
+
+# cSitNFe do resumo (resNFe) -> situação
+SITUACOES_RESUMO = {"1": "autorizada", "2": "denegada", "3": "cancelada"}
+
+_MARCADORES_CANCELAMENTO = ", ".join("?" * len(CANCELAMENTO))
+
+
+def salvar_eventos(conn, eventos):
+    """
+    Grava um lote de EventoNFe e atualiza a situação das notas afetadas na
+    mesma transação (o commit fica a cargo de quem chama).
+    """
+    eventos = [e for e in eventos if e.chave]
+    if not eventos:
+        return 0
+
+    conn.executemany("""
+        INSERT OR IGNORE INTO eventos
+        (chave, tipo_evento, sequencia, descricao, data_evento, protocolo, nsu)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (e.como_linha() for e in eventos))
+
+    aplicar_situacao(conn, {e.chave for e in eventos if e.tipo_evento in CANCELAMENTO})
+    return len(eventos)
+
+
+def aplicar_situacao(conn, chaves):
+    """
+    Marca como canceladas as notas que têm evento de cancelamento registrado.
+    Usado também após inserir notas cujo evento chegou antes da própria nota.
+    """
+    conn.executemany(f"""
+        UPDATE notas SET situacao = 'cancelada'
+        WHERE numero = ?
+          AND situacao IS NOT 'cancelada'
+          AND EXISTS (
+              SELECT 1 FROM eventos
+              WHERE eventos.chave = notas.numero
+                AND eventos.tipo_evento IN ({_MARCADORES_CANCELAMENTO})
+          )
+    """, ((chave, *CANCELAMENTO) for chave in chaves))
@@ -0,0 +1,588 @@
+# modules/ingestao.py
+"""
+Ingestão automática dos XMLs (NF-e, CT-e e eventos) que o ERP e o robô de
+e-mail deixam em pastas compartilhadas.
+
+Um observador varre as pastas (os.scandir, só lendo arquivos novos ou
+alterados desde a última varredura) e, se o watchdog estiver instalado, é
+acordado pelos eventos do sistema de arquivos em vez de esperar o próximo
+ciclo. Arquivos já ingeridos são descartados pelo hash do conteúdo. Os
+novos entram numa fila limitada: quando ela enche o observador espera
+(back-pressure). Um único gravador interpreta os XMLs e grava em lotes,
+uma transação por lote. Antes de interpretar, cada XML do lote é
+validado contra o XSD oficial (modules.esquemas) e tem a assinatura
+digital conferida (modules.assinatura), em paralelo; arquivos reprovados
+são registrados como erro e não são gravados.
+
+O registro de ingestão (arquivos_ingeridos) é indexado pelo hash do
+conteúdo e pela chave de acesso: um arquivo idêntico é descartado só pelo
+hash, e uma cópia diferente do mesmo documento (reexportada por outro
+sistema) é descartada lendo apenas o início do XML, sem interpretá-lo,
+desde que a versão ingerida seja tão completa quanto ela: um nfeProc
+(com o protocolo de autorização) substitui uma NFe avulsa da mesma chave,
+mas não o contrário. Uma cópia cuja chave ainda está na fila fica
+aguardando: vira duplicada só se a primeira for ingerida numa forma tão
+completa quanto a dela; se a primeira for reprovada, segue no lugar dela. Cópias marcadas como duplicadas de uma chave que não tem
+nenhum arquivo ingerido voltam para a fila. Arquivos reprovados não são
+lidos de novo até reprocessar_erros() (--reprocessar-erros), por exemplo
+depois de instalar o XSD ou as ACs que faltavam.
+
+Uso: python -m modules.ingestao [pasta ...] [--uma-vez] [--reprocessar-erros]  (ou FISCAL_PASTAS_ENTRADA)
+"""
+import io
+import os
+import sys
+import time
+import queue
+import signal
+import hashlib
+import logging
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from modules import database, nfe, cte, eventos, travas, ncm, assinatura, esquemas, paralelo
+from modules.registros import NotaFiscal, CTe, EventoNFe, chave_acesso
+from modules.texto import local
+
+logger = logging.getLogger("fiscal.ingestao")
+
+PASTAS_ENTRADA = [p for p in os.environ.get("FISCAL_PASTAS_ENTRADA", "data/entrada").split(os.pathsep) if p]
+INTERVALO_VARREDURA = float(os.environ.get("FISCAL_INTERVALO_VARREDURA", "2"))
+# Arquivo modificado há menos que isso pode ainda estar sendo copiado
+ESTABILIDADE = 1.0
+TAMANHO_FILA = 256
+TAMANHO_LOTE = 200
+# Um lote incompleto é gravado se a fila ficar parada por este tempo (s)
+ESPERA_LOTE = 1.0
+
+_RAIZES_NFE = ("nfeProc", "NFe")
+_RAIZES_CTE = ("cteProc", "CTe")
+_RAIZES_EVENTO = ("procEventoNFe", "resEvento", "evento")
+# Documento sem o protocolo de autorização: dá lugar ao nfeProc/cteProc da mesma chave
+_RAIZES_SEM_PROTOCOLO = ("NFe", "CTe")
+# Mesma regra em SQL; raiz NULL (registros anteriores à coluna) conta como completa
+_SQL_FORCA = "CASE {} WHEN 'NFe' THEN 1 WHEN 'CTe' THEN 1 ELSE 2 END"
+
+
+def tag_raiz(origem):
+    """Nome local do elemento raiz, sem processar o restante do arquivo"""
+    if isinstance(origem, (bytes, bytearray)):
+        origem = io.BytesIO(origem)
+    try:
+        for _, elem in ET.iterparse(origem, events=("start",)):
+            return local(elem.tag)
+    except ET.ParseError:
+        return None
+    return None
+
+
+def hash_conteudo(conteudo):
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def interpretar(conteudo):
+    """XML (bytes) -> NotaFiscal, CTe ou EventoNFe; ValueError se o tipo não for reconhecido"""
+    raiz = tag_raiz(conteudo)
+    if raiz in _RAIZES_NFE:
+        return nfe.extrair_nfe(conteudo, tipo="NFe")
+    if raiz in _RAIZES_CTE:
+        return cte.extrair_cte(conteudo)
+    if raiz in _RAIZES_EVENTO:
+        from modules.sefaz_connector import processar_evento_nfe
+        return processar_evento_nfe(conteudo)
+    raise ValueError(f"Tipo de XML não reconhecido ({raiz or 'XML inválido'})")
+
+
+def forca_raiz(raiz):
+    """1 para NFe/CTe sem protocolo, 2 para as demais (nfeProc, cteProc)"""
+    return 1 if raiz in _RAIZES_SEM_PROTOCOLO else 2
+
+
+def identificar(conteudo):
+    """
+    (raiz, chave): nome local do elemento raiz e chave de acesso do Id de
+    infNFe/infCte, lendo só até esse elemento. Chave None para eventos
+    (vários por chave) e XMLs sem chave.
+    """
+    raiz = None
+    try:
+        for _, elem in ET.iterparse(io.BytesIO(conteudo), events=("start",)):
+            tag = local(elem.tag)
+            raiz = raiz or tag
+            if tag in ("infNFe", "infCte"):
+                return raiz, chave_acesso(elem.get("Id"))
+            if tag in _RAIZES_EVENTO:
+                return raiz, None
+    except ET.ParseError:
+        pass
+    return raiz, None
+
+
+def chave_documento(conteudo):
+    """Chave de acesso do documento (ver identificar)"""
+    return identificar(conteudo)[1]
+
+
+def _em_lista(conn, sql, valores):
+    valores = list(valores)
+    if not valores:
+        return []
+    marcadores = ", ".join("?" * len(valores))
+    return conn.execute(sql.format(marcadores=marcadores), valores).fetchall()
+
+
+def hashes_ingeridos(hashes):
+    """
+    Quais dos hashes informados não precisam ser lidos de novo: ingeridos,
+    reprovados (status erro, até reprocessar_erros) ou duplicados de uma
+    chave já ingerida
+    """
+    conn = database.get_connection()
+    linhas = _em_lista(conn, f"""
+        SELECT a.hash FROM arquivos_ingeridos a
+        WHERE a.hash IN ({{marcadores}})
+          AND (a.status != 'duplicado' OR EXISTS (
+              SELECT 1 FROM arquivos_ingeridos i
+              WHERE i.chave = a.chave AND i.status = 'ingerido'
+                AND {_SQL_FORCA.format("i.raiz")} >= {_SQL_FORCA.format("a.raiz")}
+          ))
+    """, hashes)
+    conn.close()
+    return {linha[0] for linha in linhas}
+
+
+def chaves_ingeridas(chaves):
+    """Chaves informadas já ingeridas a partir de algum arquivo -> força da forma mais completa (forca_raiz)"""
+    conn = database.get_connection()
+    linhas = _em_lista(conn, f"""
+        SELECT chave, MAX({_SQL_FORCA.format("raiz")}) FROM arquivos_ingeridos
+        WHERE chave IN ({{marcadores}}) AND status = 'ingerido'
+        GROUP BY chave
+    """, [c for c in chaves if c])
+    conn.close()
+    return dict(linhas)
+
+
+def buscar_ingerido(hash_arquivo, chave=None, raiz=None):
+    """
+    Registro anterior do mesmo arquivo (pelo hash) ou do mesmo documento
+    (pela chave) numa forma tão completa quanto `raiz`. Reprovações não
+    contam: o arquivo pode ser enviado de novo.
+    """
+    conn = database.get_connection()
+    linha = conn.execute(f"""
+        SELECT hash, caminho, status, erro, chave, tipo, raiz, ingerido_em FROM arquivos_ingeridos
+        WHERE hash = ? AND status != 'erro'
+        UNION ALL
+        SELECT hash, caminho, status, erro, chave, tipo, raiz, ingerido_em FROM arquivos_ingeridos
+        WHERE chave = ? AND status = 'ingerido' AND {_SQL_FORCA.format("raiz")} >= ?
+        LIMIT 1
+    """, (hash_arquivo, chave, forca_raiz(raiz))).fetchone()
+    conn.close()
+    if linha is None:
+        return None
+    return dict(zip(("hash", "caminho", "status", "erro", "chave", "tipo", "raiz", "ingerido_em"), linha))
+
+
+def reprocessar_erros():
+    """Apaga os registros de arquivos reprovados para a próxima varredura lê-los de novo; retorna quantos"""
+    conn = database.get_connection()
+    try:
+        removidos = conn.execute("DELETE FROM arquivos_ingeridos WHERE status = 'erro'").rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return removidos
+
+
+def registrar_ingeridos(conn, linhas, agora=None):
+    """
+    Grava (hash, caminho, status, erro, chave, tipo, raiz) no registro de ingestão
+    (o commit fica a cargo de quem chama). Um arquivo já ingerido não muda;
+    um que tinha sido reprovado ou marcado como duplicado é atualizado.
+    """
+    agora = agora or datetime.now().isoformat()
+    conn.executemany("""
+        INSERT INTO arquivos_ingeridos (hash, caminho, status, erro, chave, tipo, raiz, ingerido_em)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(hash) DO UPDATE SET
+            caminho = excluded.caminho,
+            status = excluded.status,
+            erro = excluded.erro,
+            chave = excluded.chave,
+            tipo = excluded.tipo,
+            raiz = excluded.raiz,
+            ingerido_em = excluded.ingerido_em
+        WHERE arquivos_ingeridos.status != 'ingerido'
+    """, ((*linha, agora) for linha in linhas))
+
+
+def linha_ingerido(caminho, hash_arquivo, registro, erro=None, raiz=None):
+    """Linha de registrar_ingeridos para um registro interpretado (ou para um erro) lido de um XML `raiz`"""
+    if erro or registro is None:
+        return (hash_arquivo, caminho, "erro", erro, None, None, raiz)
+    chave = registro.chave if isinstance(registro, (NotaFiscal, CTe)) else None
+    return (hash_arquivo, caminho, "ingerido", None, chave, registro.tipo, raiz)
+
+
+def conferir(conteudo):
+    """Esquema XSD e assinatura digital de um XML: mensagem de erro ou None (roda no pool de processos)"""
+    if esquemas.VALIDAR_ESQUEMA:
+        validacao = esquemas.validar(conteudo)
+        if not validacao.valido:
+            return f"XML fora do esquema {validacao.esquema or ''}: {'; '.join(validacao.erros)}"
+    if assinatura.VERIFICAR_ASSINATURA:
+        verificacao = assinatura.verificar(conteudo)
+        if not verificacao.valida:
+            return f"Assinatura digital inválida: {verificacao.motivo}"
+    return None
+
+
+def gravar_lote(lote):
+    """
+    Grava um lote de (caminho, hash, registro, erro, raiz) em uma única
+    transação: notas/itens, CT-e, eventos e o registro de arquivos ingeridos.
+    """
+    agora = datetime.now().isoformat()
+    registros = [registro for _, _, registro, erro, _ in lote if erro is None]
+    notas = [r for r in registros if isinstance(r, NotaFiscal)]
+    ctes = [r for r in registros if isinstance(r, CTe)]
+    lista_eventos = [r for r in registros if isinstance(r, EventoNFe)]
+
+    conn = database.get_connection()
+    try:
+        nfe.salvar_lote(conn, notas, agora)
+        for registro in ctes:
+            nfe.salvar_nota(conn, registro, agora)
+            cte.salvar_cte(conn, registro)
+        eventos.salvar_eventos(conn, lista_eventos)
+        # Eventos que chegaram antes das notas
+        eventos.aplicar_situacao(conn, [r.chave for r in notas])
+
+        registrar_ingeridos(conn, (
+            linha_ingerido(caminho, hash_arquivo, registro, erro, raiz)
+            for caminho, hash_arquivo, registro, erro, raiz in lote
+        ), agora)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class Ingestor:
+    def __init__(self, pastas=None, intervalo=INTERVALO_VARREDURA, tamanho_fila=TAMANHO_FILA,
+                 tamanho_lote=TAMANHO_LOTE):
+        self.pastas = list(pastas or PASTAS_ENTRADA)
+        self.intervalo = intervalo
+        self.tamanho_lote = tamanho_lote
+        self.fila = queue.Queue(maxsize=tamanho_fila)
+        self.parar = threading.Event()
+        self.acordar = threading.Event()
+        # caminho -> (mtime_ns, tamanho) da última vez que o arquivo foi lido
+        self._vistos = {}
+        # hash -> chave dos arquivos na fila ou no lote ainda não gravado
+        self._em_fila = {}
+        self._chaves_em_fila = set()
+        # chave em andamento -> outras cópias dela, esperando o resultado da primeira
+        self._aguardando = {}
+        self._lock = threading.Lock()
+        self.estatisticas = {"ingeridos": 0, "erros": 0, "duplicados": 0, "lotes": 0, "ncm_invalidos": 0}
+
+    def _arquivos(self, pasta):
+        """*.xml da pasta e subpastas"""
+        try:
+            with os.scandir(pasta) as entradas:
+                for entrada in entradas:
+                    if entrada.is_dir(follow_symlinks=False):
+                        yield from self._arquivos(entrada.path)
+                    elif entrada.is_file() and entrada.name.lower().endswith(".xml"):
+                        yield entrada
+        except FileNotFoundError:
+            return
+
+    def varrer(self, estabilidade=ESTABILIDADE):
+        """Uma varredura: enfileira arquivos novos ou alterados ainda não ingeridos"""
+        limite = time.time() - estabilidade
+        candidatos = []
+        for pasta in self.pastas:
+            for entrada in self._arquivos(pasta):
+                estado = entrada.stat()
+                marca_arquivo = (estado.st_mtime_ns, estado.st_size)
+                if self._vistos.get(entrada.path) == marca_arquivo or estado.st_mtime > limite:
+                    continue
+                try:
+                    with open(entrada.path, "rb") as f:
+                        conteudo = f.read()
+                except OSError as e:
+                    logger.warning("Não foi possível ler %s: %s", entrada.path, e)
+                    continue
+                self._vistos[entrada.path] = marca_arquivo
+                candidatos.append((entrada.path, hash_conteudo(conteudo), conteudo))
+
+                if len(candidatos) >= self.tamanho_lote:
+                    self._enfileirar(candidatos)
+                    candidatos = []
+        self._enfileirar(candidatos)
+
+    def _enfileirar(self, candidatos):
+        conhecidos = hashes_ingeridos({h for _, h, _ in candidatos})
+        novos = []
+        for caminho, hash_arquivo, conteudo in candidatos:
+            if hash_arquivo in conhecidos or hash_arquivo in self._em_fila:
+                self.estatisticas["duplicados"] += 1
+            else:
+                novos.append((caminho, hash_arquivo, conteudo, *identificar(conteudo)))
+
+        # Conteúdo diferente, mesmo documento: registra o hash para pular direto na próxima vez
+        chaves_conhecidas = chaves_ingeridas({chave for _, _, _, _, chave in novos})
+        repetidos = []
+        for caminho, hash_arquivo, conteudo, raiz, chave in novos:
+            if chave and chaves_conhecidas.get(chave, 0) >= forca_raiz(raiz):
+                self.estatisticas["duplicados"] += 1
+                repetidos.append((hash_arquivo, caminho, "duplicado", None, chave, None, raiz))
+                continue
+            with self._lock:
+                if chave and chave in self._chaves_em_fila:
+                    # Só é duplicada se a cópia em andamento for ingerida (ver _resolver_aguardando)
+                    self._aguardando.setdefault(chave, []).append((caminho, hash_arquivo, conteudo))
+                    self._em_fila[hash_arquivo] = chave
+                    continue
+                self._em_fila[hash_arquivo] = chave
+                if chave:
+                    self._chaves_em_fila.add(chave)
+            # Bloqueia enquanto o gravador não abrir espaço na fila
+            while not self.parar.is_set():
+                try:
+                    self.fila.put((caminho, hash_arquivo, conteudo), timeout=1)
+                    break
+                except queue.Full:
+                    continue
+
+        if repetidos:
+            conn = database.get_connection()
+            registrar_ingeridos(conn, repetidos)
+            conn.commit()
+            conn.close()
+
+    def _observar(self):
+        while not self.parar.is_set():
+            try:
+                self.varrer()
+            except Exception as e:
+                logger.exception("Erro na varredura: %s", e)
+            self.acordar.wait(self.intervalo)
+            self.acordar.clear()
+
+    def _interpretar(self, recebidos):
+        """(caminho, hash, conteudo) -> (caminho, hash, registro, erro, raiz), conferindo esquema e assinatura do lote"""
+        if esquemas.VALIDAR_ESQUEMA or assinatura.VERIFICAR_ASSINATURA:
+            reprovacoes = paralelo.mapear(conferir, [conteudo for _, _, conteudo in recebidos])
+        else:
+            reprovacoes = [None] * len(recebidos)
+
+        lote = []
+        for (caminho, hash_arquivo, conteudo), reprovacao in zip(recebidos, reprovacoes):
+            raiz = tag_raiz(conteudo)
+            if reprovacao:
+                lote.append((caminho, hash_arquivo, None, reprovacao, raiz))
+                continue
+            try:
+                lote.append((caminho, hash_arquivo, interpretar(conteudo), None, raiz))
+            except Exception as e:
+                lote.append((caminho, hash_arquivo, None, str(e), raiz))
+        return lote
+
+    def _gravar(self):
+        recebidos = []
+        while not (self.parar.is_set() and self.fila.empty() and not recebidos):
+            try:
+                caminho, hash_arquivo, conteudo = self.fila.get(timeout=ESPERA_LOTE)
+            except queue.Empty:
+                caminho = None
+            else:
+                recebidos.append((caminho, hash_arquivo, conteudo))
+
+            if recebidos and (caminho is None or len(recebidos) >= self.tamanho_lote):
+                try:
+                    lote = self._interpretar(recebidos)
+                except Exception as e:
+                    # Falha do lote inteiro (ex.: pool de processos quebrado): registra como
+                    # erro em vez de encerrar o único gravador
+                    logger.exception("Erro ao interpretar lote de %d arquivos: %s", len(recebidos), e)
+                    lote = [(caminho, hash_arquivo, None, f"falha ao interpretar o lote: {e}", None)
+                            for caminho, hash_arquivo, _ in recebidos]
+                # Cópias que aguardavam uma chave reprovada entram no próximo lote
+                recebidos = self._gravar_lote(lote)
+
+    def _resolver_aguardando(self, lote, gravado):
+        """
+        Chaves do lote concluídas: se a cópia foi ingerida, as que aguardavam
+        e não são mais completas que ela são duplicadas; senão a próxima
+        cópia assume a chave. Retorna (linhas de duplicados para o
+        registro, cópias para o próximo lote).
+        """
+        repetidos, retomados = [], []
+        with self._lock:
+            for caminho, hash_arquivo, registro, erro, raiz in lote:
+                chave = self._em_fila.pop(hash_arquivo, None)
+                if not chave:
+                    continue
+                aguardando = self._aguardando.pop(chave, [])
+                if gravado and erro is None:
+                    # Ex.: NFe avulsa ingerida e um nfeProc aguardando: o nfeProc substitui
+                    mais_completas = []
+                    for copia in aguardando:
+                        raiz_copia = tag_raiz(copia[2])
+                        if forca_raiz(raiz_copia) > forca_raiz(raiz):
+                            mais_completas.append(copia)
+                            continue
+                        self._em_fila.pop(copia[1], None)
+                        repetidos.append((copia[1], copia[0], "duplicado", None, chave, None, raiz_copia))
+                    if mais_completas:
+                        retomados.append(mais_completas.pop(0))
+                        if mais_completas:
+                            self._aguardando[chave] = mais_completas
+                    else:
+                        self._chaves_em_fila.discard(chave)
+                elif aguardando:
+                    retomados.append(aguardando.pop(0))
+                    if aguardando:
+                        self._aguardando[chave] = aguardando
+                else:
+                    self._chaves_em_fila.discard(chave)
+        return repetidos, retomados
+
+    def _gravar_lote(self, lote):
+        """Grava o lote e retorna as cópias que devem entrar no próximo"""
+        inicio = time.perf_counter()
+        gravado = False
+        try:
+            gravar_lote(lote)
+            gravado = True
+        except Exception as e:
+            # Os arquivos voltam a ser lidos na próxima varredura
+            logger.exception("Erro ao gravar lote de %d arquivos: %s", len(lote), e)
+            for caminho, *_ in lote:
+                self._vistos.pop(caminho, None)
+        else:
+            erros = len([item for item in lote if item[3]])
+            self.estatisticas["ingeridos"] += len(lote) - erros
+            self.estatisticas["erros"] += erros
+            self.estatisticas["lotes"] += 1
+            for caminho, _, registro, erro, _ in lote:
+                if erro:
+                    logger.warning("%s: %s", caminho, erro)
+                elif isinstance(registro, NotaFiscal):
+                    # A nota é gravada mesmo assim, apenas com o aviso
+                    invalidos = ncm.validar_itens(registro.itens)
+                    if invalidos:
+                        self.estatisticas["ncm_invalidos"] += sum(len(itens) for itens in invalidos.values())
+                        logger.warning("%s: NCM fora da tabela vigente %s", caminho, invalidos)
+            logger.info("Lote de %d arquivos gravado em %.2fs", len(lote), time.perf_counter() - inicio)
+
+        repetidos, retomados = self._resolver_aguardando(lote, gravado)
+        if repetidos:
+            self.estatisticas["duplicados"] += len(repetidos)
+            conn = database.get_connection()
+            try:
+                registrar_ingeridos(conn, repetidos)
+                conn.commit()
+            finally:
+                conn.close()
+        return retomados
+
+    def _iniciar_watchdog(self):
+        """Eventos do sistema de arquivos antecipam a próxima varredura (opcional)"""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return None
+
+        acordar = self.acordar
+
+        class _Acordar(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    acordar.set()
+
+        observador = Observer()
+        for pasta in self.pastas:
+            os.makedirs(pasta, exist_ok=True)
+            observador.schedule(_Acordar(), pasta, recursive=True)
+        observador.start()
+        return observador
+
+    def executar(self, uma_vez=False):
+        """Roda até `parar` ser sinalizado (ou uma única varredura, se `uma_vez`)"""
+        gravador = threading.Thread(target=self._gravar, name="ingestao-gravador", daemon=True)
+        gravador.start()
+        if uma_vez:
+            self.varrer(estabilidade=0)
+            self.parar.set()
+            gravador.join()
+            return self.estatisticas
+
+        observador = self._iniciar_watchdog()
+        try:
+            self._observar()
+        finally:
+            self.parar.set()
+            if observador is not None:
+                observador.stop()
+                observador.join()
+            gravador.join()
+        return self.estatisticas
+
+
+def _encerrar_ao_perder(trava, ingestor):
+    trava.perdida.wait()
+    logger.error("Trava %s perdida; encerrando a ingestão", trava.nome)
+    ingestor.parar.set()
+    ingestor.acordar.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingestão automática de XMLs de NF-e/CT-e")
+    parser.add_argument("pastas", nargs="*", help="Pastas monitoradas (padrão: FISCAL_PASTAS_ENTRADA)")
+    parser.add_argument("--uma-vez", action="store_true", help="Faz uma única varredura e termina")
+    parser.add_argument("--reprocessar-erros", action="store_true",
+                        help="Lê de novo os arquivos reprovados nas execuções anteriores")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    database.init_db()
+
+    # Um único ingestor por banco, mesmo com vários processos apontando para as mesmas pastas
+    trava = travas.Trava("ingestao")
+    if not trava.adquirir():
+        print(trava.motivo)
+        return 1
+
+    if args.reprocessar_erros:
+        logger.info("%d arquivo(s) reprovado(s) serão lidos de novo", reprocessar_erros())
+
+    ingestor = Ingestor(args.pastas or None)
+    # Perder a trava (processo pausado além do TTL) encerra o ingestor
+    threading.Thread(target=_encerrar_ao_perder, args=(trava, ingestor), daemon=True).start()
+
+    def encerrar(*_):
+        ingestor.parar.set()
+        ingestor.acordar.set()
+
+    # systemd/docker param o serviço com SIGTERM: termina o lote em andamento e libera a trava
+    signal.signal(signal.SIGTERM, encerrar)
+    try:
+        estatisticas = ingestor.executar(uma_vez=args.uma_vez)
+    except KeyboardInterrupt:
+        ingestor.parar.set()
+        estatisticas = ingestor.estatisticas
+    finally:
+        paralelo.encerrar()
+        trava.liberar()
+    print(f"Ingestão encerrada: {estatisticas}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 from modules.database import conectar
+from modules import ncm, conciliacao
 
 def adicionar_mercadoria(descricao, codigo, valor_unit, ncm="", unidade="UN"):
     conn = conectar()
@@ -46,18 +47,37 @@ def render():
     </style>
     """, unsafe_allow_html=True)
     
-    tab1, tab2, tab3 = st.tabs(["📝 Cadastrar", "📋 Listar", "🔍 Pesquisar"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📝 Cadastrar", "📋 Listar", "🔍 Pesquisar", "🗂️ Tabela NCM", "🔗 Conciliação"])
+    
+    # Índice carregado uma vez por processo e compartilhado entre as sessões
+    indice_ncm = ncm.indice()
     
     with tab1:
         st.subheader("📝 Cadastrar Nova Mercadoria")
         
+        # Fora do formulário para atualizar as sugestões a cada busca
+        sugestoes_ncm = []
+        if len(indice_ncm):
+            busca_ncm = st.text_input("📊 Buscar NCM", placeholder="Digite o início do código ou uma palavra da descrição")
+            sugestoes_ncm = indice_ncm.sugerir(busca_ncm, limite=20) if busca_ncm else []
+            if busca_ncm and not sugestoes_ncm:
+                st.caption("Nenhum NCM encontrado para a busca")
+        
         with st.form("nova_mercadoria", clear_on_submit=True):
             col1, col2 = st.columns(2)
             
             with col1:
                 descricao = st.text_input("📄 Descrição da Mercadoria", placeholder="Ex: Notebook Dell Inspiron")
                 codigo = st.text_input("🏷️ Código da Mercadoria", placeholder="Ex: PROD001")
-                ncm = st.text_input("📊 NCM (Opcional)", placeholder="Ex: 8471.30.12")
+                if sugestoes_ncm:
+                    ncm_escolhido = st.selectbox(
+                        "📊 NCM",
+                        [""] + [codigo_ncm for codigo_ncm, _ in sugestoes_ncm],
+                        format_func=lambda c: f"{ncm.formatar_ncm(c)} - {indice_ncm.descricao(c)[:80]}" if c else "(nenhum)"
+                    )
+                    ncm_valor = ncm.formatar_ncm(ncm_escolhido) if ncm_escolhido else ""
+                else:
+                    ncm_valor = st.text_input("📊 NCM (Opcional)", placeholder="Ex: 8471.30.12")
             
             with col2:
                 valor_unit = st.number_input("💰 Valor Unitário (R$)", min_value=0.0, step=0.01, format="%.2f")
@@ -69,7 +89,9 @@ def render():
                 submit = st.form_submit_button("💾 Cadastrar Mercadoria", type="primary", use_container_width=True)
             
             if submit:
-                if descricao and codigo:
+                if ncm_valor and len(indice_ncm) and not indice_ncm.valido(ncm_valor):
+                    st.error(f"❌ NCM '{ncm_valor}' não consta na tabela NCM vigente!")
+                elif descricao and codigo:
                     try:
                         conn = conectar()
                         c = conn.cursor()
@@ -77,7 +99,7 @@ def render():
                             INSERT OR REPLACE INTO mercadorias 
                             (descricao, codigo, valor_unit, ncm, unidade) 
                             VALUES (?, ?, ?, ?, ?)
-                        """, (descricao, codigo, valor_unit, ncm, unidade))
+                        """, (descricao, codigo, valor_unit, ncm_valor, unidade))
                         conn.commit()
                         conn.close()
                         st.success(f"✅ Mercadoria '{descricao}' cadastrada com sucesso!")
@@ -107,6 +129,18 @@ def render():
                 valor_total = df['valor_unit'].sum()
                 st.metric("💸 Valor Total Estoque", f"R$ {valor_total:.2f}")
             
+            # Validação do catálogo inteiro contra o índice em memória
+            if len(indice_ncm):
+                preenchidos = df[df['ncm'].fillna("").str.strip() != ""]
+                invalidos = indice_ncm.invalidos(preenchidos['ncm'])
+                if invalidos:
+                    with st.expander(f"⚠️ {len(invalidos)} NCM(s) fora da tabela vigente"):
+                        st.dataframe(
+                            preenchidos[preenchidos['ncm'].isin(invalidos)][['codigo', 'descricao', 'ncm']],
+                            use_container_width=True,
+                            hide_index=True
+                        )
+            
             # Formatando a tabela
             df_display = df.copy()
             df_display['valor_unit'] = df_display['valor_unit'].apply(lambda x: f"R$ {x:.2f}")
@@ -224,3 +258,63 @@ def render():
                     if st.button(f"🔍 {row['descricao']}", key=f"sugestao_{row['descricao']}"):
                         st.session_state.termo_pesquisa = row['descricao']
                         st.rerun()
+    
+    with tab4:
+        st.subheader("🗂️ Tabela NCM")
+        st.metric("📊 Códigos carregados", len(indice_ncm))
+        st.caption("Importe o JSON da tabela NCM vigente (Siscomex) ou um CSV com as colunas código e descrição.")
+        
+        arquivo_ncm = st.file_uploader("Arquivo da tabela NCM", type=["json", "csv"])
+        if arquivo_ncm and st.button("📥 Importar tabela NCM", type="primary"):
+            try:
+                total = ncm.importar_tabela(arquivo_ncm.getvalue())
+                st.success(f"✅ {total} códigos NCM importados")
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Erro ao importar: {e}")
+    
+    with tab5:
+        st.subheader("🔗 Conciliação de Itens de NF-e")
+        st.caption("Relaciona o código do produto de cada fornecedor a uma mercadoria do catálogo. "
+                   "Depois de confirmado, o produto não volta a ser comparado.")
+        
+        col_conc1, col_conc2 = st.columns([2, 1])
+        with col_conc1:
+            automatico = st.slider("Confirmar automaticamente a partir da similaridade", 0.80, 1.00, 1.00, 0.01,
+                                   help="1,00 = não confirmar nada automaticamente")
+        with col_conc2:
+            if st.button("🔍 Buscar sugestões", use_container_width=True):
+                with st.spinner("Comparando itens com o catálogo..."):
+                    st.session_state.conciliacao = conciliacao.conciliar(
+                        automatico=automatico if automatico < 1 else None
+                    )
+        
+        resultado = st.session_state.get("conciliacao")
+        if resultado:
+            st.info(f"📊 {resultado['pendentes']} produto(s) pendente(s), "
+                    f"{resultado['confirmados']} confirmado(s) automaticamente, "
+                    f"{resultado['sem_candidato']} sem candidato")
+            
+            for n, pendente in enumerate(resultado["sugestoes"][:50]):
+                col_item, col_escolha, col_botao = st.columns([3, 3, 1])
+                with col_item:
+                    st.markdown(f"**{pendente['descricao']}**  \n"
+                                f"{pendente['cnpj_fornecedor']} · cód. {pendente['codigo_fornecedor']} · "
+                                f"NCM {pendente['ncm'] or '-'} · {pendente['itens']} item(ns)")
+                with col_escolha:
+                    escolha = st.selectbox(
+                        "Mercadoria",
+                        pendente["sugestoes"],
+                        format_func=lambda s: f"{s[0]} ({s[1]:.0%})",
+                        key=f"conciliacao_{n}",
+                        label_visibility="collapsed"
+                    )
+                with col_botao:
+                    if st.button("✅", key=f"confirmar_{n}", help="Confirmar"):
+                        conn = conectar()
+                        conciliacao.confirmar(conn, pendente["cnpj_fornecedor"], pendente["codigo_fornecedor"],
+                                              escolha[0], escolha[1])
+                        conn.commit()
+                        conn.close()
+                        resultado["sugestoes"].remove(pendente)
+                        st.rerun()
@@ -0,0 +1,462 @@
+# modules/migracoes.py
+"""
+Migrações versionadas do esquema SQLite.
+
+A versão aplicada fica em PRAGMA user_version. Cada migração normal roda em
+uma única transação junto com a atualização da versão; migrações marcadas
+como "em lotes" reescrevem tabelas grandes em várias transações curtas (para
+não segurar o lock de escrita) e por isso precisam ser idempotentes.
+"""
+import logging
+
+logger = logging.getLogger("fiscal.migracoes")
+
+TAMANHO_LOTE = 5000
+
+
+def versao_atual(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def colunas(conn, tabela):
+    return {linha[1] for linha in conn.execute(f"PRAGMA table_info({tabela})")}
+
+
+def adicionar_coluna(conn, tabela, coluna, definicao):
+    """ALTER TABLE ADD COLUMN apenas se a coluna ainda não existir"""
+    if coluna not in colunas(conn, tabela):
+        conn.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+
+
+def atualizar_em_lotes(conn, tabela, sql, tamanho_lote=TAMANHO_LOTE):
+    """
+    Executa `sql` em faixas de rowid, uma transação por faixa.
+    O SQL recebe os parâmetros nomeados :inicio (exclusivo) e :fim (inclusivo).
+    """
+    maximo = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {tabela}").fetchone()[0]
+    inicio = 0
+    while inicio < maximo:
+        fim = inicio + tamanho_lote
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(sql, {"inicio": inicio, "fim": fim})
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        inicio = fim
+
+
+# --- Migrações -----------------------------------------------------------
+
+def _m001_esquema_inicial(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS clientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cnpj TEXT UNIQUE,
+            nome TEXT,
+            endereco TEXT,
+            telefone TEXT,
+            email TEXT
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS mercadorias (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo TEXT UNIQUE,
+            descricao TEXT,
+            ncm TEXT,
+            unidade TEXT,
+            valor_unit REAL
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT,
+            numero TEXT,
+            cnpj_emitente TEXT,
+            nome_emitente TEXT,
+            valor_total REAL,
+            data_sincronizacao TEXT
+        )
+    """)
+
+    # Bancos criados por versões antigas não têm estas colunas
+    adicionar_coluna(conn, "clientes", "telefone", "TEXT")
+    adicionar_coluna(conn, "clientes", "email", "TEXT")
+    adicionar_coluna(conn, "notas", "data_sincronizacao", "TEXT")
+
+
+def _m002_indices_consultas(conn):
+    # Ordenações e filtros usados pelas telas de notas, clientes e mercadorias
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_numero ON notas(numero)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_data_sincronizacao ON notas(data_sincronizacao)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clientes_nome ON clientes(nome)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mercadorias_descricao ON mercadorias(descricao)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mercadorias_ncm ON mercadorias(ncm)")
+
+
+def _m003_ctes(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ctes (
+            chave TEXT PRIMARY KEY,
+            numero TEXT,
+            serie TEXT,
+            data_emissao TEXT,
+            cnpj_emitente TEXT,
+            nome_emitente TEXT,
+            cnpj_remetente TEXT,
+            nome_remetente TEXT,
+            cnpj_destinatario TEXT,
+            nome_destinatario TEXT,
+            cnpj_tomador TEXT,
+            nome_tomador TEXT,
+            tipo_tomador TEXT,
+            cmun_origem TEXT,
+            mun_origem TEXT,
+            uf_origem TEXT,
+            cmun_destino TEXT,
+            mun_destino TEXT,
+            uf_destino TEXT,
+            valor_prestacao REAL,
+            valor_receber REAL,
+            valor_carga REAL,
+            produto_predominante TEXT,
+            qtd_nfes INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ctes_emitente ON ctes(cnpj_emitente)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ctes_tomador ON ctes(cnpj_tomador, data_emissao)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ctes_data_emissao ON ctes(data_emissao)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ctes_rota ON ctes(cmun_origem, cmun_destino)")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cte_componentes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chave_cte TEXT NOT NULL,
+            nome TEXT,
+            valor REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_componentes_chave ON cte_componentes(chave_cte)")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cte_cargas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chave_cte TEXT NOT NULL,
+            unidade TEXT,
+            tipo_medida TEXT,
+            quantidade REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_cargas_chave ON cte_cargas(chave_cte)")
+
+    # Chave primária começando pela NF-e: "frete por NF-e" é uma busca direta
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cte_nfes (
+            chave_nfe TEXT NOT NULL,
+            chave_cte TEXT NOT NULL,
+            PRIMARY KEY (chave_nfe, chave_cte)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_nfes_cte ON cte_nfes(chave_cte)")
+
+
+def _m004_eventos(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS eventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chave TEXT NOT NULL,
+            tipo_evento TEXT NOT NULL,
+            sequencia INTEGER NOT NULL DEFAULT 1,
+            descricao TEXT,
+            data_evento TEXT,
+            protocolo TEXT,
+            nsu TEXT,
+            UNIQUE (chave, tipo_evento, sequencia)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_eventos_tipo ON eventos(tipo_evento)")
+
+    # DEFAULT em ADD COLUMN não reescreve a tabela
+    adicionar_coluna(conn, "notas", "situacao", "TEXT DEFAULT 'autorizada'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_situacao ON notas(situacao, data_sincronizacao)")
+
+
+def _m005_chave_unica_notas(conn):
+    # O leitor de XML gravava o Id com prefixo ("NFe"/"CTe"); a sincronização grava só a chave
+    atualizar_em_lotes(conn, "notas", """
+        UPDATE notas SET numero = substr(numero, 4)
+        WHERE rowid > :inicio AND rowid <= :fim
+          AND (numero LIKE 'NFe%' OR numero LIKE 'CTe%')
+    """)
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Notas antigas sem chave ('N/A' do leitor legado) não são duplicatas entre si:
+        # o índice único aceita vários NULL
+        sem_chave = conn.execute("UPDATE notas SET numero = NULL WHERE numero IN ('N/A', '')").rowcount
+        removidas = conn.execute("""
+            DELETE FROM notas
+            WHERE numero IS NOT NULL
+              AND id NOT IN (SELECT MAX(id) FROM notas WHERE numero IS NOT NULL GROUP BY numero)
+        """).rowcount
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_notas_numero ON notas(numero)")
+        conn.execute("DROP INDEX IF EXISTS idx_notas_numero")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if sem_chave:
+        logger.info("%d nota(s) sem chave (numero 'N/A') mantidas com numero NULL", sem_chave)
+    if removidas:
+        logger.warning("%d nota(s) duplicada(s) removida(s); ficou a gravação mais recente de cada chave", removidas)
+
+
+def _m006_certificados(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS certificados (
+            cnpj TEXT PRIMARY KEY,
+            apelido TEXT,
+            caminho TEXT NOT NULL,
+            uf TEXT DEFAULT '35',
+            validade TEXT,
+            ativo INTEGER NOT NULL DEFAULT 1,
+            atualizado_em TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS nsu_controle (
+            cnpj TEXT PRIMARY KEY,
+            ultimo_nsu TEXT NOT NULL,
+            max_nsu TEXT,
+            atualizado_em TEXT
+        )
+    """)
+
+
+def _m007_fila_download(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fila_download (
+            chave TEXT PRIMARY KEY,
+            cnpj TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa TEXT,
+            ultimo_erro TEXT,
+            atualizado_em TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fila_download_status ON fila_download(status, proxima_tentativa)")
+
+
+def _m008_travas(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS travas (
+            nome TEXT PRIMARY KEY,
+            dono TEXT NOT NULL,
+            adquirida_em TEXT,
+            expira_em REAL NOT NULL,
+            heartbeat_em REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS controle_execucao (
+            nome TEXT PRIMARY KEY,
+            ultima_execucao TEXT
+        )
+    """)
+
+
+def _m009_itens_nfe(conn):
+    # Valores dos itens em centavos (INTEGER), como nos registros tipados
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS nfe_itens (
+            chave TEXT NOT NULL,
+            numero_item INTEGER NOT NULL,
+            codigo_produto TEXT,
+            descricao TEXT,
+            ncm TEXT,
+            cfop TEXT,
+            unidade TEXT,
+            quantidade REAL,
+            valor_produto INTEGER NOT NULL DEFAULT 0,
+            valor_frete INTEGER NOT NULL DEFAULT 0,
+            valor_icms INTEGER NOT NULL DEFAULT 0,
+            valor_icms_st INTEGER NOT NULL DEFAULT 0,
+            valor_ipi INTEGER NOT NULL DEFAULT 0,
+            valor_pis INTEGER NOT NULL DEFAULT 0,
+            valor_cofins INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chave, numero_item)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_itens_ncm ON nfe_itens(ncm)")
+
+    adicionar_coluna(conn, "notas", "data_emissao", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_data_emissao ON notas(data_emissao)")
+
+
+def _m010_arquivos_ingeridos(conn):
+    # Hash SHA-256 do conteúdo de cada XML já processado pela ingestão automática
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS arquivos_ingeridos (
+            hash TEXT PRIMARY KEY,
+            caminho TEXT,
+            status TEXT NOT NULL,
+            erro TEXT,
+            ingerido_em TEXT
+        ) WITHOUT ROWID
+    """)
+
+
+def _m011_chave_arquivos_ingeridos(conn):
+    # Mesmo documento em arquivos diferentes (reexportado, reenviado por e-mail)
+    adicionar_coluna(conn, "arquivos_ingeridos", "chave", "TEXT")
+    adicionar_coluna(conn, "arquivos_ingeridos", "tipo", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_arquivos_ingeridos_chave ON arquivos_ingeridos(chave, status)")
+
+
+def _m012_ncm(conn):
+    # Tabela oficial (Siscomex), com todos os níveis da hierarquia (2 a 8 dígitos)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ncm (
+            codigo TEXT PRIMARY KEY,
+            descricao TEXT,
+            data_inicio TEXT,
+            data_fim TEXT
+        ) WITHOUT ROWID
+    """)
+
+
+def _m013_mapa_produtos_fornecedor(conn):
+    # De-para confirmado: código do produto no XML do fornecedor -> mercadorias.codigo
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS mapa_produtos_fornecedor (
+            cnpj_fornecedor TEXT NOT NULL,
+            codigo_fornecedor TEXT NOT NULL,
+            codigo_mercadoria TEXT NOT NULL,
+            similaridade REAL,
+            origem TEXT NOT NULL DEFAULT 'manual',
+            confirmado_em TEXT,
+            PRIMARY KEY (cnpj_fornecedor, codigo_fornecedor)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mapa_produtos_mercadoria ON mapa_produtos_fornecedor(codigo_mercadoria)"
+    )
+
+
+def _m014_auditoria_totais(conn):
+    # Totais de ICMSTot como vieram no XML, em centavos como nfe_itens
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS nfe_totais (
+            chave TEXT PRIMARY KEY,
+            valor_produtos INTEGER NOT NULL DEFAULT 0,
+            valor_frete INTEGER NOT NULL DEFAULT 0,
+            valor_icms INTEGER NOT NULL DEFAULT 0,
+            valor_icms_st INTEGER NOT NULL DEFAULT 0,
+            valor_ipi INTEGER NOT NULL DEFAULT 0,
+            valor_pis INTEGER NOT NULL DEFAULT 0,
+            valor_cofins INTEGER NOT NULL DEFAULT 0,
+            valor_total INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+
+    # Uma linha por nota e campo divergente (soma dos itens x total declarado)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS auditoria_totais (
+            chave TEXT NOT NULL,
+            campo TEXT NOT NULL,
+            valor_itens INTEGER NOT NULL,
+            valor_declarado INTEGER NOT NULL,
+            diferenca INTEGER NOT NULL,
+            auditado_em TEXT NOT NULL,
+            PRIMARY KEY (chave, campo)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_auditoria_totais_campo ON auditoria_totais(campo, diferenca)")
+
+
+def _m015_mercadoria_dos_itens(conn):
+    # Mercadoria do catálogo resolvida pelo de-para na gravação do item; NULL = ainda sem conciliação
+    adicionar_coluna(conn, "nfe_itens", "codigo_mercadoria", "TEXT")
+    # Prefixo NULL = itens pendentes de conciliação, sem varrer os já conciliados
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_nfe_itens_mercadoria ON nfe_itens(codigo_mercadoria, codigo_produto)"
+    )
+    conn.execute("""
+        UPDATE nfe_itens SET codigo_mercadoria = (
+            SELECT m.codigo_mercadoria FROM notas n
+            JOIN mapa_produtos_fornecedor m
+                ON m.cnpj_fornecedor = n.cnpj_emitente AND m.codigo_fornecedor = nfe_itens.codigo_produto
+            WHERE n.numero = nfe_itens.chave
+        )
+        WHERE codigo_mercadoria IS NULL
+    """)
+
+
+def _m016_raiz_arquivos_ingeridos(conn):
+    # NFe/CTe sem protocolo x nfeProc/cteProc: a versão autorizada substitui a outra
+    adicionar_coluna(conn, "arquivos_ingeridos", "raiz", "TEXT")
+
+
+# (versão, descrição, função, em_lotes) — sempre em ordem crescente de versão
+MIGRACOES = [
+    (1, "Esquema inicial", _m001_esquema_inicial, False),
+    (2, "Índices das consultas das telas", _m002_indices_consultas, False),
+    (3, "Tabelas normalizadas de CT-e", _m003_ctes, False),
+    (4, "Eventos de NF-e e situação das notas", _m004_eventos, False),
+    (5, "Chave de acesso única em notas", _m005_chave_unica_notas, True),
+    (6, "Registro de certificados e checkpoint de NSU por CNPJ", _m006_certificados, False),
+    (7, "Fila de download do XML completo", _m007_fila_download, False),
+    (8, "Travas de sincronização entre processos", _m008_travas, False),
+    (9, "Itens da NF-e e data de emissão das notas", _m009_itens_nfe, False),
+    (10, "Registro de arquivos ingeridos por hash", _m010_arquivos_ingeridos, False),
+    (11, "Chave de acesso no registro de arquivos ingeridos", _m011_chave_arquivos_ingeridos, False),
+    (12, "Tabela de referência NCM", _m012_ncm, False),
+    (13, "De-para de produtos do fornecedor para mercadorias", _m013_mapa_produtos_fornecedor, False),
+    (14, "Totais da NF-e e auditoria contra a soma dos itens", _m014_auditoria_totais, False),
+    (15, "Mercadoria conciliada nos itens da NF-e", _m015_mercadoria_dos_itens, False),
+    (16, "Elemento raiz no registro de arquivos ingeridos", _m016_raiz_arquivos_ingeridos, False),
+]
+
+
+def aplicar_migracoes(conn):
+    """Aplica as migrações pendentes e retorna a versão final do esquema"""
+    versao = versao_atual(conn)
+    ultima = MIGRACOES[-1][0]
+    if versao > ultima:
+        raise RuntimeError(
+            f"Banco na versão {versao}, mais nova que a suportada por este código ({ultima})"
+        )
+
+    nivel_isolamento = conn.isolation_level
+    # Controle manual das transações (BEGIN/COMMIT explícitos)
+    conn.isolation_level = None
+    try:
+        for numero, descricao, funcao, em_lotes in MIGRACOES:
+            if numero <= versao:
+                continue
+
+            logger.info("Aplicando migração %03d: %s", numero, descricao)
+            if em_lotes:
+                # Cada lote faz seu próprio commit; a versão só avança no final
+                funcao(conn)
+                conn.execute(f"PRAGMA user_version = {numero}")
+            else:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    funcao(conn)
+                    conn.execute(f"PRAGMA user_version = {numero}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            versao = numero
+    finally:
+        conn.isolation_level = nivel_isolamento
+
+    return versao
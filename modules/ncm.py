@@ -0,0 +1,193 @@
+# modules/ncm.py
+"""
+Tabela de referência NCM e índice de prefixos em memória.
+
+A tabela oficial (JSON da Siscomex ou CSV "codigo;descricao") é importada
+para a tabela `ncm`. O índice é carregado uma vez por processo: listas
+ordenadas de códigos e de palavras das descrições, consultadas com bisect.
+Autocomplete e validação não tocam o banco depois da carga.
+
+Uso: python -m modules.ncm arquivo.json|arquivo.csv
+"""
+import io
+import re
+import csv
+import sys
+import json
+import bisect
+import threading
+from modules import database
+from modules.texto import somente_digitos, normalizar, faixa_prefixo
+
+TAMANHO_NCM = 8
+# Itens que não são mercadoria (serviços) usam NCM "00" na NF-e
+NCM_SERVICO = "00"
+_RE_PALAVRA = re.compile(r"[a-z0-9]+")
+
+
+def formatar_ncm(codigo):
+    """84713012 -> 8471.30.12 (códigos incompletos ficam como estão)"""
+    codigo = somente_digitos(codigo)
+    if len(codigo) != TAMANHO_NCM:
+        return codigo
+    return f"{codigo[:4]}.{codigo[4:6]}.{codigo[6:]}"
+
+
+def _ler_tabela(conteudo):
+    """Linhas (codigo, descricao, data_inicio, data_fim) do JSON da Siscomex ou de um CSV"""
+    if isinstance(conteudo, bytes):
+        conteudo = conteudo.decode("utf-8-sig")
+
+    if conteudo.lstrip().startswith("{"):
+        for item in json.loads(conteudo).get("Nomenclaturas", []):
+            yield (
+                item.get("Codigo"),
+                item.get("Descricao"),
+                item.get("Data_Inicio"),
+                item.get("Data_Fim"),
+            )
+        return
+
+    dialeto = csv.Sniffer().sniff(conteudo[:2048], delimiters=";,\t")
+    for linha in csv.reader(io.StringIO(conteudo), dialeto):
+        if len(linha) >= 2 and somente_digitos(linha[0]):
+            yield (linha[0], linha[1], None, None)
+
+
+def importar_tabela(conteudo):
+    """Substitui a tabela NCM pelo conteúdo informado e recarrega o índice"""
+    linhas = []
+    for codigo, descricao, data_inicio, data_fim in _ler_tabela(conteudo):
+        codigo = somente_digitos(codigo)
+        if codigo:
+            # A Siscomex indenta a hierarquia com hífens ("-- Reprodutores de raça pura")
+            linhas.append((codigo, (descricao or "").lstrip("- ").strip(), data_inicio, data_fim))
+
+    conn = database.get_connection()
+    try:
+        conn.execute("DELETE FROM ncm")
+        conn.executemany(
+            "INSERT OR REPLACE INTO ncm (codigo, descricao, data_inicio, data_fim) VALUES (?, ?, ?, ?)",
+            linhas
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    recarregar()
+    return len(linhas)
+
+
+class IndiceNCM:
+    def __init__(self, linhas):
+        linhas = sorted(linhas)
+        self.codigos = [codigo for codigo, _ in linhas]
+        self.descricoes = [descricao for _, descricao in linhas]
+        # (palavra normalizada, posição do código) para busca pelo início das palavras da descrição
+        self.palavras = sorted(
+            {(palavra, i) for i, descricao in enumerate(self.descricoes)
+             for palavra in _RE_PALAVRA.findall(normalizar(descricao)) if len(palavra) > 2}
+        )
+        self._chaves_palavras = [palavra for palavra, _ in self.palavras]
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def descricao(self, codigo):
+        codigo = somente_digitos(codigo)
+        i = bisect.bisect_left(self.codigos, codigo)
+        if i < len(self.codigos) and self.codigos[i] == codigo:
+            return self.descricoes[i]
+        return None
+
+    def valido(self, codigo):
+        """NCM de 8 dígitos presente na tabela"""
+        codigo = somente_digitos(codigo)
+        return len(codigo) == TAMANHO_NCM and self.descricao(codigo) is not None
+
+    def invalidos(self, codigos):
+        """Subconjunto dos códigos informados que não são NCM válidos"""
+        return {codigo for codigo in set(codigos) if not self.valido(codigo)}
+
+    def sugerir(self, termo, limite=10):
+        """
+        Até `limite` (codigo, descricao) de 8 dígitos: por prefixo do código,
+        ou pelo início de uma palavra da descrição se o termo não tiver dígitos.
+        """
+        termo = (termo or "").strip()
+        digitos = somente_digitos(termo)
+        sugestoes = []
+
+        if digitos:
+            inicio, fim = faixa_prefixo(self.codigos, digitos)
+            for i in range(inicio, fim):
+                if len(self.codigos[i]) == TAMANHO_NCM:
+                    sugestoes.append((self.codigos[i], self.descricoes[i]))
+                    if len(sugestoes) >= limite:
+                        break
+            return sugestoes
+
+        palavra = normalizar(termo).split()[0] if termo.split() else ""
+        if len(palavra) < 3:
+            return sugestoes
+        inicio, fim = faixa_prefixo(self._chaves_palavras, palavra)
+        vistos = set()
+        for _, posicao in self.palavras[inicio:fim]:
+            # A descrição das posições de 2 a 7 dígitos vale para os NCM abaixo delas
+            prefixo = self.codigos[posicao]
+            i, j = faixa_prefixo(self.codigos, prefixo)
+            for k in range(i, j):
+                if len(self.codigos[k]) == TAMANHO_NCM and k not in vistos:
+                    vistos.add(k)
+                    sugestoes.append((self.codigos[k], self.descricoes[k]))
+                    if len(sugestoes) >= limite:
+                        return sugestoes
+        return sugestoes
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def indice():
+    """Índice compartilhado pelo processo (todas as sessões do Streamlit), carregado na primeira chamada"""
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                conn = database.get_connection()
+                linhas = conn.execute("SELECT codigo, COALESCE(descricao, '') FROM ncm").fetchall()
+                conn.close()
+                _indice = IndiceNCM(linhas)
+    return _indice
+
+
+def recarregar():
+    global _indice
+    with _indice_lock:
+        _indice = None
+    return indice()
+
+
+def validar_itens(itens):
+    """
+    NCMs inválidos de uma lista de ItemNFe, como {ncm: [numero_item, ...]}.
+    Sem tabela importada não há como validar e o resultado é vazio.
+    """
+    referencia = indice()
+    if not len(referencia):
+        return {}
+    invalidos = {}
+    for item in itens:
+        if item.ncm != NCM_SERVICO and not referencia.valido(item.ncm):
+            invalidos.setdefault(item.ncm or "", []).append(item.numero_item)
+    return invalidos
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Uso: python -m modules.ncm arquivo.json|arquivo.csv")
+        sys.exit(1)
+    database.init_db()
+    with open(sys.argv[1], "rb") as f:
+        print(f"{importar_tabela(f.read())} códigos NCM importados")
@@ -0,0 +1,222 @@
+# modules/nfe.py
+"""
+Extração da NF-e completa (cabeçalho, totais de ICMSTot e itens) com parser
+em streaming, e gravação em notas / nfe_itens. Na gravação, cada item
+recebe a mercadoria do catálogo já conciliada para o produto do fornecedor.
+
+Uso (medição de memória, registros x dicts):
+    python -m modules.nfe --benchmark N arquivo-procNFe.xml
+"""
+import io
+import sys
+import argparse
+import tracemalloc
+import dataclasses
+import xml.etree.ElementTree as ET
+from modules import conciliacao
+from modules.texto import local
+from modules.registros import ItemNFe, NotaFiscal, centavos, chave_acesso, quantidade
+
+_CAMPOS_IDE = {"nNF": "numero", "serie": "serie", "dhEmi": "data_emissao", "dEmi": "data_emissao"}
+_CAMPOS_TOTAL = {
+    "vProd": "valor_produtos_centavos",
+    "vFrete": "valor_frete_centavos",
+    "vICMS": "valor_icms_centavos",
+    "vST": "valor_icms_st_centavos",
+    "vIPI": "valor_ipi_centavos",
+    "vPIS": "valor_pis_centavos",
+    "vCOFINS": "valor_cofins_centavos",
+    "vNF": "valor_total_centavos",
+}
+_CAMPOS_PROD = {
+    "cProd": "codigo_produto",
+    "xProd": "descricao",
+    "NCM": "ncm",
+    "CFOP": "cfop",
+    "uCom": "unidade",
+}
+# Grupo de imposto do item -> tag do valor -> campo
+_CAMPOS_IMPOSTO = {
+    "ICMS": {"vICMS": "valor_icms_centavos", "vICMSST": "valor_icms_st_centavos"},
+    "IPI": {"vIPI": "valor_ipi_centavos"},
+    "PIS": {"vPIS": "valor_pis_centavos"},
+    "COFINS": {"vCOFINS": "valor_cofins_centavos"},
+}
+
+SQL_NOTA = """
+    INSERT INTO notas
+    (tipo, numero, cnpj_emitente, nome_emitente, valor_total, data_emissao, situacao, data_sincronizacao)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(numero) DO UPDATE SET
+        tipo = excluded.tipo,
+        cnpj_emitente = excluded.cnpj_emitente,
+        nome_emitente = excluded.nome_emitente,
+        valor_total = excluded.valor_total,
+        data_emissao = COALESCE(excluded.data_emissao, notas.data_emissao),
+        data_sincronizacao = excluded.data_sincronizacao,
+        situacao = CASE WHEN notas.situacao = 'cancelada' THEN notas.situacao ELSE excluded.situacao END
+"""
+
+SQL_ITEM = """
+    INSERT INTO nfe_itens (
+        chave, numero_item, codigo_produto, descricao, ncm, cfop, unidade, quantidade,
+        valor_produto, valor_frete, valor_icms, valor_icms_st, valor_ipi, valor_pis, valor_cofins,
+        codigo_mercadoria
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_TOTAIS = """
+    INSERT OR REPLACE INTO nfe_totais (
+        chave, valor_produtos, valor_frete, valor_icms, valor_icms_st,
+        valor_ipi, valor_pis, valor_cofins, valor_total
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def extrair_nfe(origem, tipo="NFe_Completa"):
+    """
+    Extrai NotaFiscal (com itens) de um nfeProc/NFe com ET.iterparse.
+    `origem` pode ser um caminho, bytes, str ou um arquivo binário aberto.
+    """
+    if isinstance(origem, str) and origem.lstrip().startswith("<"):
+        origem = origem.encode("utf-8")
+    if isinstance(origem, (bytes, bytearray)):
+        origem = io.BytesIO(origem)
+
+    nota = None
+    item = None
+    caminho = []
+    for evento, elem in ET.iterparse(origem, events=("start", "end")):
+        tag = local(elem.tag)
+
+        if evento == "start":
+            caminho.append(tag)
+            if tag == "infNFe" and nota is None:
+                nota = NotaFiscal(chave=chave_acesso(elem.get("Id")), tipo=tipo)
+            elif tag == "det" and nota is not None:
+                item = ItemNFe(chave=nota.chave, numero_item=int(elem.get("nItem") or len(nota.itens) + 1))
+            continue
+
+        caminho.pop()
+        if nota is None:
+            elem.clear()
+            continue
+        pai = caminho[-1] if caminho else None
+        texto = elem.text.strip() if elem.text else None
+
+        if tag == "det" and item is not None:
+            nota.itens.append(item)
+            item = None
+        elif item is not None and pai == "prod":
+            if tag in _CAMPOS_PROD:
+                setattr(item, _CAMPOS_PROD[tag], texto)
+            elif tag == "qCom":
+                item.quantidade = quantidade(texto)
+            elif tag == "vProd":
+                item.valor_produto_centavos = centavos(texto)
+            elif tag == "vFrete":
+                item.valor_frete_centavos = centavos(texto)
+        elif item is not None and "imposto" in caminho:
+            # ICMS/ICMS00/vICMS, IPI/IPITrib/vIPI, PIS/PISAliq/vPIS...
+            posicao = caminho.index("imposto") + 1
+            grupo = caminho[posicao] if posicao < len(caminho) else None
+            campo = _CAMPOS_IMPOSTO.get(grupo, {}).get(tag)
+            if campo:
+                setattr(item, campo, centavos(texto))
+        elif pai == "ICMSTot" and tag in _CAMPOS_TOTAL:
+            setattr(nota, _CAMPOS_TOTAL[tag], centavos(texto))
+        elif pai == "ide" and tag in _CAMPOS_IDE:
+            setattr(nota, _CAMPOS_IDE[tag], texto)
+        elif pai == "emit" and tag in ("CNPJ", "CPF"):
+            nota.cnpj_emitente = texto
+        elif pai == "emit" and tag == "xNome":
+            nota.nome_emitente = texto
+        elif pai == "dest" and tag in ("CNPJ", "CPF"):
+            nota.cnpj_destinatario = texto
+        elif pai == "dest" and tag == "xNome":
+            nota.nome_destinatario = texto
+
+        # Libera a memória dos elementos já processados
+        elem.clear()
+
+    if nota is None or nota.chave is None:
+        raise ValueError("XML sem infNFe ou com chave de acesso inválida")
+    return nota
+
+
+def salvar_nota(conn, registro, data_sincronizacao=None):
+    """
+    Grava (ou atualiza) a linha de notas de um NotaFiscal, ResumoNFe ou CTe.
+    Uma nota cancelada continua cancelada mesmo que o XML chegue depois do
+    evento. O commit fica a cargo de quem chama.
+    """
+    conn.execute(SQL_NOTA, (*registro.como_linha_nota(), data_sincronizacao))
+
+
+def resolver_mercadorias(conn, notas):
+    """Preenche codigo_mercadoria dos itens pelo de-para; uma busca por (fornecedor, produto)"""
+    conciliados = {}
+    for nota in notas:
+        for item in nota.itens:
+            if not nota.cnpj_emitente or not item.codigo_produto:
+                continue
+            produto = (nota.cnpj_emitente, item.codigo_produto)
+            if produto not in conciliados:
+                conciliados[produto] = conciliacao.mercadoria_do_fornecedor(conn, *produto)
+            item.codigo_mercadoria = conciliados[produto]
+
+
+def salvar_itens(conn, nota):
+    """Substitui os itens da nota em nfe_itens (o commit fica a cargo de quem chama)"""
+    resolver_mercadorias(conn, [nota])
+    conn.execute("DELETE FROM nfe_itens WHERE chave = ?", (nota.chave,))
+    conn.executemany(SQL_ITEM, (item.como_linha() for item in nota.itens))
+
+
+def salvar_totais(conn, nota):
+    """Grava os totais de ICMSTot da nota em nfe_totais (o commit fica a cargo de quem chama)"""
+    conn.execute(SQL_TOTAIS, nota.como_linha_totais())
+
+
+def salvar_lote(conn, notas, data_sincronizacao=None):
+    """salvar_nota + salvar_totais + salvar_itens para várias NotaFiscal, com um executemany por tabela"""
+    conn.executemany(SQL_NOTA, ((*nota.como_linha_nota(), data_sincronizacao) for nota in notas))
+    conn.executemany(SQL_TOTAIS, (nota.como_linha_totais() for nota in notas))
+    resolver_mercadorias(conn, notas)
+    conn.executemany("DELETE FROM nfe_itens WHERE chave = ?", ((nota.chave,) for nota in notas))
+    conn.executemany(SQL_ITEM, (item.como_linha() for nota in notas for item in nota.itens))
+
+
+def medir_memoria(conteudo, documentos=10_000):
+    """
+    Memória (tracemalloc) retida por `documentos` cópias da NF-e lida de
+    `conteudo`, como NotaFiscal/ItemNFe com __slots__ e como dicts com os
+    mesmos campos (dataclasses.asdict). Só o que fica retido na lista conta.
+    """
+    resultado = {"documentos": documentos, "itens_por_documento": len(extrair_nfe(conteudo).itens)}
+    for nome, converter in (("registros", lambda nota: nota), ("dicts", dataclasses.asdict)):
+        tracemalloc.start()
+        retidos = [converter(extrair_nfe(conteudo)) for _ in range(documentos)]
+        atual, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del retidos
+        resultado[f"{nome}_mb"] = round(atual / 1024 / 1024, 1)
+        resultado[f"{nome}_pico_mb"] = round(pico / 1024 / 1024, 1)
+        resultado[f"{nome}_bytes_por_documento"] = atual // documentos
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Leitura de NF-e (procNFe) em registros tipados")
+    parser.add_argument("arquivo")
+    parser.add_argument("--benchmark", type=int, metavar="N", default=10_000,
+                        help="mede a memória de N cópias do arquivo como registros e como dicts")
+    args = parser.parse_args(argv)
+
+    with open(args.arquivo, "rb") as f:
+        print(medir_memoria(f.read(), args.benchmark))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
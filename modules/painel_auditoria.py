@@ -0,0 +1,50 @@
+import streamlit as st
+from datetime import date
+from modules import auditoria
+
+
+def render():
+    st.title("🧮 Auditoria de Totais da NF-e")
+    st.caption("Compara ICMS, ICMS-ST, IPI, PIS, COFINS, frete e produtos do ICMSTot com a soma dos itens.")
+
+    col1, col2, col3 = st.columns([1, 1, 1])
+    with col1:
+        todas = st.checkbox("Todas as notas", value=False)
+        mes = None if todas else st.text_input("Mês de emissão (AAAA-MM)", value=date.today().strftime("%Y-%m"))
+    with col2:
+        tolerancia = st.number_input("Tolerância por campo (R$)", min_value=0.0, value=0.01, step=0.01, format="%.2f")
+    with col3:
+        auditar_agora = st.button("🧮 Auditar", type="primary", use_container_width=True)
+
+    if mes:
+        try:
+            auditoria.validar_mes(mes)
+        except ValueError:
+            st.error("❌ Informe o mês no formato AAAA-MM")
+            return
+
+    if auditar_agora:
+        try:
+            with st.spinner("Somando os itens..."):
+                resultado = auditoria.auditar(mes, round(tolerancia * 100))
+        except ValueError as e:
+            # Mês com notas já arquivadas
+            st.error(f"❌ {e}")
+            return
+        col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+        col_m1.metric("🧾 Notas auditadas", resultado["notas"])
+        col_m2.metric("⚠️ Notas divergentes", resultado["notas_divergentes"])
+        col_m3.metric("📋 Divergências", resultado["divergencias"])
+        col_m4.metric("⏱️ Tempo", f"{resultado['tempo']:.2f} s")
+
+    try:
+        df = auditoria.listar_divergencias(mes)
+    except ValueError as e:
+        # Mais anos arquivados do que o SQLite consegue anexar
+        st.error(f"❌ {e}")
+        return
+    if df.empty:
+        st.info("✅ Nenhuma divergência registrada para o período.")
+        return
+
+    st.dataframe(df, use_container_width=True, hide_index=True)
@@ -0,0 +1,49 @@
+# modules/paralelo.py
+"""
+Pool de processos compartilhado pelas verificações em lote (assinatura
+digital, esquema XSD). É criado na primeira chamada e reaproveitado pelos
+lotes seguintes, para que os caches de cada processo (certificados,
+esquemas compilados) continuem quentes.
+"""
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+PROCESSOS = os.cpu_count() or 1
+# Abaixo disso o custo de mandar os documentos para outro processo não compensa
+LOTE_MINIMO = 200
+TAMANHO_TAREFA = 50
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _obter_pool(processos):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: o Ingestor tem threads, e fork com threads ativas não é seguro
+            _pool = ProcessPoolExecutor(processos, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(encerrar)
+        return _pool
+
+
+def encerrar():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def mapear(funcao, itens, processos=PROCESSOS, minimo=LOTE_MINIMO):
+    """
+    [funcao(item) for item in itens], no pool quando o lote tem pelo menos
+    `minimo` itens. `funcao` precisa ser uma função de módulo (vai por pickle).
+    """
+    itens = list(itens)
+    if processos <= 1 or len(itens) < minimo:
+        return [funcao(item) for item in itens]
+    return list(_obter_pool(processos).map(funcao, itens, chunksize=TAMANHO_TAREFA))
@@ -0,0 +1,228 @@
+# modules/registros.py
+"""
+Registros tipados dos documentos fiscais lidos de XML (NF-e, itens, resumo,
+evento e CT-e).
+
+São dataclasses com __slots__: ocupam bem menos memória que dicts em lotes
+grandes e não repetem as chaves de texto em cada documento. Valores
+monetários ficam em centavos (int, campos *_centavos), chaves de acesso
+como strings de 44 dígitos e campos ausentes como None. O método
+`como_linha` devolve a tupla de colunas na ordem do INSERT da tabela
+correspondente, pronta para executemany.
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+TAMANHO_CHAVE = 44
+
+
+def centavos(texto):
+    """'1234.56' -> 123456; vazio ou inválido -> 0"""
+    if not texto:
+        return 0
+    try:
+        return int((Decimal(texto) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        return 0
+
+
+def reais(valor_centavos):
+    return (valor_centavos or 0) / 100
+
+
+def quantidade(texto):
+    try:
+        return float(texto)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def chave_acesso(texto):
+    """Id do XML ("NFe3520...") ou chNFe -> chave de 44 dígitos; None se inválida"""
+    if not texto:
+        return None
+    chave = texto.strip()
+    if chave[:3] in ("NFe", "CTe"):
+        chave = chave[3:]
+    if len(chave) != TAMANHO_CHAVE or not chave.isdigit():
+        return None
+    return chave
+
+
+@dataclass(slots=True)
+class ItemNFe:
+    """Linha det/prod da NF-e com os tributos de imposto"""
+    chave: str
+    numero_item: int
+    codigo_produto: str | None = None
+    descricao: str | None = None
+    ncm: str | None = None
+    cfop: str | None = None
+    unidade: str | None = None
+    quantidade: float = 0.0
+    valor_produto_centavos: int = 0
+    valor_frete_centavos: int = 0
+    valor_icms_centavos: int = 0
+    valor_icms_st_centavos: int = 0
+    valor_ipi_centavos: int = 0
+    valor_pis_centavos: int = 0
+    valor_cofins_centavos: int = 0
+    # Mercadoria do catálogo pelo de-para do fornecedor (modules.conciliacao)
+    codigo_mercadoria: str | None = None
+
+    def como_linha(self):
+        # Ordem das colunas de nfe_itens
+        return (
+            self.chave, self.numero_item, self.codigo_produto, self.descricao, self.ncm, self.cfop,
+            self.unidade, self.quantidade, self.valor_produto_centavos, self.valor_frete_centavos,
+            self.valor_icms_centavos, self.valor_icms_st_centavos, self.valor_ipi_centavos,
+            self.valor_pis_centavos, self.valor_cofins_centavos, self.codigo_mercadoria,
+        )
+
+
+@dataclass(slots=True)
+class NotaFiscal:
+    """Cabeçalho da NF-e completa (procNFe), com os totais de ICMSTot"""
+    chave: str
+    numero: str | None = None
+    serie: str | None = None
+    data_emissao: str | None = None
+    cnpj_emitente: str | None = None
+    nome_emitente: str | None = None
+    cnpj_destinatario: str | None = None
+    nome_destinatario: str | None = None
+    valor_produtos_centavos: int = 0
+    valor_frete_centavos: int = 0
+    valor_icms_centavos: int = 0
+    valor_icms_st_centavos: int = 0
+    valor_ipi_centavos: int = 0
+    valor_pis_centavos: int = 0
+    valor_cofins_centavos: int = 0
+    valor_total_centavos: int = 0
+    tipo: str = "NFe_Completa"
+    situacao: str = "autorizada"
+    itens: list = field(default_factory=list)
+
+    def como_linha_nota(self):
+        # (tipo, numero, cnpj_emitente, nome_emitente, valor_total, data_emissao, situacao) de notas
+        return (
+            self.tipo, self.chave, self.cnpj_emitente, self.nome_emitente,
+            reais(self.valor_total_centavos), self.data_emissao, self.situacao,
+        )
+
+    def como_linha_totais(self):
+        # Ordem das colunas de nfe_totais
+        return (
+            self.chave, self.valor_produtos_centavos, self.valor_frete_centavos,
+            self.valor_icms_centavos, self.valor_icms_st_centavos, self.valor_ipi_centavos,
+            self.valor_pis_centavos, self.valor_cofins_centavos, self.valor_total_centavos,
+        )
+
+
+@dataclass(slots=True)
+class ResumoNFe:
+    """resNFe da DistribuicaoDFe (nota sem o XML completo)"""
+    chave: str
+    cnpj_emitente: str | None = None
+    nome_emitente: str | None = None
+    data_emissao: str | None = None
+    valor_total_centavos: int = 0
+    situacao: str = "autorizada"
+    tipo: str = "NFe_Resumo"
+
+    def como_linha_nota(self):
+        return (
+            self.tipo, self.chave, self.cnpj_emitente, self.nome_emitente,
+            reais(self.valor_total_centavos), self.data_emissao, self.situacao,
+        )
+
+
+@dataclass(slots=True)
+class EventoNFe:
+    """resEvento ou procEventoNFe (cancelamento, carta de correção, manifestação)"""
+    chave: str
+    tipo_evento: str | None = None
+    sequencia: int = 1
+    descricao: str | None = None
+    data_evento: str | None = None
+    protocolo: str | None = None
+    nsu: str | None = None
+    tipo = "Evento_NFe"
+
+    def como_linha(self):
+        # Ordem das colunas de eventos
+        return (
+            self.chave, self.tipo_evento, self.sequencia, self.descricao,
+            self.data_evento, self.protocolo, self.nsu,
+        )
+
+
+@dataclass(slots=True)
+class CTe:
+    """CT-e com componentes (nome, centavos), cargas (unidade, tipo, quantidade) e NF-e transportadas"""
+    chave: str
+    numero: str | None = None
+    serie: str | None = None
+    data_emissao: str | None = None
+    cnpj_emitente: str | None = None
+    nome_emitente: str | None = None
+    cnpj_remetente: str | None = None
+    nome_remetente: str | None = None
+    cnpj_destinatario: str | None = None
+    nome_destinatario: str | None = None
+    cnpj_tomador: str | None = None
+    nome_tomador: str | None = None
+    tipo_tomador: str | None = None
+    codigo_tomador: str | None = None
+    cmun_origem: str | None = None
+    mun_origem: str | None = None
+    uf_origem: str | None = None
+    cmun_destino: str | None = None
+    mun_destino: str | None = None
+    uf_destino: str | None = None
+    valor_prestacao_centavos: int = 0
+    valor_receber_centavos: int = 0
+    valor_carga_centavos: int = 0
+    produto_predominante: str | None = None
+    componentes: list = field(default_factory=list)
+    cargas: list = field(default_factory=list)
+    nfes: list = field(default_factory=list)
+    tipo = "CTe"
+    situacao = "autorizada"
+
+    def como_linha(self):
+        # Ordem das colunas de ctes (valores em reais)
+        return (
+            self.chave, self.numero, self.serie, self.data_emissao,
+            self.cnpj_emitente, self.nome_emitente, self.cnpj_remetente, self.nome_remetente,
+            self.cnpj_destinatario, self.nome_destinatario, self.cnpj_tomador, self.nome_tomador,
+            self.tipo_tomador,
+            self.cmun_origem, self.mun_origem, self.uf_origem,
+            self.cmun_destino, self.mun_destino, self.uf_destino,
+            reais(self.valor_prestacao_centavos), reais(self.valor_receber_centavos),
+            reais(self.valor_carga_centavos), self.produto_predominante, len(set(self.nfes)),
+        )
+
+    def como_linha_nota(self):
+        return (
+            self.tipo, self.chave, self.cnpj_emitente, self.nome_emitente,
+            reais(self.valor_prestacao_centavos), self.data_emissao, self.situacao,
+        )
+
+
+@dataclass(slots=True)
+class DocumentoDFe:
+    """Um docZip da DistribuicaoDFe: o registro extraído e onde ficou o XML"""
+    nsu: str
+    schema: str
+    arquivo: str | None = None
+    registro: object = None
+    erro: str | None = None
+
+    @property
+    def processado(self):
+        return self.registro is not None and self.erro is None
+
+    @property
+    def tipo(self):
+        return self.registro.tipo if self.registro is not None else self.schema
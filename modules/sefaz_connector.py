@@ -1,15 +1,32 @@
 # modules/sefaz_connector.py
 import tempfile
-import requests
 import xml.etree.ElementTree as ET
-from OpenSSL import crypto
 import base64
+import gzip
 import os
+import re
 from datetime import datetime
-from modules import database
+from modules import database, eventos, certificados, nfe, esquemas, texto
+from modules.registros import DocumentoDFe, EventoNFe, ResumoNFe, centavos, chave_acesso
+from modules.agendador_sefaz import agendador, ConsultaAdiada, TIMEOUT, ERRO_REDE, ERRO_SERVIDOR, DIST_NSU
+
+def _buscar(elem, tag):
+    """Primeiro descendente com o nome local `tag`, ignorando namespaces"""
+    for filho in elem.iter():
+        if filho.tag == tag or filho.tag.endswith("}" + tag):
+            return filho
+    return None
+
+def _texto(elem, tag, padrao="N/A"):
+    encontrado = _buscar(elem, tag) if elem is not None else None
+    if encontrado is not None and encontrado.text:
+        return encontrado.text.strip()
+    return padrao
 
 def carregar_certificado(pfx_bytes, senha):
     """Converte certificado .pfx em PEM temporário (para autenticação mTLS)"""
+    from OpenSSL import crypto
+
     try:
         pfx = crypto.load_pkcs12(pfx_bytes, senha.encode())
         chave_privada = crypto.dump_privatekey(crypto.FILETYPE_PEM, pfx.get_privatekey())
@@ -43,17 +60,23 @@ def extrair_cnpj_certificado(certificado):
         print(f"Erro ao extrair CNPJ: {e}")
         return None
 
-def consultar_notas_distribuicao_dfe(cert_path, cnpj, ambiente="producao", uf="35", ultimo_nsu="000000000000000"):
+# (conexão, leitura) em segundos
+TIMEOUT_SEFAZ = (float(os.environ.get("SEFAZ_TIMEOUT_CONEXAO", "10")), float(os.environ.get("SEFAZ_TIMEOUT_LEITURA", "60")))
+TENTATIVAS_SEFAZ = 3
+
+URLS_DISTRIBUICAO = {
+    "producao": "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx",
+    "homologacao": "https://hom.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx",
+}
+
+def requisitar_distribuicao_dfe(cert_path, cnpj, consulta_xml, ambiente="producao", uf="35", endpoint=DIST_NSU):
     """
-    Consulta notas na SEFAZ via NFeDistribuicaoDFe.
-    Esta é a forma oficial de consultar NFes destinadas ao CNPJ
+    Envia um distDFeInt (distNSU, consNSU ou consChNFe) e retorna o XML de resposta.
+    O agendador decide quando a chamada pode sair; falhas transitórias são repetidas.
     """
-    urls = {
-        "producao": "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx",
-        "homologacao": "https://hom.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx",
-    }
-    
-    url = urls.get(ambiente, urls["producao"])
+    import requests
+
+    url = URLS_DISTRIBUICAO.get(ambiente, URLS_DISTRIBUICAO["producao"])
     cnpj_limpo = ''.join(filter(str.isdigit, cnpj))
 
     soap_xml = f"""<?xml version="1.0" encoding="utf-8"?>
@@ -67,9 +90,7 @@ def consultar_notas_distribuicao_dfe(cert_path, cnpj, ambiente="producao", uf="3
                         <tpAmb>{"1" if ambiente == "producao" else "2"}</tpAmb>
                         <cUFAutor>{uf}</cUFAutor>
                         <CNPJ>{cnpj_limpo}</CNPJ>
-                        <distNSU>
-                            <ultNSU>{ultimo_nsu}</ultNSU>
-                        </distNSU>
+                        {consulta_xml}
                     </distDFeInt>
                 </nfeDadosMsg>
             </nfe:nfeDistDFeInteresse>
@@ -81,92 +102,155 @@ def consultar_notas_distribuicao_dfe(cert_path, cnpj, ambiente="producao", uf="3
         "SOAPAction": "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe/nfeDistDFeInteresse"
     }
 
+    for tentativa in range(1, TENTATIVAS_SEFAZ + 1):
+        agendador.aguardar(cnpj_limpo, endpoint)
+        try:
+            resp = requests.post(url, data=soap_xml, headers=headers, cert=cert_path, timeout=TIMEOUT_SEFAZ)
+            resp.raise_for_status()
+        except requests.exceptions.Timeout:
+            agendador.registrar(cnpj_limpo, endpoint, TIMEOUT)
+            if tentativa == TENTATIVAS_SEFAZ:
+                raise
+        except requests.exceptions.ConnectionError:
+            agendador.registrar(cnpj_limpo, endpoint, ERRO_REDE)
+            if tentativa == TENTATIVAS_SEFAZ:
+                raise
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code < 500:
+                agendador.liberar(cnpj_limpo, endpoint)
+                raise
+            agendador.registrar(cnpj_limpo, endpoint, ERRO_SERVIDOR)
+            if tentativa == TENTATIVAS_SEFAZ:
+                raise
+        except Exception:
+            # Sem liberar, uma chamada de teste com o circuito meio-aberto travaria o CNPJ
+            agendador.liberar(cnpj_limpo, endpoint)
+            raise
+        else:
+            codigo_status = re.search(r"<cStat>(\d+)</cStat>", resp.text)
+            agendador.registrar(cnpj_limpo, endpoint, codigo_status.group(1) if codigo_status else None)
+            return resp.text
+
+def consultar_notas_distribuicao_dfe(cert_path, cnpj, ambiente="producao", uf="35", ultimo_nsu="000000000000000"):
+    """
+    Consulta notas na SEFAZ via NFeDistribuicaoDFe.
+    Esta é a forma oficial de consultar NFes destinadas ao CNPJ
+    """
+    import requests
+
     try:
-        resp = requests.post(url, data=soap_xml, headers=headers, cert=cert_path, timeout=30)
-        resp.raise_for_status()
+        xml_resposta = requisitar_distribuicao_dfe(
+            cert_path, cnpj, f"<distNSU><ultNSU>{ultimo_nsu}</ultNSU></distNSU>", ambiente, uf
+        )
         
-        return processar_resposta_distribuicao_dfe(resp.text)
+        return processar_resposta_distribuicao_dfe(xml_resposta, cnpj)
         
+    except ConsultaAdiada as e:
+        return {"erro": str(e), "sucesso": False, "adiada": True}
     except requests.exceptions.RequestException as e:
         return {"erro": f"Erro na requisição: {e}", "sucesso": False}
     except Exception as e:
         return {"erro": f"Erro inesperado: {e}", "sucesso": False}
 
-def processar_resposta_distribuicao_dfe(xml_response):
-    """Processa a resposta XML da consulta DistribuicaoDFe"""
+def descompactar_doczip(conteudo_b64):
+    """docZip vem em base64 de um XML compactado com gzip"""
+    conteudo = base64.b64decode(conteudo_b64)
+    if conteudo[:2] == b"\x1f\x8b":
+        conteudo = gzip.decompress(conteudo)
+    return conteudo.decode('utf-8')
+
+# Documentos exibidos na tela por lote; os demais são apenas contados
+LIMITE_PREVIA = 10
+# XMLs brutos da distribuição, por CNPJ interessado: data/xmls/dfe/<cnpj>/<nsu>-<schema>.xml
+DFE_DIR = "data/xmls/dfe"
+
+def _gravar_xml_bruto(cnpj_interessado, nsu, schema, conteudo_xml):
+    """Grava o XML descompactado em disco e retorna o caminho"""
+    pasta = os.path.join(DFE_DIR, texto.somente_digitos(cnpj_interessado or "") or "sem_cnpj")
+    os.makedirs(pasta, exist_ok=True)
+    nome_schema = schema.split("_v")[0].replace(".xsd", "") or "doc"
+    caminho = os.path.join(pasta, f"{nsu}-{nome_schema}.xml")
+    with open(caminho, "w", encoding="utf-8") as f:
+        f.write(conteudo_xml)
+    return caminho
+
+def iterar_documentos_distribuicao(ret_dist_dfe, cnpj_interessado=None):
+    """
+    Gera um DocumentoDFe por docZip do lote (sem o XML), gravando o XML bruto
+    em disco à medida que avança. Os eventos do lote são gravados de uma vez
+    ao final da iteração.
+    """
+    eventos_lote = []
+    
+    for doc in ret_dist_dfe.iter():
+        if not doc.tag.endswith("docZip") or not doc.text:
+            continue
+        documento = DocumentoDFe(nsu=doc.get('NSU', 'N/A'), schema=doc.get('schema', 'N/A'))
+        
+        try:
+            # Decodifica o conteúdo base64
+            conteudo_xml = descompactar_doczip(doc.text)
+            documento.arquivo = _gravar_xml_bruto(cnpj_interessado, documento.nsu, documento.schema, conteudo_xml)
+
+            # O atributo schema do docZip é o nome do XSD ("procNFe_v4.00.xsd")
+            if esquemas.VALIDAR_ESQUEMA:
+                validacao = esquemas.validar(conteudo_xml, documento.schema)
+                if not validacao.valido:
+                    raise ValueError(f"fora do esquema {documento.schema}: {'; '.join(validacao.erros)}")
+
+            # Processa diferentes tipos de documento
+            if 'resNFe' in documento.schema:
+                documento.registro = processar_resumo_nfe(conteudo_xml, cnpj_interessado)
+            elif 'procNFe' in documento.schema:
+                documento.registro = processar_nfe_completa(conteudo_xml)
+            elif 'resEvento' in documento.schema or 'procEventoNFe' in documento.schema:
+                documento.registro = processar_evento_nfe(conteudo_xml)
+                documento.registro.nsu = documento.nsu
+                eventos_lote.append(documento.registro)
+            
+        except Exception as e:
+            documento.erro = f"Erro ao processar documento: {e}"
+        
+        yield documento
+    
+    # Eventos do lote são gravados de uma vez, junto com a situação das notas
+    salvar_eventos_no_banco(eventos_lote)
+
+def processar_resposta_distribuicao_dfe(xml_response, cnpj_interessado=None, limite_previa=LIMITE_PREVIA):
+    """
+    Processa a resposta XML da consulta DistribuicaoDFe.
+    Retorna apenas contagens e uma prévia de até `limite_previa` documentos;
+    os XMLs ficam em disco (atributo `arquivo` de cada DocumentoDFe).
+    """
     try:
         # Parse do XML de resposta
         root = ET.fromstring(xml_response)
         
-        # Namespaces comuns da NFe
-        namespaces = {
-            'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
-            'nfe': 'http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe',
-            'ns': 'http://www.portalfiscal.inf.br/nfe'
-        }
-        
-        # Procura por elementos de retorno
-        ret_dist_dfe = root.find('.//ns:retDistDFeInt', namespaces)
-        
-        if ret_dist_dfe is None:
-            # Tenta sem namespace
-            ret_dist_dfe = root.find('.//retDistDFeInt')
+        # Procura por elementos de retorno (com ou sem namespace)
+        ret_dist_dfe = _buscar(root, 'retDistDFeInt')
         
         if ret_dist_dfe is None:
             return {"erro": "Resposta inválida da SEFAZ", "sucesso": False, "xml_completo": xml_response}
         
-        # Extrai informações básicas
-        codigo_status = ret_dist_dfe.find('.//cStat')
-        motivo = ret_dist_dfe.find('.//xMotivo')
-        ultimo_nsu = ret_dist_dfe.find('.//ultNSU')
-        max_nsu = ret_dist_dfe.find('.//maxNSU')
-        
         resultado = {
             "sucesso": True,
-            "codigo_status": codigo_status.text if codigo_status is not None else "N/A",
-            "motivo": motivo.text if motivo is not None else "N/A",
-            "ultimo_nsu": ultimo_nsu.text if ultimo_nsu is not None else "000000000000000",
-            "max_nsu": max_nsu.text if max_nsu is not None else "000000000000000",
+            "codigo_status": _texto(ret_dist_dfe, 'cStat'),
+            "motivo": _texto(ret_dist_dfe, 'xMotivo'),
+            "ultimo_nsu": _texto(ret_dist_dfe, 'ultNSU', "000000000000000"),
+            "max_nsu": _texto(ret_dist_dfe, 'maxNSU', "000000000000000"),
+            "total_documentos": 0,
+            "processados": 0,
+            "por_tipo": {},
             "documentos": []
         }
         
-        # Processa documentos encontrados
-        documentos = ret_dist_dfe.findall('.//loteDistDFeInt/docZip')
-        
-        for doc in documentos:
-            nsu = doc.get('NSU', 'N/A')
-            schema = doc.get('schema', 'N/A')
-            
-            # Decodifica o conteúdo base64
-            try:
-                conteudo_b64 = doc.text
-                if conteudo_b64:
-                    conteudo_xml = base64.b64decode(conteudo_b64).decode('utf-8')
-                    
-                    # Processa diferentes tipos de documento
-                    if 'resNFe' in schema:
-                        doc_info = processar_resumo_nfe(conteudo_xml)
-                    elif 'procNFe' in schema:
-                        doc_info = processar_nfe_completa(conteudo_xml)
-                    elif 'resEvento' in schema:
-                        doc_info = processar_evento_nfe(conteudo_xml)
-                    else:
-                        doc_info = {"tipo": schema, "processado": False}
-                    
-                    doc_info.update({
-                        "nsu": nsu,
-                        "schema": schema,
-                        "xml_original": conteudo_xml
-                    })
-                    
-                    resultado["documentos"].append(doc_info)
-                    
-            except Exception as e:
-                resultado["documentos"].append({
-                    "nsu": nsu,
-                    "schema": schema,
-                    "erro": f"Erro ao processar documento: {e}"
-                })
+        for documento in iterar_documentos_distribuicao(ret_dist_dfe, cnpj_interessado):
+            resultado["total_documentos"] += 1
+            if documento.processado:
+                resultado["processados"] += 1
+            resultado["por_tipo"][documento.tipo] = resultado["por_tipo"].get(documento.tipo, 0) + 1
+            if len(resultado["documentos"]) < limite_previa:
+                resultado["documentos"].append(documento)
         
         return resultado
         
@@ -175,103 +259,96 @@ def processar_resposta_distribuicao_dfe(xml_response):
     except Exception as e:
         return {"erro": f"Erro ao processar resposta: {e}", "sucesso": False}
 
-def processar_resumo_nfe(xml_content):
-    """Processa resumo de NFe e salva no banco"""
-    try:
-        root = ET.fromstring(xml_content)
-        
-        # Extrai dados do resumo
-        dados = {
-            "tipo": "NFe_Resumo",
-            "chave": root.get('chNFe', 'N/A'),
-            "cnpj_emitente": root.get('CNPJ', 'N/A'),
-            "nome_emitente": root.get('xNome', 'N/A'),
-            "data_emissao": root.get('dhEmi', 'N/A'),
-            "valor_total": float(root.get('vNF', 0)),
-            "situacao": root.get('cSitNFe', 'N/A'),
-            "processado": True
-        }
-        
-        # Salva no banco de dados
-        salvar_documento_no_banco(dados)
-        
-        return dados
-        
-    except Exception as e:
-        return {"tipo": "NFe_Resumo", "erro": f"Erro ao processar resumo: {e}", "processado": False}
+def processar_resumo_nfe(xml_content, cnpj_interessado=None):
+    """Processa resumo de NFe e salva no banco (e na fila de download do XML completo)"""
+    root = ET.fromstring(xml_content)
+    
+    chave = chave_acesso(_texto(root, 'chNFe', None))
+    if chave is None:
+        raise ValueError("Resumo sem chave de acesso válida")
+    
+    resumo = ResumoNFe(
+        chave=chave,
+        cnpj_emitente=_texto(root, 'CNPJ', None) or _texto(root, 'CPF', None),
+        nome_emitente=_texto(root, 'xNome', None),
+        data_emissao=_texto(root, 'dhEmi', None),
+        valor_total_centavos=centavos(_texto(root, 'vNF', None)),
+        situacao=eventos.SITUACOES_RESUMO.get(_texto(root, 'cSitNFe'), "autorizada"),
+    )
+    
+    # Salva no banco de dados
+    salvar_documento_no_banco(resumo, cnpj_interessado)
+    
+    return resumo
 
-def processar_nfe_completa(xml_content):
-    """Processa NFe completa"""
-    try:
-        root = ET.fromstring(xml_content)
-        
-        # Busca dados da NFe
-        inf_nfe = root.find('.//infNFe')
-        emit = root.find('.//emit')
-        total = root.find('.//total/ICMSTot')
-        
-        dados = {
-            "tipo": "NFe_Completa",
-            "chave": inf_nfe.get('Id', 'N/A').replace('NFe', '') if inf_nfe is not None else 'N/A',
-            "cnpj_emitente": emit.find('CNPJ').text if emit is not None and emit.find('CNPJ') is not None else 'N/A',
-            "nome_emitente": emit.find('xNome').text if emit is not None and emit.find('xNome') is not None else 'N/A',
-            "valor_total": float(total.find('vNF').text) if total is not None and total.find('vNF') is not None else 0,
-            "processado": True
-        }
-        
-        # Salva no banco de dados
-        salvar_documento_no_banco(dados)
-        
-        return dados
-        
-    except Exception as e:
-        return {"tipo": "NFe_Completa", "erro": f"Erro ao processar NFe: {e}", "processado": False}
+def processar_nfe_completa(xml_content, salvar=True):
+    """Processa NFe completa (cabeçalho e itens)"""
+    nota = nfe.extrair_nfe(xml_content)
+    
+    # Salva no banco de dados
+    if salvar:
+        salvar_documento_no_banco(nota)
+    
+    return nota
 
 def processar_evento_nfe(xml_content):
     """Processa eventos de NFe (cancelamento, carta de correção, etc.)"""
+    root = ET.fromstring(xml_content)
+    
+    # resEvento traz os campos na raiz; procEventoNFe dentro de evento/infEvento e retEvento
+    chave = chave_acesso(_texto(root, 'chNFe', None))
+    if chave is None:
+        raise ValueError("Evento sem chave de acesso válida")
+    
+    return EventoNFe(
+        chave=chave,
+        tipo_evento=_texto(root, 'tpEvento', None),
+        sequencia=int(_texto(root, 'nSeqEvento', 1)),
+        descricao=_texto(root, 'xEvento', None) or _texto(root, 'descEvento', None),
+        data_evento=_texto(root, 'dhEvento', None),
+        protocolo=_texto(root, 'nProt', None),
+    )
+
+def salvar_documento_no_banco(registro, cnpj_interessado=None):
+    """Salva um ResumoNFe ou NotaFiscal (com itens) no banco de dados"""
     try:
-        root = ET.fromstring(xml_content)
+        conn = database.get_connection()
         
-        dados = {
-            "tipo": "Evento_NFe",
-            "chave": root.get('chNFe', 'N/A'),
-            "tipo_evento": root.get('tpEvento', 'N/A'),
-            "descricao": root.get('xEvento', 'N/A'),
-            "processado": True
-        }
+        nfe.salvar_nota(conn, registro, datetime.now().isoformat())
+        if registro.tipo == "NFe_Completa":
+            nfe.salvar_totais(conn, registro)
+            nfe.salvar_itens(conn, registro)
+        eventos.aplicar_situacao(conn, [registro.chave])
         
-        return dados
+        # Resumos entram na fila de download do XML completo (procNFe)
+        if registro.tipo == "NFe_Resumo" and cnpj_interessado:
+            from modules import download_xml
+            download_xml.enfileirar(conn, [(registro.chave, cnpj_interessado)])
+        
+        conn.commit()
+        conn.close()
         
     except Exception as e:
-        return {"tipo": "Evento_NFe", "erro": f"Erro ao processar evento: {e}", "processado": False}
+        print(f"Erro ao salvar no banco: {e}")
 
-def salvar_documento_no_banco(dados):
-    """Salva documento no banco de dados"""
+def salvar_eventos_no_banco(lista_eventos):
+    """Salva um lote de eventos e atualiza a situação das notas na mesma transação"""
+    if not lista_eventos:
+        return
     try:
         conn = database.get_connection()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            INSERT OR REPLACE INTO notas 
-            (tipo, numero, cnpj_emitente, nome_emitente, valor_total, data_sincronizacao) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            dados.get('tipo', 'N/A'),
-            dados.get('chave', 'N/A'),
-            dados.get('cnpj_emitente', 'N/A'),
-            dados.get('nome_emitente', 'N/A'),
-            dados.get('valor_total', 0),
-            datetime.now().isoformat()
-        ))
-        
+        eventos.salvar_eventos(conn, lista_eventos)
         conn.commit()
         conn.close()
         
     except Exception as e:
-        print(f"Erro ao salvar no banco: {e}")
+        print(f"Erro ao salvar eventos no banco: {e}")
 
-def consultar_e_sincronizar_nfes(cert_path, senha, ambiente="producao"):
-    """Função principal para consultar e sincronizar NFes"""
+def consultar_e_sincronizar_nfes(cert_path, senha, ambiente="producao", parar=None):
+    """
+    Função principal para consultar e sincronizar NFes. Se o evento `parar`
+    (trava perdida) for sinalizado durante a consulta, o NSU não é salvo.
+    """
     try:
         # Carrega certificado e extrai CNPJ
         with open(cert_path, 'rb') as f:
@@ -283,8 +360,14 @@ def consultar_e_sincronizar_nfes(cert_path, senha, ambiente="producao"):
         if not cnpj:
             return {"erro": "Não foi possível extrair CNPJ do certificado", "sucesso": False}
         
-        # Consulta documentos na SEFAZ
-        resultado = consultar_notas_distribuicao_dfe(cert_pem_path, cnpj, ambiente)
+        # Consulta documentos na SEFAZ a partir do último NSU deste CNPJ
+        resultado = consultar_notas_distribuicao_dfe(
+            cert_pem_path, cnpj, ambiente, ultimo_nsu=certificados.obter_ultimo_nsu(cnpj)
+        )
+        if parar is not None and parar.is_set():
+            resultado = {"erro": "Sincronização interrompida: trava perdida", "sucesso": False}
+        elif resultado.get("codigo_status") in ("137", "138"):
+            certificados.salvar_nsu(cnpj, resultado["ultimo_nsu"], resultado["max_nsu"])
         
         # Remove arquivo temporário
         if os.path.exists(cert_pem_path):
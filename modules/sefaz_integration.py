@@ -3,10 +3,13 @@ import os
 import time
 import json
 from datetime import datetime, timedelta
-from modules.sefaz_connector import consultar_e_sincronizar_nfes
-from modules import database
+from modules import database, certificados, travas
+from modules.registros import reais
 
+# Arquivo legado: a última sincronização agora fica no banco (controle_execucao)
 SYNC_FILE = "data/ultima_sincronizacao.json"
+TRAVA_SYNC = "sincronizacao_sefaz"
+INTERVALO_SYNC = timedelta(hours=1)
 CERT_FILE = "data/certificados/certificado_a1.pfx"
 
 # Recupera variáveis de ambiente
@@ -14,16 +17,21 @@ CERT_PASSWORD_ENV = os.environ.get("CERT_PASSWORD")
 CNPJ = os.environ.get("CNPJ")
 
 def get_last_sync():
-    if os.path.exists(SYNC_FILE):
+    ultima = travas.ultima_execucao(TRAVA_SYNC)
+    if ultima is None and os.path.exists(SYNC_FILE):
+        # Migra o registro do arquivo JSON antigo para o banco
         with open(SYNC_FILE, "r") as f:
             data = json.load(f)
-        return datetime.fromisoformat(data.get("ultima_execucao"))
-    return None
+        ultima = datetime.fromisoformat(data.get("ultima_execucao"))
+        travas.registrar_execucao(TRAVA_SYNC, ultima)
+    return ultima
 
 def set_last_sync():
-    os.makedirs("data", exist_ok=True)
-    with open(SYNC_FILE, "w") as f:
-        json.dump({"ultima_execucao": datetime.now().isoformat()}, f)
+    travas.registrar_execucao(TRAVA_SYNC)
+
+def nova_trava_sync():
+    """Trava compartilhada entre réplicas: uma sincronização por vez, no máximo uma por hora"""
+    return travas.Trava(TRAVA_SYNC, intervalo_minimo=INTERVALO_SYNC)
 
 def save_cert(cert_bytes):
     os.makedirs("data/certificados", exist_ok=True)
@@ -80,115 +88,239 @@ def render():
     # Upload certificado A1
     st.subheader("🔐 Certificado Digital A1")
     uploaded_cert = st.file_uploader("Selecione seu arquivo .pfx", type=["pfx"], key="upload_cert")
+    apelido = st.text_input("Nome do estabelecimento (opcional)", key="apelido_cert")
     
     # Prioriza senha do certificado via variável de ambiente
     senha = CERT_PASSWORD_ENV if CERT_PASSWORD_ENV else st.text_input("Senha do certificado", type="password", key="senha_cert")
 
     if uploaded_cert and senha:
         save_cert(uploaded_cert.getvalue())
-        st.success("✅ Certificado armazenado com sucesso.")
+        try:
+            # Também registra no cadastro de estabelecimentos (um certificado por CNPJ)
+            cnpj_cert = certificados.registrar_certificado(uploaded_cert.getvalue(), senha, apelido or None)
+            st.success(f"✅ Certificado do CNPJ {cnpj_cert} armazenado com sucesso.")
+        except Exception as e:
+            st.success("✅ Certificado armazenado com sucesso.")
+            st.warning(f"⚠️ Certificado não registrado como estabelecimento: {e}")
         st.info("Mantenha seu certificado em local seguro.")
 
-    # Sincronização com controle de 1 hora
-    last_sync = get_last_sync()
-    
+    cadastrados = certificados.listar_certificados(somente_ativos=False)
+    estabelecimentos = [e for e in cadastrados if e["ativo"]]
+    if cadastrados:
+        with st.expander(f"🏢 Estabelecimentos cadastrados ({len(estabelecimentos)} ativos de {len(cadastrados)})"):
+            # Inativos ficam fora da sincronização em grupo e do download de XMLs
+            editados = st.data_editor(
+                [{"Ativo": bool(e["ativo"]), "CNPJ": e["cnpj"], "Nome": e["apelido"] or "", "UF": e["uf"],
+                  "Validade": e["validade"]} for e in cadastrados],
+                disabled=["CNPJ", "Nome", "UF", "Validade"],
+                use_container_width=True,
+                hide_index=True,
+                key="editor_estabelecimentos"
+            )
+            alterados = [(e["cnpj"], linha["Ativo"]) for e, linha in zip(cadastrados, editados) if linha["Ativo"] != bool(e["ativo"])]
+            for cnpj, ativo in alterados:
+                certificados.definir_ativo(cnpj, ativo)
+            if alterados:
+                st.rerun()
+
+    # Sincronização com controle de 1 hora (trava no banco, compartilhada entre réplicas)
     # Sempre usar ambiente de produção
     ambiente = "producao"
     st.info("🌐 **Ambiente:** Produção (dados reais da SEFAZ)")
     
-    col_sync1, col_sync2 = st.columns([1, 1])
+    col_sync1, col_sync2, col_sync3 = st.columns([1, 1, 1])
     
     with col_sync1:
         sync_button = st.button("🔄 Sincronizar com SEFAZ", type="primary", use_container_width=True)
     
     with col_sync2:
+        sync_grupo_button = st.button(
+            "🏢 Sincronizar todos os CNPJs",
+            use_container_width=True,
+            disabled=len(estabelecimentos) < 2
+        )
+    
+    with col_sync3:
         if st.button("📊 Ver Notas Sincronizadas", use_container_width=True):
             st.session_state.show_notas = True
     
+    if sync_grupo_button:
+        trava = nova_trava_sync()
+        if not trava.adquirir():
+            st.warning(f"⚠️ {trava.motivo}")
+        else:
+            resultado_grupo = {}
+            try:
+                with st.spinner(f"🔍 Consultando SEFAZ para {len(estabelecimentos)} estabelecimentos em paralelo..."):
+                    from modules.sincronizacao import sincronizar_grupo
+
+                    resultado_grupo = sincronizar_grupo(ambiente=ambiente, parar=trava.perdida)
+            finally:
+                # A última sincronização só é registrada se houve sucesso
+                trava.liberar(concluida=bool(resultado_grupo.get("sucesso")))
+
+            if resultado_grupo.get("sucesso"):
+                st.success(f"✅ Sincronização concluída em {resultado_grupo['tempo_total']:.1f}s")
+            else:
+                st.error(f"❌ Erro na sincronização: {resultado_grupo.get('erro', 'Nenhum CNPJ sincronizado')}")
+
+            if resultado_grupo.get("resultados"):
+                st.dataframe(
+                    [{
+                        "CNPJ": r["cnpj"],
+                        "Nome": r.get("apelido") or "",
+                        "Lotes": r["lotes"],
+                        "Documentos": r["documentos"],
+                        "Processados": r["processados"],
+                        "Último NSU": r.get("ultimo_nsu", ""),
+                        "Tempo (s)": round(r.get("tempo", 0), 1),
+                        "Status": r.get("erro") or f"{r.get('codigo_status')} - {r.get('motivo')}",
+                    } for r in resultado_grupo["resultados"]],
+                    use_container_width=True,
+                    hide_index=True
+                )
+    
     if sync_button:
+        trava = nova_trava_sync()
         if not os.path.exists(CERT_FILE):
             st.error("❌ Nenhum certificado encontrado. Faça o upload primeiro.")
-        elif not last_sync or datetime.now() - last_sync >= timedelta(hours=1):
-            if not senha:
-                st.error("❌ Não foi possível obter a senha do certificado.")
-            else:
+        elif not senha:
+            st.error("❌ Não foi possível obter a senha do certificado.")
+        elif not trava.adquirir():
+            # Outra réplica está sincronizando ou a última sincronização foi há menos de 1 hora
+            st.warning(f"⚠️ {trava.motivo}")
+        else:
+            resultado = {}
+            try:
                 with st.spinner("🔍 Consultando SEFAZ... Isso pode levar alguns minutos."):
+                    # Importado sob demanda: carrega requests e OpenSSL apenas ao sincronizar
+                    from modules.sefaz_connector import consultar_e_sincronizar_nfes
+
                     # Chama a integração real
-                    resultado = consultar_e_sincronizar_nfes(CERT_FILE, senha, ambiente)
-                    
-                    if resultado.get("sucesso"):
-                        set_last_sync()
-                        
-                        st.success("✅ Sincronização concluída com sucesso!")
-                        
-                        # Estatísticas
-                        documentos = resultado.get("documentos", [])
-                        total_docs = len(documentos)
-                        processados = len([d for d in documentos if d.get("processado", False)])
-                        
-                        col_stat1, col_stat2, col_stat3 = st.columns(3)
-                        with col_stat1:
-                            st.metric("📄 Documentos Encontrados", total_docs)
-                        with col_stat2:
-                            st.metric("✅ Processados", processados)
-                        with col_stat3:
-                            st.metric("⚠️ Erros", total_docs - processados)
-                        
-                        # Detalhes dos documentos
-                        if documentos:
-                            st.subheader("📋 Documentos Sincronizados")
-                            for i, doc in enumerate(documentos[:10]):  # Mostra apenas os primeiros 10
-                                with st.expander(f"📄 {doc.get('tipo', 'N/A')} - NSU: {doc.get('nsu', 'N/A')}"):
-                                    if doc.get("processado"):
-                                        st.write(f"**Chave:** {doc.get('chave', 'N/A')}")
-                                        st.write(f"**Emitente:** {doc.get('nome_emitente', 'N/A')}")
-                                        st.write(f"**CNPJ:** {doc.get('cnpj_emitente', 'N/A')}")
-                                        if doc.get('valor_total'):
-                                            st.write(f"**Valor:** R$ {doc.get('valor_total', 0):.2f}")
-                                    else:
-                                        st.error(f"Erro: {doc.get('erro', 'Não especificado')}")
-                                        
-                            if len(documentos) > 10:
-                                st.info(f"... e mais {len(documentos) - 10} documentos")
-                        
-                        # Informações da consulta
-                        st.info(f"📊 Status SEFAZ: {resultado.get('codigo_status')} - {resultado.get('motivo')}")
-                        st.info(f"🔢 Último NSU processado: {resultado.get('ultimo_nsu')}")
-                        
-                    else:
-                        st.error(f"❌ Erro na sincronização: {resultado.get('erro', 'Erro desconhecido')}")
-                        
-                        # Debug information
-                        if st.checkbox("🔧 Mostrar detalhes técnicos"):
-                            st.text_area("XML de resposta:", resultado.get('xml_completo', 'N/A'), height=200)
-        else:
-            restante = timedelta(hours=1) - (datetime.now() - last_sync)
-            minutos = int(restante.total_seconds() // 60)
-            st.warning(f"⚠️ Você já sincronizou há menos de 1 hora. Tente novamente em {minutos} minutos.")
+                    resultado = consultar_e_sincronizar_nfes(CERT_FILE, senha, ambiente, parar=trava.perdida)
+            finally:
+                trava.liberar(concluida=bool(resultado.get("sucesso")))
+            
+            if resultado.get("sucesso"):
+                st.success("✅ Sincronização concluída com sucesso!")
+                
+                # Estatísticas
+                documentos = resultado.get("documentos", [])
+                total_docs = resultado.get("total_documentos", 0)
+                processados = resultado.get("processados", 0)
+                
+                col_stat1, col_stat2, col_stat3 = st.columns(3)
+                with col_stat1:
+                    st.metric("📄 Documentos Encontrados", total_docs)
+                with col_stat2:
+                    st.metric("✅ Processados", processados)
+                with col_stat3:
+                    st.metric("⚠️ Erros", total_docs - processados)
+                
+                # Detalhes dos documentos
+                if documentos:
+                    st.subheader("📋 Documentos Sincronizados")
+                    # O conector devolve apenas uma prévia; o XML de cada documento fica em disco
+                    for doc in documentos:
+                        with st.expander(f"📄 {doc.tipo} - NSU: {doc.nsu}"):
+                            if doc.processado:
+                                registro = doc.registro
+                                st.write(f"**Chave:** {registro.chave}")
+                                st.write(f"**Emitente:** {getattr(registro, 'nome_emitente', None) or 'N/A'}")
+                                st.write(f"**CNPJ:** {getattr(registro, 'cnpj_emitente', None) or 'N/A'}")
+                                if getattr(registro, 'valor_total_centavos', 0):
+                                    st.write(f"**Valor:** R$ {reais(registro.valor_total_centavos):.2f}")
+                            else:
+                                st.error(f"Erro: {doc.erro or 'Documento não processado'}")
+                                
+                    if total_docs > len(documentos):
+                        st.info(f"... e mais {total_docs - len(documentos)} documentos")
+                
+                # Informações da consulta
+                st.info(f"📊 Status SEFAZ: {resultado.get('codigo_status')} - {resultado.get('motivo')}")
+                st.info(f"🔢 Último NSU processado: {resultado.get('ultimo_nsu')}")
+                
+            else:
+                st.error(f"❌ Erro na sincronização: {resultado.get('erro', 'Erro desconhecido')}")
+                
+                # Debug information
+                if st.checkbox("🔧 Mostrar detalhes técnicos"):
+                    st.text_area("XML de resposta:", resultado.get('xml_completo', 'N/A'), height=200)
+    
+    # Estado do agendador adaptativo (esperas, backoff e circuito por CNPJ)
+    from modules.agendador_sefaz import agendador
+    situacao_agendador = agendador.situacao()
+    if situacao_agendador:
+        with st.expander("⏱️ Agendamento de consultas à SEFAZ"):
+            st.dataframe(
+                [{
+                    "CNPJ": s["cnpj"],
+                    "Serviço": s["endpoint"],
+                    "Circuito": s["circuito"],
+                    "Próxima consulta em (min)": round(s["espera"] / 60, 1),
+                    "Motivo": s["motivo"],
+                } for s in situacao_agendador],
+                use_container_width=True,
+                hide_index=True
+            )
+    
+    # Download do XML completo das notas que vieram apenas como resumo
+    from modules import download_xml
+    fila = download_xml.contagem_por_status()
+    if fila:
+        with st.expander(f"⬇️ XML completo das notas resumidas ({sum(fila.values())} na fila)"):
+            st.write(", ".join(f"**{status}:** {qtd}" for status, qtd in sorted(fila.items())))
+            if st.button("⬇️ Baixar XMLs pendentes"):
+                with st.spinner("📥 Baixando XMLs completos da SEFAZ..."):
+                    resultado_download = download_xml.executar_downloads(ambiente)
+                if resultado_download.get("erro"):
+                    st.warning(f"⚠️ {resultado_download['erro']}")
+                else:
+                    st.success(f"✅ Concluído em {resultado_download['tempo']:.1f}s: {resultado_download['contagem']}")
     
     # Mostrar notas sincronizadas
     if st.session_state.get('show_notas', False):
         st.markdown("---")
         st.subheader("📊 Notas Fiscais Sincronizadas")
         
-        conn = database.get_connection()
+        from modules import arquivamento
+
+        col_filtro1, col_filtro2 = st.columns(2)
+        filtro_situacao = col_filtro1.selectbox("Situação:", ["Todas", "Autorizadas", "Canceladas", "Denegadas"])
+        situacao = {"Autorizadas": "autorizada", "Canceladas": "cancelada", "Denegadas": "denegada"}.get(filtro_situacao)
+        # Notas antigas saem do banco principal: o ano arquivado é lido junto com o principal
+        anos_arquivados = sorted(arquivamento.particoes(), reverse=True)
+        ano = col_filtro2.selectbox(
+            "Emissão:", [None] + anos_arquivados,
+            format_func=lambda valor: "Banco ativo" if valor is None else f"{valor} (com arquivo)"
+        )
+        
+        conn = arquivamento.conectar(ano, ano) if ano else database.get_connection()
         
         try:
             import pandas as pd
-            df = pd.read_sql_query("""
-                SELECT tipo, numero, cnpj_emitente, nome_emitente, valor_total, data_sincronizacao
-                FROM notas 
-                WHERE data_sincronizacao IS NOT NULL
+            # Com situação definida a consulta usa o índice (situacao, data_sincronizacao)
+            if situacao:
+                where, params = "WHERE situacao = ? AND data_sincronizacao IS NOT NULL", (situacao,)
+            else:
+                where, params = "WHERE data_sincronizacao IS NOT NULL", ()
+            if ano:
+                where += f" AND {arquivamento.DATA_NOTA} >= ? AND {arquivamento.DATA_NOTA} < ?"
+                params += (str(ano), str(ano + 1))
+            df = pd.read_sql_query(f"""
+                SELECT tipo, numero, cnpj_emitente, nome_emitente, valor_total, situacao, data_sincronizacao
+                FROM {"historico_notas" if ano else "notas"} 
+                {where}
                 ORDER BY data_sincronizacao DESC
                 LIMIT 50
-            """, conn)
+            """, conn, params=params)
             
             if not df.empty:
                 # Formatar valores
                 df['valor_total'] = df['valor_total'].apply(lambda x: f"R$ {x:.2f}" if x > 0 else "N/A")
                 df['data_sincronizacao'] = pd.to_datetime(df['data_sincronizacao']).dt.strftime('%d/%m/%Y %H:%M')
                 
-                df.columns = ['Tipo', 'Número/Chave', 'CNPJ Emitente', 'Nome Emitente', 'Valor Total', 'Data Sincronização']
+                df.columns = ['Tipo', 'Número/Chave', 'CNPJ Emitente', 'Nome Emitente', 'Valor Total', 'Situação', 'Data Sincronização']
                 
                 st.dataframe(df, use_container_width=True, hide_index=True)
                 st.info(f"📊 Total de {len(df)} notas sincronizadas")
@@ -0,0 +1,115 @@
+# modules/sincronizacao.py
+"""
+Sincronização DistribuicaoDFe de vários CNPJs em paralelo.
+
+Cada CNPJ usa seu próprio certificado, checkpoint de NSU e agendamento de
+chamadas (agendador_sefaz); com paralelismo limitado, o tempo total do grupo
+se aproxima do tempo do CNPJ mais lento em vez da soma de todos.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from modules import certificados, texto
+
+MAX_PARALELO = int(os.environ.get("SEFAZ_MAX_PARALELO", "8"))
+# Cada lote traz até 50 documentos
+MAX_LOTES = 100
+TRAVA_PERDIDA = "Sincronização interrompida: trava perdida"
+
+
+def sincronizar_cnpj(certificado, ambiente="producao", max_lotes=MAX_LOTES, parar=None):
+    """
+    Consulta todos os lotes pendentes de um CNPJ, a partir do seu checkpoint de
+    NSU; para entre um lote e outro se o evento `parar` (trava perdida) for sinalizado.
+    """
+    from modules.sefaz_connector import carregar_certificado, consultar_notas_distribuicao_dfe
+
+    cnpj = certificado["cnpj"]
+    inicio = time.perf_counter()
+    resumo = {
+        "cnpj": cnpj,
+        "apelido": certificado.get("apelido"),
+        "sucesso": False,
+        "lotes": 0,
+        "documentos": 0,
+        "processados": 0,
+    }
+
+    senha = certificados.senha_certificado(cnpj)
+    if not senha:
+        resumo["erro"] = f"Senha não configurada (CERT_PASSWORD_{cnpj})"
+        return resumo
+
+    cert_pem_path = None
+    try:
+        with open(certificado["caminho"], "rb") as f:
+            cert_pem_path, _ = carregar_certificado(f.read(), senha)
+
+        ultimo_nsu = certificados.obter_ultimo_nsu(cnpj)
+        for _ in range(max_lotes):
+            if parar is not None and parar.is_set():
+                # Outra réplica assumiu a sincronização: o checkpoint fica no último lote salvo
+                resumo["erro"] = TRAVA_PERDIDA
+                break
+            resultado = consultar_notas_distribuicao_dfe(
+                cert_pem_path, cnpj, ambiente, certificado.get("uf") or "35", ultimo_nsu
+            )
+            if parar is not None and parar.is_set():
+                # Salvar agora poderia recuar o NSU de quem assumiu a trava
+                resumo["erro"] = TRAVA_PERDIDA
+                break
+            if not resultado.get("sucesso"):
+                resumo["erro"] = resultado.get("erro", "Erro desconhecido")
+                break
+
+            resumo["lotes"] += 1
+            resumo["documentos"] += resultado.get("total_documentos", 0)
+            resumo["processados"] += resultado.get("processados", 0)
+            resumo["codigo_status"] = resultado.get("codigo_status")
+            resumo["motivo"] = resultado.get("motivo")
+            resumo["sucesso"] = True
+
+            # 137: nenhum documento localizado / 138: documentos localizados
+            if resumo["codigo_status"] not in ("137", "138"):
+                break
+            ultimo_nsu = resultado.get("ultimo_nsu", ultimo_nsu)
+            max_nsu = resultado.get("max_nsu", ultimo_nsu)
+            certificados.salvar_nsu(cnpj, ultimo_nsu, max_nsu)
+            resumo["ultimo_nsu"] = ultimo_nsu
+
+            if resumo["codigo_status"] == "137" or int(ultimo_nsu) >= int(max_nsu):
+                break
+
+    except Exception as e:
+        resumo["erro"] = f"Erro na sincronização: {e}"
+    finally:
+        if cert_pem_path and os.path.exists(cert_pem_path):
+            os.unlink(cert_pem_path)
+        resumo["tempo"] = time.perf_counter() - inicio
+
+    return resumo
+
+
+def sincronizar_grupo(cnpjs=None, ambiente="producao", max_paralelo=MAX_PARALELO, parar=None):
+    """Sincroniza todos os estabelecimentos ativos (ou apenas `cnpjs`) em paralelo"""
+    registros = certificados.listar_certificados()
+    if cnpjs:
+        filtro = {texto.somente_digitos(c) for c in cnpjs}
+        registros = [r for r in registros if r["cnpj"] in filtro]
+
+    if not registros:
+        return {"sucesso": False, "erro": "Nenhum certificado ativo cadastrado", "resultados": []}
+
+    inicio = time.perf_counter()
+    resultados = []
+    with ThreadPoolExecutor(max_workers=min(max_paralelo, len(registros))) as executor:
+        futuros = [executor.submit(sincronizar_cnpj, registro, ambiente, parar=parar) for registro in registros]
+        for futuro in as_completed(futuros):
+            resultados.append(futuro.result())
+
+    resultados.sort(key=lambda r: (r.get("apelido") or "", r["cnpj"]))
+    return {
+        "sucesso": any(r["sucesso"] for r in resultados),
+        "resultados": resultados,
+        "tempo_total": time.perf_counter() - inicio,
+    }
@@ -0,0 +1,35 @@
+# modules/texto.py
+"""
+Funções de texto usadas em vários módulos: dígitos de CNPJ/NCM,
+normalização para busca, faixa de prefixo em lista ordenada e nome local
+das tags XML.
+"""
+import re
+import bisect
+import unicodedata
+
+_RE_NAO_DIGITO = re.compile(r"\D")
+_RE_ESPACOS = re.compile(r"\s+")
+
+
+def somente_digitos(texto):
+    """'11.222.333/0001-81' -> '11222333000181'; None -> ''"""
+    return _RE_NAO_DIGITO.sub("", texto or "")
+
+
+def normalizar(texto):
+    """'  Comércio  São João ' -> 'comercio sao joao'"""
+    texto = unicodedata.normalize("NFKD", texto or "").encode("ascii", "ignore").decode()
+    return _RE_ESPACOS.sub(" ", texto).strip().lower()
+
+
+def faixa_prefixo(chaves, prefixo):
+    """(início, fim) das posições da lista ordenada `chaves` que começam com `prefixo`"""
+    inicio = bisect.bisect_left(chaves, prefixo)
+    fim = bisect.bisect_left(chaves, prefixo + "\uffff", inicio)
+    return inicio, fim
+
+
+def local(tag):
+    """Remove o namespace de uma tag ({http://...}nome -> nome)"""
+    return tag.rsplit("}", 1)[-1]
@@ -0,0 +1,149 @@
+# modules/travas.py
+"""
+Travas (leases) com expiração gravadas no SQLite, para coordenar
+sincronizações entre várias réplicas do Streamlit e workers que usam o
+mesmo diretório de dados.
+
+A aquisição roda em BEGIN IMMEDIATE: a verificação do intervalo mínimo
+desde a última execução e a tomada da trava são atômicas entre processos.
+Enquanto a trava está com o dono, uma thread de heartbeat renova a
+expiração; se o processo morrer, a trava expira sozinha.
+"""
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from modules import database
+
+logger = logging.getLogger("fiscal.travas")
+
+TTL_PADRAO = 120  # segundos sem heartbeat até a trava ser considerada abandonada
+
+
+def identificador_processo():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def ultima_execucao(nome):
+    conn = database.get_connection()
+    linha = conn.execute("SELECT ultima_execucao FROM controle_execucao WHERE nome = ?", (nome,)).fetchone()
+    conn.close()
+    return datetime.fromisoformat(linha[0]) if linha and linha[0] else None
+
+
+def registrar_execucao(nome, quando=None, conn=None):
+    proprio = conn is None
+    conn = conn or database.get_connection()
+    conn.execute("""
+        INSERT INTO controle_execucao (nome, ultima_execucao) VALUES (?, ?)
+        ON CONFLICT(nome) DO UPDATE SET ultima_execucao = excluded.ultima_execucao
+    """, (nome, (quando or datetime.now()).isoformat()))
+    if proprio:
+        conn.commit()
+        conn.close()
+
+
+class Trava:
+    def __init__(self, nome, ttl=TTL_PADRAO, intervalo_minimo=None):
+        self.nome = nome
+        self.ttl = ttl
+        # Intervalo mínimo entre execuções concluídas (ex.: 1 hora para a SEFAZ)
+        self.intervalo_minimo = intervalo_minimo
+        self.dono = identificador_processo()
+        self.motivo = None
+        self.perdida = threading.Event()
+        self._parar = threading.Event()
+        self._heartbeat = None
+
+    def adquirir(self):
+        """Tenta obter a trava; em caso de recusa, `motivo` explica o porquê"""
+        conn = database.get_connection()
+        conn.isolation_level = None
+        agora = time.time()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+
+            if self.intervalo_minimo:
+                linha = conn.execute(
+                    "SELECT ultima_execucao FROM controle_execucao WHERE nome = ?", (self.nome,)
+                ).fetchone()
+                if linha and linha[0]:
+                    restante = self.intervalo_minimo - (datetime.now() - datetime.fromisoformat(linha[0]))
+                    if restante > timedelta(0):
+                        conn.execute("ROLLBACK")
+                        self.motivo = (
+                            f"Última execução há menos de {int(self.intervalo_minimo.total_seconds() // 60)} minutos. "
+                            f"Tente novamente em {int(restante.total_seconds() // 60)} minutos."
+                        )
+                        return False
+
+            cur = conn.execute("""
+                INSERT INTO travas (nome, dono, adquirida_em, expira_em, heartbeat_em)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(nome) DO UPDATE SET
+                    dono = excluded.dono,
+                    adquirida_em = excluded.adquirida_em,
+                    expira_em = excluded.expira_em,
+                    heartbeat_em = excluded.heartbeat_em
+                WHERE travas.expira_em < ? OR travas.dono = excluded.dono
+            """, (self.nome, self.dono, datetime.now().isoformat(), agora + self.ttl, agora, agora))
+
+            if cur.rowcount != 1:
+                dono_atual = conn.execute("SELECT dono FROM travas WHERE nome = ?", (self.nome,)).fetchone()
+                conn.execute("ROLLBACK")
+                self.motivo = f"Execução em andamento em outro processo ({dono_atual[0] if dono_atual else 'desconhecido'})."
+                return False
+
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        self.motivo = None
+        self.perdida.clear()
+        self._parar.clear()
+        self._heartbeat = threading.Thread(target=self._renovar_periodicamente, daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def renovar(self):
+        """Estende a expiração; retorna False se a trava não pertence mais a este dono"""
+        agora = time.time()
+        conn = database.get_connection()
+        cur = conn.execute(
+            "UPDATE travas SET expira_em = ?, heartbeat_em = ? WHERE nome = ? AND dono = ?",
+            (agora + self.ttl, agora, self.nome, self.dono)
+        )
+        conn.commit()
+        conn.close()
+        return cur.rowcount == 1
+
+    def _renovar_periodicamente(self):
+        while not self._parar.wait(self.ttl / 3):
+            try:
+                if not self.renovar():
+                    self.perdida.set()
+                    return
+            except Exception as e:
+                # Banco ocupado: tenta de novo no próximo ciclo, ainda dentro do TTL
+                logger.warning("Erro ao renovar trava %s: %s", self.nome, e)
+
+    def liberar(self, concluida=True):
+        """Solta a trava; se `concluida`, registra a execução na mesma transação"""
+        self._parar.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+
+        conn = database.get_connection()
+        cur = conn.execute("DELETE FROM travas WHERE nome = ? AND dono = ?", (self.nome, self.dono))
+        if concluida and cur.rowcount == 1:
+            registrar_execucao(self.nome, conn=conn)
+        conn.commit()
+        conn.close()
@@ -1,8 +1,9 @@
 import streamlit as st
-import xmltodict
-import pandas as pd
 import os
+import xml.etree.ElementTree as ET
+from datetime import datetime
 from modules import database
+from modules.registros import reais
 
 def render():
     st.title("📂 Leitor de XML - NF-e & CT-e")
@@ -10,61 +11,151 @@ def render():
     uploaded_file = st.file_uploader("Selecione o arquivo XML", type=["xml"])
 
     if uploaded_file:
+        # Ingestão, esquemas e assinatura (lxml, cryptography, OpenSSL) só quando há arquivo
+        from modules import ingestao, esquemas, assinatura
+
+        conteudo = uploaded_file.getvalue()
+
+        # Arquivo idêntico (hash) ou mesmo documento (chave) já importado: não reprocessa
+        hash_arquivo = ingestao.hash_conteudo(conteudo)
+        raiz, chave = ingestao.identificar(conteudo)
+        anterior = ingestao.buscar_ingerido(hash_arquivo, chave, raiz)
+        if anterior:
+            exibir_importado(anterior)
+            return
+
         os.makedirs("data/xmls", exist_ok=True)
         xml_path = os.path.join("data/xmls", uploaded_file.name)
         with open(xml_path, "wb") as f:
-            f.write(uploaded_file.read())
+            f.write(conteudo)
 
-        with open(xml_path, "r", encoding="utf-8") as f:
-            xml_content = xmltodict.parse(f.read())
+        if esquemas.VALIDAR_ESQUEMA:
+            validacao = esquemas.validar(conteudo)
+            if not validacao.valido:
+                st.error(f"❌ XML fora do esquema {validacao.esquema or ''}")
+                for erro in validacao.erros:
+                    st.caption(erro)
+                registrar_erro(xml_path, hash_arquivo, "; ".join(validacao.erros))
+                return
 
-        if "nfeProc" in xml_content:
+        if assinatura.VERIFICAR_ASSINATURA and raiz in ("nfeProc", "cteProc"):
+            verificacao = assinatura.verificar(conteudo)
+            if not verificacao.valida:
+                st.error(f"❌ Assinatura digital inválida: {verificacao.motivo}")
+                registrar_erro(xml_path, hash_arquivo, f"Assinatura digital inválida: {verificacao.motivo}")
+                return
+            st.caption(f"🔏 Assinado por {verificacao.titular}"
+                       + ("" if verificacao.cadeia_verificada else " (cadeia do certificado não verificada)"))
+
+        if raiz == "nfeProc":
             st.success("Arquivo identificado como NF-e ✅")
-            parse_nfe(xml_content)
-        elif "cteProc" in xml_content:
+            parse_nfe(xml_path, hash_arquivo)
+        elif raiz == "cteProc":
             st.success("Arquivo identificado como CT-e ✅")
-            parse_cte(xml_content)
+            parse_cte(xml_path, hash_arquivo)
         else:
             st.error("Não foi possível identificar o tipo de XML.")
 
-def parse_nfe(xml_content):
-    nfe = xml_content["nfeProc"]["NFe"]["infNFe"]
-    emit = nfe["emit"]
-    total = nfe["total"]["ICMSTot"]
+def exibir_importado(anterior):
+    """Mostra o que já está gravado para o documento, sem ler o XML de novo"""
+    quando = (anterior["ingerido_em"] or "")[:16].replace("T", " ")
+    st.info(f"Documento já importado em {quando} ({anterior['caminho']}). Leitura ignorada.")
+    notas = None
+    if anterior["chave"]:
+        # A nota pode já ter sido arquivada: consulta também o arquivo do ano da chave
+        from modules import arquivamento
+        ano = arquivamento.ano_da_chave(anterior["chave"])
+        notas = arquivamento.consultar(
+            "SELECT tipo, nome_emitente, cnpj_emitente, valor_total, situacao FROM historico_notas WHERE numero = ?",
+            (anterior["chave"],), ano, ano
+        )
+    if notas:
+        tipo, nome, cnpj, valor_total, situacao = notas[0]
+        st.write(f"**Tipo:** {tipo}")
+        st.write(f"**Emitente:** {nome or 'N/A'}")
+        st.write(f"**CNPJ:** {cnpj or 'N/A'}")
+        st.write(f"**Valor Total:** R$ {valor_total or 0:.2f}")
+        st.write(f"**Situação:** {situacao}")
+
+def registrar_erro(xml_path, hash_arquivo, erro):
+    from modules import ingestao
+    conn = database.get_connection()
+    ingestao.registrar_ingeridos(conn, [ingestao.linha_ingerido(xml_path, hash_arquivo, None, erro)])
+    conn.commit()
+    conn.close()
 
-    cnpj = emit.get("CNPJ", "N/A")
-    nome = emit.get("xNome", "N/A")
-    valor_total = float(total.get("vNF", 0))
+def parse_nfe(xml_path, hash_arquivo=None):
+    from modules import nfe, ncm, eventos, ingestao, cte
+    try:
+        nota = nfe.extrair_nfe(xml_path, tipo="NFe")
+    except (ET.ParseError, ValueError) as e:
+        st.error(f"Erro ao ler a NF-e: {e}")
+        if hash_arquivo:
+            registrar_erro(xml_path, hash_arquivo, str(e))
+        return
 
     st.subheader("🧾 Dados da NF-e")
-    st.write(f"**Emitente:** {nome}")
-    st.write(f"**CNPJ:** {cnpj}")
-    st.write(f"**Valor Total:** R$ {valor_total:.2f}")
+    st.write(f"**Emitente:** {nota.nome_emitente or 'N/A'}")
+    st.write(f"**CNPJ:** {nota.cnpj_emitente or 'N/A'}")
+    st.write(f"**Valor Total:** R$ {reais(nota.valor_total_centavos):.2f}")
+    if nota.itens:
+        st.write(f"**Itens:** {len(nota.itens)}")
+    invalidos = ncm.validar_itens(nota.itens)
+    if invalidos:
+        st.warning("⚠️ NCM fora da tabela vigente: " + ", ".join(
+            f"{codigo or '(vazio)'} (itens {', '.join(map(str, itens))})" for codigo, itens in invalidos.items()
+        ))
 
     conn = database.get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO notas (tipo, numero, cnpj_emitente, nome_emitente, valor_total) VALUES (?, ?, ?, ?, ?)",
-                ("NFe", nfe["@Id"], cnpj, nome, valor_total))
+    nfe.salvar_nota(conn, nota, datetime.now().isoformat())
+    nfe.salvar_totais(conn, nota)
+    nfe.salvar_itens(conn, nota)
+    eventos.aplicar_situacao(conn, [nota.chave])
+    if hash_arquivo:
+        ingestao.registrar_ingeridos(conn, [ingestao.linha_ingerido(xml_path, hash_arquivo, nota, raiz="nfeProc")])
     conn.commit()
     conn.close()
 
-def parse_cte(xml_content):
-    cte = xml_content["cteProc"]["CTe"]["infCte"]
-    emit = cte["emit"]
-    vPrest = cte["vPrest"]
+    # CT-e que já chegaram para esta nota (o valor de cada um é rateado entre as NF-e que transporta),
+    # inclusive os já arquivados: o CT-e é do ano da nota ou do seguinte
+    from modules import arquivamento
+    ano = arquivamento.ano_da_chave(nota.chave)
+    conn = arquivamento.conectar(ano, ano + 1)
+    try:
+        fretes = cte.custo_frete_por_nfe(conn, [nota.chave], historico=True)
+    finally:
+        conn.close()
+    for _, qtd_ctes, frete_total, frete_rateado in fretes:
+        st.write(f"**Frete (CT-e):** R$ {frete_rateado:.2f} rateado de R$ {frete_total:.2f} em {qtd_ctes} CT-e")
 
-    cnpj = emit.get("CNPJ", "N/A")
-    nome = emit.get("xNome", "N/A")
-    valor_total = float(vPrest.get("vTPrest", 0))
+def parse_cte(xml_path, hash_arquivo=None):
+    from modules import cte, nfe, ingestao
+    try:
+        dados = cte.extrair_cte(xml_path)
+    except (ET.ParseError, ValueError) as e:
+        st.error(f"Erro ao ler o CT-e: {e}")
+        if hash_arquivo:
+            registrar_erro(xml_path, hash_arquivo, str(e))
+        return
 
     st.subheader("🚚 Dados do CT-e")
-    st.write(f"**Emitente:** {nome}")
-    st.write(f"**CNPJ:** {cnpj}")
-    st.write(f"**Valor Total:** R$ {valor_total:.2f}")
+    st.write(f"**Emitente:** {dados.nome_emitente or 'N/A'}")
+    st.write(f"**CNPJ:** {dados.cnpj_emitente or 'N/A'}")
+    st.write(f"**Remetente:** {dados.nome_remetente or 'N/A'}")
+    st.write(f"**Destinatário:** {dados.nome_destinatario or 'N/A'}")
+    st.write(f"**Tomador:** {dados.nome_tomador or 'N/A'} ({dados.tipo_tomador or 'N/A'})")
+    st.write(f"**Trajeto:** {dados.mun_origem or 'N/A'}/{dados.uf_origem or ''} → {dados.mun_destino or 'N/A'}/{dados.uf_destino or ''}")
+    st.write(f"**Valor Total:** R$ {reais(dados.valor_prestacao_centavos):.2f}")
+
+    if dados.componentes:
+        st.table([{"Componente": nome, "Valor (R$)": f"{reais(valor):.2f}"} for nome, valor in dados.componentes])
+    if dados.nfes:
+        st.write(f"**NF-e transportadas:** {len(dados.nfes)}")
 
     conn = database.get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO notas (tipo, numero, cnpj_emitente, nome_emitente, valor_total) VALUES (?, ?, ?, ?, ?)",
-                ("CTe", cte["@Id"], cnpj, nome, valor_total))
+    nfe.salvar_nota(conn, dados, datetime.now().isoformat())
+    cte.salvar_cte(conn, dados)
+    if hash_arquivo:
+        ingestao.registrar_ingeridos(conn, [ingestao.linha_ingerido(xml_path, hash_arquivo, dados, raiz="cteProc")])
     conn.commit()
-    conn.close()
\ No newline at end of file
+    conn.close()
@@ -0,0 +1,18 @@
+import pytest
+from modules import database, assinatura, esquemas
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    """Banco novo (todas as migrações aplicadas) em tmp_path, que vira o diretório de trabalho"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "data" / "db.sqlite3"))
+    database.init_db()
+    return tmp_path
+
+
+@pytest.fixture
+def sem_conferencia(monkeypatch):
+    """Desliga esquema e assinatura, para testar a ingestão com XMLs não assinados"""
+    monkeypatch.setattr(esquemas, "VALIDAR_ESQUEMA", False)
+    monkeypatch.setattr(assinatura, "VERIFICAR_ASSINATURA", False)
@@ -0,0 +1,41 @@
+"""XMLs mínimos de NF-e para os testes"""
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+
+def chave(numero, ano=24, mes=5):
+    return f"35{ano:02d}{mes:02d}{numero:038d}"
+
+
+def inf_nfe(chave_nfe, cnpj="11222333000181", itens=((1000, 180),), total=None, data="2024-05-10T10:00:00-03:00"):
+    """infNFe com itens (vProd, vICMS) em centavos; `total` sobrescreve o vProd do ICMSTot"""
+    dets = "".join(
+        f'<det nItem="{n}"><prod><cProd>P{n}</cProd><xProd>Produto {n}</xProd><NCM>84713012</NCM>'
+        f'<qCom>1</qCom><vProd>{vprod / 100:.2f}</vProd></prod>'
+        f'<imposto><ICMS><ICMS00><vICMS>{vicms / 100:.2f}</vICMS></ICMS00></ICMS></imposto></det>'
+        for n, (vprod, vicms) in enumerate(itens, 1)
+    )
+    soma_prod = sum(v for v, _ in itens) if total is None else total
+    soma_icms = sum(i for _, i in itens)
+    return (
+        f'<infNFe xmlns="{NS_NFE}" Id="NFe{chave_nfe}" versao="4.00">'
+        f'<ide><nNF>1</nNF><dhEmi>{data}</dhEmi></ide>'
+        f'<emit><CNPJ>{cnpj}</CNPJ><xNome>Emitente</xNome></emit>{dets}'
+        f'<total><ICMSTot><vProd>{soma_prod / 100:.2f}</vProd><vICMS>{soma_icms / 100:.2f}</vICMS>'
+        f'<vNF>{soma_prod / 100:.2f}</vNF></ICMSTot></total></infNFe>'
+    )
+
+
+def nfe_proc(chave_nfe, **kwargs):
+    """nfeProc sem assinatura (bytes)"""
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="{NS_NFE}" versao="4.00">'
+        f'<NFe>{inf_nfe(chave_nfe, **kwargs)}</NFe>'
+        f'<protNFe versao="4.00"><infProt><chNFe>{chave_nfe}</chNFe></infProt></protNFe></nfeProc>'
+    ).encode()
+
+
+def nfe_avulsa(chave_nfe, **kwargs):
+    """NFe sem o protocolo de autorização (bytes)"""
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><NFe xmlns="{NS_NFE}">{inf_nfe(chave_nfe, **kwargs)}</NFe>'
+    ).encode()
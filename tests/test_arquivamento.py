@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+from datetime import date
+import pytest
+from modules import arquivamento, database, migracoes, nfe
+from fabrica import chave, nfe_proc
+
+
+@pytest.fixture
+def pasta_arquivo(banco, monkeypatch):
+    pasta = banco / "data" / "arquivo"
+    monkeypatch.setattr(arquivamento, "PASTA_ARQUIVO", str(pasta))
+    return pasta
+
+
+def _gravar_notas(*chaves_datas):
+    conn = database.get_connection()
+    notas = [nfe.extrair_nfe(nfe_proc(chave_nfe, data=data)) for chave_nfe, data in chaves_datas]
+    nfe.salvar_lote(conn, notas, "2026-10-01T00:00:00")
+    conn.commit()
+    conn.close()
+
+
+def _contar(caminho, tabela):
+    conn = sqlite3.connect(caminho)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_notas_antigas_vao_para_o_arquivo_do_ano(pasta_arquivo):
+    antiga = chave(1, ano=23, mes=3)
+    recente = chave(2, ano=26, mes=5)
+    _gravar_notas((antiga, "2023-03-10T10:00:00-03:00"), (recente, "2026-05-10T10:00:00-03:00"))
+
+    movidas = arquivamento.arquivar(meses=24, tamanho_lote=1, hoje=date(2026, 10, 1))
+
+    assert movidas == {2023: 1}
+    particao = arquivamento.caminho_particao(2023)
+    assert _contar(particao, "notas") == 1 and _contar(particao, "nfe_itens") == 1
+    assert _contar(database.DB_PATH, "notas") == 1 and _contar(database.DB_PATH, "nfe_itens") == 1
+
+    linhas = arquivamento.consultar("SELECT numero FROM historico_notas ORDER BY numero")
+    assert [linha[0] for linha in linhas] == [antiga, recente]
+    # Só os anos do período são anexados
+    assert arquivamento.consultar("SELECT COUNT(*) FROM historico_notas", inicio=2026)[0][0] == 1
+
+
+def test_rodar_de_novo_nao_move_nada(pasta_arquivo):
+    _gravar_notas((chave(1, ano=23, mes=3), "2023-03-10T10:00:00-03:00"))
+    assert arquivamento.arquivar(meses=24, hoje=date(2026, 10, 1)) == {2023: 1}
+    assert arquivamento.arquivar(meses=24, hoje=date(2026, 10, 1)) == {}
+    assert _contar(arquivamento.caminho_particao(2023), "notas") == 1
+
+
+def test_arquivo_anual_e_migrado_uma_vez_por_processo(pasta_arquivo, monkeypatch):
+    _gravar_notas((chave(1, ano=23, mes=3), "2023-03-10T10:00:00-03:00"))
+    arquivamento.arquivar(meses=24, hoje=date(2026, 10, 1))
+
+    chamadas = []
+    monkeypatch.setattr(migracoes, "aplicar_migracoes", lambda conn: chamadas.append(conn))
+    for _ in range(3):
+        arquivamento.consultar("SELECT COUNT(*) FROM historico_notas")
+    assert chamadas == []
+
+
+def test_trava_perdida_para_entre_lotes(pasta_arquivo, monkeypatch):
+    _gravar_notas(*((chave(n, ano=23, mes=3), "2023-03-10T10:00:00-03:00") for n in range(1, 4)))
+    parar = threading.Event()
+    mover_lote = arquivamento._mover_lote
+
+    def mover_e_perder(*args):
+        mover_lote(*args)
+        parar.set()
+
+    monkeypatch.setattr(arquivamento, "_mover_lote", mover_e_perder)
+
+    assert arquivamento.arquivar(meses=24, tamanho_lote=1, hoje=date(2026, 10, 1), parar=parar) == {2023: 1}
+    assert _contar(database.DB_PATH, "notas") == 2
@@ -0,0 +1,125 @@
+import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
+import pytest
+from lxml import etree
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa, padding
+from modules import assinatura
+from fabrica import NS_NFE, chave, inf_nfe, nfe_proc
+
+C14N = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+_CHAVE_PRIVADA = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture(autouse=True)
+def sem_cadeia(monkeypatch):
+    """Sem ACs: confere só a assinatura e o titular, com o cache de certificados limpo"""
+    monkeypatch.setattr(assinatura, "_cadeia", False)
+    monkeypatch.setattr(assinatura, "_certificados", {})
+
+
+def _certificado(nome_comum, cnpj_outro_nome=None, chave_privada=_CHAVE_PRIVADA):
+    nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, nome_comum)])
+    inicio = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    construtor = (
+        x509.CertificateBuilder().subject_name(nome).issuer_name(nome)
+        .public_key(chave_privada.public_key()).serial_number(x509.random_serial_number())
+        .not_valid_before(inicio).not_valid_after(inicio + timedelta(days=365))
+    )
+    if cnpj_outro_nome:
+        # otherName ICP-Brasil: OCTET STRING com o CNPJ
+        valor = b"\x04" + bytes([len(cnpj_outro_nome)]) + cnpj_outro_nome.encode()
+        construtor = construtor.add_extension(x509.SubjectAlternativeName([
+            x509.OtherName(x509.ObjectIdentifier("2.16.76.1.3.3"), valor)
+        ]), critical=False)
+    return construtor.sign(chave_privada, hashes.SHA256()).public_bytes(serialization.Encoding.DER)
+
+
+def _assinatura(inf, certificado, uri):
+    """Signature (C14N, RSA-SHA256) do infNFe `inf`, como os emissores geram"""
+    digest = hashlib.sha256(etree.tostring(etree.fromstring(inf), method="c14n")).digest()
+    info = (
+        f'<SignedInfo xmlns="{assinatura.NS_DS}"><CanonicalizationMethod Algorithm="{C14N}"/>'
+        f'<SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"/>'
+        f'<Reference URI="{uri}"><Transforms>'
+        f'<Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>'
+        f'<Transform Algorithm="{C14N}"/></Transforms>'
+        f'<DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>'
+        f'<DigestValue>{base64.b64encode(digest).decode()}</DigestValue></Reference></SignedInfo>'
+    )
+    valor = _CHAVE_PRIVADA.sign(
+        etree.tostring(etree.fromstring(info), method="c14n"), padding.PKCS1v15(), hashes.SHA256()
+    )
+    return (
+        f'<Signature xmlns="{assinatura.NS_DS}">{info}'
+        f'<SignatureValue>{base64.b64encode(valor).decode()}</SignatureValue>'
+        f'<KeyInfo><X509Data><X509Certificate>{base64.b64encode(certificado).decode()}'
+        f'</X509Certificate></X509Data></KeyInfo></Signature>'
+    )
+
+
+def nfe_assinada(chave_nfe, certificado=None, uri=None, antes="", **kwargs):
+    """nfeProc assinado; `antes` é inserido no nfeProc antes da NFe assinada"""
+    inf = inf_nfe(chave_nfe, **kwargs)
+    certificado = certificado or _certificado("EMPRESA TESTE:11222333000181")
+    uri = f"#NFe{chave_nfe}" if uri is None else uri
+    return (
+        f'<nfeProc xmlns="{NS_NFE}" versao="4.00">{antes}<NFe>{inf}{_assinatura(inf, certificado, uri)}</NFe>'
+        f'<protNFe versao="4.00"><infProt><chNFe>{chave_nfe}</chNFe></infProt></protNFe></nfeProc>'
+    ).encode()
+
+
+def test_assinatura_valida():
+    resultado = assinatura.verificar(nfe_assinada(chave(1)))
+    assert resultado.valida, resultado.motivo
+    assert "EMPRESA TESTE" in resultado.titular
+
+
+def test_certificado_de_outro_estabelecimento_da_mesma_empresa():
+    certificado = _certificado("EMPRESA TESTE", cnpj_outro_nome="11222333000262")
+    resultado = assinatura.verificar(nfe_assinada(chave(1), certificado))
+    assert resultado.valida, resultado.motivo
+
+
+def test_conteudo_alterado_apos_assinatura():
+    conteudo = nfe_assinada(chave(1)).replace(b"<vProd>10.00</vProd></prod>", b"<vProd>99.00</vProd></prod>")
+    resultado = assinatura.verificar(conteudo)
+    assert not resultado.valida
+    assert "alterado" in resultado.motivo
+
+
+@pytest.mark.parametrize("uri", ["", "#NFe00000000000000000000000000000000000000000000"])
+def test_reference_precisa_apontar_para_o_infnfe(uri):
+    resultado = assinatura.verificar(nfe_assinada(chave(1), uri=uri))
+    assert not resultado.valida
+    assert "Reference" in resultado.motivo
+
+
+def test_certificado_de_outro_cnpj():
+    certificado = _certificado("OUTRA EMPRESA:99888777000166")
+    resultado = assinatura.verificar(nfe_assinada(chave(1), certificado))
+    assert not resultado.valida
+    assert "não pertence ao emitente 11222333000181" in resultado.motivo
+
+
+def test_infnfe_nao_assinado_antes_do_assinado():
+    falso = f"<NFe>{inf_nfe(chave(2), itens=((500000, 0),))}</NFe>"
+    resultado = assinatura.verificar(nfe_assinada(chave(1), antes=falso))
+    assert not resultado.valida
+    assert "não está assinado" in resultado.motivo
+
+
+def test_documento_sem_assinatura():
+    resultado = assinatura.verificar(nfe_proc(chave(1)))
+    assert not resultado.valida
+    assert resultado.motivo == "documento sem assinatura digital"
+
+
+def test_certificado_com_chave_ec_e_recusado_sem_excecao():
+    certificado = _certificado("EMPRESA TESTE:11222333000181", chave_privada=ec.generate_private_key(ec.SECP256R1()))
+    resultado = assinatura.verificar(nfe_assinada(chave(1), certificado=certificado))
+    assert not resultado.valida
+    assert "RSA" in resultado.motivo
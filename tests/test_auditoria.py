@@ -0,0 +1,63 @@
+import sys
+import subprocess
+from pathlib import Path
+from datetime import date
+import pytest
+from modules import arquivamento, auditoria, database, nfe
+from fabrica import chave, nfe_proc
+
+
+def _gravar(*documentos):
+    conn = database.get_connection()
+    nfe.salvar_lote(conn, [nfe.extrair_nfe(documento) for documento in documentos])
+    conn.commit()
+    conn.close()
+
+
+def test_divergencia_do_icmstot_com_a_soma_dos_itens(banco):
+    _gravar(
+        nfe_proc(chave(1), itens=((1000, 180), (500, 90))),
+        # vProd declarado 1 real acima da soma dos itens
+        nfe_proc(chave(2), itens=((1000, 180), (500, 90)), total=1600),
+        nfe_proc(chave(3), itens=((1000, 180),), data="2024-06-01T10:00:00-03:00", total=9999),
+    )
+
+    resultado = auditoria.auditar("2024-05")
+
+    assert resultado["notas"] == 2
+    assert resultado["notas_divergentes"] == 1 and resultado["divergencias"] == 1
+    divergencias = auditoria.listar_divergencias("2024-05")
+    assert divergencias[["chave", "campo", "diferenca"]].values.tolist() == [[chave(2), "vProd", -1.0]]
+
+
+def test_tolerancia_em_centavos(banco):
+    _gravar(nfe_proc(chave(1), itens=((1000, 180),), total=1001))
+    assert auditoria.auditar("2024-05", tolerancia=1)["divergencias"] == 0
+    assert auditoria.auditar("2024-05", tolerancia=0)["divergencias"] == 1
+
+
+@pytest.mark.parametrize("mes", ["2024-13", "2024-00", "maio", "2024/05"])
+def test_mes_invalido(banco, mes):
+    with pytest.raises(ValueError):
+        auditoria.listar_divergencias(mes)
+
+
+def test_mes_arquivado_e_recusado_mas_listado(banco, monkeypatch):
+    monkeypatch.setattr(arquivamento, "PASTA_ARQUIVO", str(banco / "data" / "arquivo"))
+    _gravar(nfe_proc(chave(1, ano=23, mes=3), data="2023-03-10T10:00:00-03:00", total=9999))
+    assert auditoria.auditar("2023-03")["divergencias"] == 1
+    arquivamento.arquivar(meses=24, hoje=date(2026, 10, 1))
+
+    with pytest.raises(ValueError, match="arquivadas"):
+        auditoria.auditar("2023-03")
+    assert auditoria.listar_divergencias("2023-03")["chave"].tolist() == [chave(1, ano=23, mes=3)]
+    assert len(auditoria.listar_divergencias()) == 1
+    # Meses sem notas arquivadas seguem auditáveis
+    assert auditoria.auditar("2023-04")["notas"] == 0
+
+
+def test_cli_nao_depende_do_streamlit():
+    codigo = "import sys, modules.auditoria; print('streamlit' in sys.modules)"
+    saida = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True,
+                           cwd=Path(__file__).resolve().parents[1])
+    assert saida.stdout.strip() == "False"
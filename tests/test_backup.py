@@ -0,0 +1,73 @@
+import os
+import gzip
+import sqlite3
+import threading
+import pytest
+from modules import backup, database
+
+
+@pytest.fixture
+def pasta_backup(banco, monkeypatch):
+    pasta = banco / "data" / "backups"
+    monkeypatch.setattr(backup, "PASTA_BACKUP", str(pasta))
+    conn = database.get_connection()
+    conn.executemany("INSERT INTO notas (tipo, numero, valor_total) VALUES ('NFe', ?, 1)",
+                     ((f"{n:044d}",) for n in range(500)))
+    conn.commit()
+    conn.close()
+    return pasta
+
+
+def test_backup_comprimido_e_verificado(pasta_backup):
+    metricas = backup.executar_backup(pausa=0)
+
+    assert metricas["arquivo"].endswith(".sqlite3.gz") and backup.listar_backups() == [metricas["arquivo"]]
+    assert backup.verificar(metricas["arquivo"]) == []
+    # Nenhum arquivo parcial fica para trás
+    assert os.listdir(pasta_backup) == [os.path.basename(metricas["arquivo"])]
+
+    restaurado = pasta_backup / "restaurado.sqlite3"
+    with gzip.open(metricas["arquivo"], "rb") as entrada:
+        restaurado.write_bytes(entrada.read())
+    conn = sqlite3.connect(restaurado)
+    assert conn.execute("SELECT COUNT(*) FROM notas").fetchone()[0] == 500
+    conn.close()
+
+
+def test_backup_corrompido_e_reportado(pasta_backup):
+    caminho = backup.executar_backup(comprimir_copia=False, pausa=0)["arquivo"]
+    with open(caminho, "r+b") as f:
+        # Estraga páginas do meio do arquivo, preservando o cabeçalho
+        f.seek(4096 * 2)
+        f.write(b"\xff" * 4096 * 3)
+
+    assert backup.verificar(caminho) != []
+
+
+def test_rotacao_mantem_os_mais_recentes(pasta_backup):
+    pasta_backup.mkdir(parents=True, exist_ok=True)
+    nomes = [f"{backup.PREFIXO}2026010{dia}_000000.sqlite3.gz" for dia in range(1, 6)]
+    for nome in nomes:
+        (pasta_backup / nome).write_bytes(b"")
+    (pasta_backup / "parcial_20260106_000000.sqlite3").write_bytes(b"")
+
+    removidos = backup.rotacionar(manter=2)
+
+    assert [os.path.basename(c) for c in removidos] == nomes[:3]
+    assert sorted(os.listdir(pasta_backup)) == sorted(nomes[3:] + ["parcial_20260106_000000.sqlite3"])
+
+
+def test_copia_reprovada_e_descartada(pasta_backup, monkeypatch):
+    monkeypatch.setattr(backup, "verificar", lambda caminho, rapido=False: ["*** in database main ***"])
+    with pytest.raises(ValueError, match="integrity_check"):
+        backup.executar_backup(pausa=0)
+    assert os.listdir(pasta_backup) == []
+
+
+def test_trava_perdida_aborta_a_copia(pasta_backup):
+    parar = threading.Event()
+    parar.set()
+
+    with pytest.raises(ValueError, match="trava perdida"):
+        backup.executar_backup(paginas=1, pausa=0, parar=parar)
+    assert backup.listar_backups() == [] and os.listdir(pasta_backup) == []
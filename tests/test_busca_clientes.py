@@ -0,0 +1,20 @@
+import pytest
+from modules.busca_clientes import IndiceClientes
+
+CLIENTES = [
+    ("11.222.333/0001-81", "Comércio São João"),
+    ("11222444000155", "Comercial Norte"),
+    ("99888777000166", "Transportes Sul"),
+]
+
+
+def test_sugere_por_prefixo_do_nome_e_do_cnpj():
+    indice = IndiceClientes(CLIENTES)
+    assert indice.sugerir("comerc") == [CLIENTES[1], CLIENTES[0]]
+    assert indice.sugerir("11.222.3") == [CLIENTES[0]]
+    assert indice.sugerir("1122") == [CLIENTES[0], CLIENTES[1]]
+
+
+@pytest.mark.parametrize("termo", [".", "./-", " - ", "..."])
+def test_termo_so_com_pontuacao_nao_lista_cnpjs(termo):
+    assert IndiceClientes(CLIENTES).sugerir(termo) == []
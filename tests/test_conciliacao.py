@@ -0,0 +1,60 @@
+from modules import conciliacao, database, nfe
+from fabrica import chave, nfe_proc
+
+FORNECEDOR = "11222333000181"
+
+
+def _gravar(*documentos):
+    conn = database.get_connection()
+    nfe.salvar_lote(conn, [nfe.extrair_nfe(documento) for documento in documentos])
+    conn.commit()
+    conn.close()
+
+
+def _mercadorias_dos_itens():
+    conn = database.get_connection()
+    linhas = conn.execute("SELECT chave, codigo_produto, codigo_mercadoria FROM nfe_itens ORDER BY chave").fetchall()
+    conn.close()
+    return [tuple(linha) for linha in linhas]
+
+
+def test_item_gravado_recebe_a_mercadoria_ja_conciliada(banco):
+    conn = database.get_connection()
+    conciliacao.confirmar(conn, FORNECEDOR, "P1", "M-100")
+    conn.commit()
+    conn.close()
+
+    _gravar(nfe_proc(chave(1)), nfe_proc(chave(2), cnpj="99888777000166"))
+
+    # Mesmo cProd de outro fornecedor continua pendente
+    assert _mercadorias_dos_itens() == [(chave(1), "P1", "M-100"), (chave(2), "P1", None)]
+    conn = database.get_connection()
+    assert [tuple(linha) for linha in conciliacao.pendentes(conn)] == [
+        ("99888777000166", "P1", "Produto 1", "84713012", 1)
+    ]
+    conn.close()
+
+
+def test_confirmar_atualiza_os_itens_ja_gravados(banco):
+    _gravar(nfe_proc(chave(1)), nfe_proc(chave(2)))
+    conn = database.get_connection()
+    assert len(conciliacao.pendentes(conn)) == 1
+
+    conciliacao.confirmar(conn, FORNECEDOR, "P1", "M-100")
+    conn.commit()
+    assert conciliacao.pendentes(conn) == []
+    assert {mercadoria for _, _, mercadoria in _mercadorias_dos_itens()} == {"M-100"}
+
+    # Trocar o de-para leva os itens junto
+    conciliacao.confirmar(conn, FORNECEDOR, "P1", "M-200")
+    conn.commit()
+    conn.close()
+    assert {mercadoria for _, _, mercadoria in _mercadorias_dos_itens()} == {"M-200"}
+
+
+def test_pendentes_usa_o_indice_dos_itens_sem_mercadoria(banco):
+    conn = database.get_connection()
+    plano = [linha[-1] for linha in conn.execute("EXPLAIN QUERY PLAN " + conciliacao.SQL_PENDENTES)]
+    conn.close()
+    assert any("idx_nfe_itens_mercadoria" in passo for passo in plano)
+    assert not any(passo.startswith("SCAN") for passo in plano)
@@ -0,0 +1,37 @@
+from datetime import date
+from modules import arquivamento, cte, database, nfe
+from fabrica import chave, nfe_proc
+
+
+def test_frete_rateado_entre_as_nfe_do_cte(banco):
+    conn = database.get_connection()
+    conn.executemany("INSERT INTO ctes (chave, valor_prestacao, qtd_nfes) VALUES (?, ?, ?)",
+                     [("CTE1", 300.0, 3), ("CTE2", 50.0, 1)])
+    conn.executemany("INSERT INTO cte_nfes (chave_nfe, chave_cte) VALUES (?, ?)",
+                     [(chave(1), "CTE1"), (chave(2), "CTE1"), (chave(3), "CTE1"), (chave(1), "CTE2")])
+
+    fretes = {linha[0]: tuple(linha[1:]) for linha in cte.custo_frete_por_nfe(conn, [chave(1), chave(2), chave(9)])}
+    conn.close()
+
+    assert fretes == {chave(1): (2, 350.0, 150.0), chave(2): (1, 300.0, 100.0)}
+
+
+def test_frete_de_cte_arquivado(banco, monkeypatch):
+    monkeypatch.setattr(arquivamento, "PASTA_ARQUIVO", str(banco / "data" / "arquivo"))
+    chave_nfe = chave(1, ano=23, mes=3)
+    conn = database.get_connection()
+    nfe.salvar_lote(conn, [nfe.extrair_nfe(nfe_proc(chave_nfe, data="2023-03-10T10:00:00-03:00"))])
+    conn.execute("INSERT INTO notas (tipo, numero, data_emissao) VALUES ('CTe', 'CTE1', '2023-03-11')")
+    conn.execute("INSERT INTO ctes (chave, valor_prestacao, qtd_nfes) VALUES ('CTE1', 80.0, 1)")
+    conn.execute("INSERT INTO cte_nfes (chave_nfe, chave_cte) VALUES (?, 'CTE1')", (chave_nfe,))
+    conn.commit()
+    conn.close()
+    arquivamento.arquivar(meses=24, hoje=date(2026, 10, 1))
+
+    conn = database.get_connection()
+    assert cte.custo_frete_por_nfe(conn, [chave_nfe]) == []
+    conn.close()
+    conn = arquivamento.conectar(2023, 2024)
+    fretes = cte.custo_frete_por_nfe(conn, [chave_nfe], historico=True)
+    conn.close()
+    assert [tuple(linha) for linha in fretes] == [(chave_nfe, 1, 80.0, 80.0)]
@@ -0,0 +1,23 @@
+from modules import database
+
+
+def _execucoes(trecho):
+    return sum(est["execucoes"] for est in database.estatisticas_consultas(limite=0) if trecho in est["consulta"])
+
+
+def test_fetchone_com_linha_registra_a_consulta(banco):
+    database.limpar_estatisticas()
+    conn = database.get_connection()
+    for _ in range(3):
+        assert conn.execute("SELECT COUNT(*) FROM notas WHERE id > ?", (0,)).fetchone() == (0,)
+    conn.close()
+    assert _execucoes("FROM notas WHERE id > ?") == 3
+
+
+def test_iteracao_interrompida_registra_ao_descartar_o_cursor(banco):
+    database.limpar_estatisticas()
+    conn = database.get_connection()
+    for _ in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+        break
+    conn.close()
+    assert _execucoes("FROM sqlite_master") == 1
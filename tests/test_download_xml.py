@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+from modules import database, download_xml
+
+CHAVE = "35240500000000000000000000000000000000000001"
+
+
+def _fila():
+    conn = database.get_connection()
+    linha = conn.execute(
+        "SELECT status, tentativas, proxima_tentativa FROM fila_download WHERE chave = ?", (CHAVE,)
+    ).fetchone()
+    conn.close()
+    return linha
+
+
+def _resultado(status, dados="motivo"):
+    """Grava o resultado de uma consulta para CHAVE, como _executar_downloads faz"""
+    tentativas = _fila()[1]
+    download_xml._gravar_lote([(CHAVE, status, dados, tentativas)])
+
+
+def test_so_erros_gastam_tentativas(banco):
+    conn = database.get_connection()
+    download_xml.enfileirar(conn, [(CHAVE, "11.222.333/0001-81")])
+    conn.commit()
+    conn.close()
+
+    for _ in range(download_xml.MAX_TENTATIVAS + 2):
+        _resultado("transitorio")
+    _resultado("aguardando_manifestacao")
+
+    status, tentativas, proxima = _fila()
+    assert (status, tentativas) == ("aguardando_manifestacao", 0)
+    assert datetime.fromisoformat(proxima) > datetime.now() + timedelta(hours=11)
+
+    for _ in range(download_xml.MAX_TENTATIVAS):
+        _resultado("erro")
+    assert _fila()[:2] == ("erro", download_xml.MAX_TENTATIVAS)
+
+
+def test_chave_adiada_volta_a_ser_listada_depois_da_espera(banco):
+    conn = database.get_connection()
+    download_xml.enfileirar(conn, [(CHAVE, "11222333000181")])
+    conn.commit()
+    conn.close()
+    _resultado("transitorio")
+    assert download_xml.listar_pendentes() == []
+
+    conn = database.get_connection()
+    conn.execute("UPDATE fila_download SET proxima_tentativa = ?", ((datetime.now() - timedelta(seconds=1)).isoformat(),))
+    conn.commit()
+    conn.close()
+    assert download_xml.listar_pendentes() == [(CHAVE, "11222333000181", 0)]
+
+
+def test_espera_exponencial_em_minutos():
+    agora = datetime(2024, 1, 1)
+    assert download_xml.reagendar("erro", 0, agora) == ("erro", 1, agora + timedelta(minutes=2))
+    assert download_xml.reagendar("erro", 2, agora)[2] == agora + timedelta(minutes=8)
+    assert download_xml.reagendar("erro", 10, agora)[2] == agora + timedelta(minutes=60)
@@ -0,0 +1,181 @@
+import threading
+from modules import assinatura, database, ingestao
+from fabrica import chave, nfe_avulsa, nfe_proc
+
+
+def _status(hash_arquivo):
+    conn = database.get_connection()
+    linha = conn.execute("SELECT status FROM arquivos_ingeridos WHERE hash = ?", (hash_arquivo,)).fetchone()
+    conn.close()
+    return linha[0] if linha else None
+
+
+def _notas():
+    conn = database.get_connection()
+    numeros = [linha[0] for linha in conn.execute("SELECT numero FROM notas")]
+    conn.close()
+    return numeros
+
+
+def _candidato(pasta, nome, conteudo):
+    caminho = pasta / nome
+    caminho.write_bytes(conteudo)
+    return str(caminho), ingestao.hash_conteudo(conteudo), conteudo
+
+
+def _ingerir_em_ordem(ingestor, candidatos):
+    """Enfileira na ordem dada (a varredura não garante ordem) e espera o gravador terminar"""
+    gravador = threading.Thread(target=ingestor._gravar)
+    gravador.start()
+    ingestor._enfileirar(candidatos)
+    ingestor.parar.set()
+    gravador.join()
+
+
+def test_arquivo_identico_e_mesma_chave_sao_descartados(banco, sem_conferencia):
+    pasta = banco / "entrada"
+    pasta.mkdir()
+    (pasta / "a.xml").write_bytes(nfe_proc(chave(1)))
+    (pasta / "b.xml").write_bytes(nfe_proc(chave(1)))
+    (pasta / "c.xml").write_bytes(nfe_proc(chave(1), cnpj="99888777000166"))
+
+    estatisticas = ingestao.Ingestor([str(pasta)]).executar(uma_vez=True)
+
+    assert _notas() == [chave(1)]
+    assert estatisticas["ingeridos"] == 1
+    assert estatisticas["duplicados"] == 2
+
+    segunda = ingestao.Ingestor([str(pasta)]).executar(uma_vez=True)
+    assert segunda["ingeridos"] == 0 and segunda["duplicados"] == 3
+
+
+def test_copia_valida_assume_quando_a_primeira_falha(banco, sem_conferencia):
+    pasta = banco / "entrada"
+    pasta.mkdir()
+    # A chave é lida do início do arquivo, mas o XML está truncado
+    ruim = _candidato(pasta, "ruim.xml", nfe_proc(chave(2))[:-40])
+    bom = _candidato(pasta, "bom.xml", nfe_proc(chave(2)))
+
+    ingestor = ingestao.Ingestor([str(pasta)])
+    _ingerir_em_ordem(ingestor, [ruim, bom])
+
+    assert _notas() == [chave(2)]
+    assert _status(ruim[1]) == "erro"
+    assert _status(bom[1]) == "ingerido"
+    assert not ingestor._chaves_em_fila and not ingestor._aguardando and not ingestor._em_fila
+
+
+def test_copia_so_vira_duplicada_depois_da_primeira_ser_ingerida(banco, sem_conferencia):
+    pasta = banco / "entrada"
+    pasta.mkdir()
+    primeira = _candidato(pasta, "a.xml", nfe_proc(chave(3)))
+    segunda = _candidato(pasta, "b.xml", nfe_proc(chave(3), cnpj="99888777000166"))
+
+    _ingerir_em_ordem(ingestao.Ingestor([str(pasta)]), [primeira, segunda])
+
+    assert _status(primeira[1]) == "ingerido"
+    assert _status(segunda[1]) == "duplicado"
+
+
+def test_duplicado_sem_chave_ingerida_volta_para_a_fila(banco, sem_conferencia):
+    conteudo = nfe_proc(chave(4))
+    hash_arquivo = ingestao.hash_conteudo(conteudo)
+    conn = database.get_connection()
+    ingestao.registrar_ingeridos(conn, [(hash_arquivo, "x.xml", "duplicado", None, chave(4), None, "nfeProc")])
+    conn.commit()
+    conn.close()
+    assert ingestao.hashes_ingeridos([hash_arquivo]) == set()
+
+    pasta = banco / "entrada"
+    pasta.mkdir()
+    (pasta / "x.xml").write_bytes(conteudo)
+    ingestao.Ingestor([str(pasta)]).executar(uma_vez=True)
+
+    assert _status(hash_arquivo) == "ingerido"
+    assert ingestao.hashes_ingeridos([hash_arquivo]) == {hash_arquivo}
+
+
+def test_reprovado_so_volta_depois_de_reprocessar_erros(banco, sem_conferencia, monkeypatch):
+    pasta = banco / "entrada"
+    pasta.mkdir()
+    conteudo = nfe_proc(chave(5))
+    (pasta / "x.xml").write_bytes(conteudo)
+    hash_arquivo = ingestao.hash_conteudo(conteudo)
+
+    # Sem assinatura: reprovado
+    monkeypatch.setattr(assinatura, "VERIFICAR_ASSINATURA", True)
+    assert ingestao.Ingestor([str(pasta)]).executar(uma_vez=True)["erros"] == 1
+    assert _status(hash_arquivo) == "erro"
+    # Reprovação não aparece como documento já importado no leitor
+    assert ingestao.buscar_ingerido(hash_arquivo, chave(5)) is None
+
+    monkeypatch.setattr(assinatura, "VERIFICAR_ASSINATURA", False)
+    assert ingestao.Ingestor([str(pasta)]).executar(uma_vez=True)["ingeridos"] == 0
+
+    assert ingestao.reprocessar_erros() == 1
+    assert ingestao.Ingestor([str(pasta)]).executar(uma_vez=True)["ingeridos"] == 1
+    assert _status(hash_arquivo) == "ingerido" and _notas() == [chave(5)]
+
+
+def test_falha_ao_interpretar_o_lote_nao_derruba_o_gravador(banco, sem_conferencia, monkeypatch):
+    pasta = banco / "entrada"
+    pasta.mkdir()
+    primeiro = _candidato(pasta, "a.xml", nfe_proc(chave(6)))
+    segundo = _candidato(pasta, "b.xml", nfe_proc(chave(7)))
+
+    def quebrar(conteudo):
+        raise RuntimeError("pool quebrado")
+
+    monkeypatch.setattr(assinatura, "VERIFICAR_ASSINATURA", True)
+    monkeypatch.setattr(ingestao, "conferir", quebrar)
+    ingestor = ingestao.Ingestor([str(pasta)], tamanho_lote=1)
+    gravador = threading.Thread(target=ingestor._gravar)
+    gravador.start()
+    ingestor._enfileirar([primeiro])
+    ingestor._enfileirar([segundo])
+    ingestor.parar.set()
+    gravador.join()
+
+    assert _status(primeiro[1]) == "erro" and _status(segundo[1]) == "erro"
+    assert ingestor.estatisticas["erros"] == 2
+    assert not ingestor._chaves_em_fila and not ingestor._em_fila
+
+
+def _raiz_ingerida(chave_nfe):
+    conn = database.get_connection()
+    raizes = [linha[0] for linha in conn.execute(
+        "SELECT raiz FROM arquivos_ingeridos WHERE chave = ? AND status = 'ingerido'", (chave_nfe,)
+    )]
+    conn.close()
+    return raizes
+
+
+def test_nfeproc_substitui_a_nfe_avulsa_ja_ingerida(banco, sem_conferencia):
+    pasta = banco / "entrada"
+    pasta.mkdir()
+    avulsa = _candidato(pasta, "avulsa.xml", nfe_avulsa(chave(8)))
+    _ingerir_em_ordem(ingestao.Ingestor([str(pasta)]), [avulsa])
+    assert _raiz_ingerida(chave(8)) == ["NFe"]
+
+    autorizada = _candidato(pasta, "autorizada.xml", nfe_proc(chave(8)))
+    outra_avulsa = _candidato(pasta, "outra.xml", nfe_avulsa(chave(8), cnpj="99888777000166"))
+    _ingerir_em_ordem(ingestao.Ingestor([str(pasta)]), [autorizada, outra_avulsa])
+
+    assert _status(autorizada[1]) == "ingerido" and _status(outra_avulsa[1]) == "duplicado"
+    assert sorted(_raiz_ingerida(chave(8))) == ["NFe", "nfeProc"]
+    assert ingestao.buscar_ingerido("outro-hash", chave(8), "nfeProc")["raiz"] == "nfeProc"
+
+
+def test_nfeproc_aguardando_assume_depois_da_nfe_avulsa(banco, sem_conferencia):
+    pasta = banco / "entrada"
+    pasta.mkdir()
+    avulsa = _candidato(pasta, "avulsa.xml", nfe_avulsa(chave(9)))
+    autorizada = _candidato(pasta, "autorizada.xml", nfe_proc(chave(9)))
+
+    ingestor = ingestao.Ingestor([str(pasta)])
+    _ingerir_em_ordem(ingestor, [avulsa, autorizada])
+
+    assert _status(avulsa[1]) == "ingerido" and _status(autorizada[1]) == "ingerido"
+    assert not ingestor._chaves_em_fila and not ingestor._aguardando and not ingestor._em_fila
+    # Só a forma mais fraca fica de fora para quem já tem o nfeProc
+    assert ingestao.buscar_ingerido("outro-hash", chave(9), "NFe") is not None
@@ -0,0 +1,70 @@
+import logging
+import sqlite3
+import pytest
+from modules import migracoes
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conexao = sqlite3.connect(tmp_path / "db.sqlite3")
+    yield conexao
+    conexao.close()
+
+
+def _esquema(conn):
+    return conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+
+
+def test_banco_novo_chega_a_ultima_versao(conn):
+    assert migracoes.aplicar_migracoes(conn) == migracoes.MIGRACOES[-1][0]
+    assert migracoes.versao_atual(conn) == migracoes.MIGRACOES[-1][0]
+    assert {"notas", "nfe_itens", "arquivos_ingeridos", "fila_download", "travas"} <= {
+        nome for tipo, nome, _ in _esquema(conn) if tipo == "table"
+    }
+
+
+def test_reaplicar_nao_muda_nada(conn):
+    migracoes.aplicar_migracoes(conn)
+    antes = _esquema(conn)
+    migracoes.aplicar_migracoes(conn)
+    assert _esquema(conn) == antes
+
+
+def test_banco_antigo_com_dados_e_atualizado(conn, monkeypatch):
+    # Banco parado na versão 8 (antes dos itens da NF-e), com uma nota gravada
+    monkeypatch.setattr(migracoes, "MIGRACOES", [m for m in migracoes.MIGRACOES if m[0] <= 8])
+    migracoes.aplicar_migracoes(conn)
+    conn.execute("INSERT INTO notas (tipo, numero, valor_total) VALUES ('NFe', '35240511222333000181550010000000011000000010', 10)")
+    conn.commit()
+    monkeypatch.undo()
+
+    migracoes.aplicar_migracoes(conn)
+
+    assert migracoes.versao_atual(conn) == migracoes.MIGRACOES[-1][0]
+    assert conn.execute("SELECT COUNT(*), MIN(data_emissao) FROM notas").fetchone() == (1, None)
+    assert "codigo_mercadoria" in migracoes.colunas(conn, "nfe_itens")
+
+
+def test_notas_sem_chave_nao_sao_tratadas_como_duplicadas(conn, monkeypatch, caplog):
+    # Banco parado na versão 4: o leitor antigo gravava 'N/A' nas notas sem chave
+    monkeypatch.setattr(migracoes, "MIGRACOES", [m for m in migracoes.MIGRACOES if m[0] <= 4])
+    migracoes.aplicar_migracoes(conn)
+    chave = "35240511222333000181550010000000011000000010"
+    conn.executemany("INSERT INTO notas (tipo, numero, valor_total) VALUES ('NFe', ?, ?)", [
+        ("N/A", 1), ("N/A", 2), ("N/A", 3), ("NFe" + chave, 4), (chave, 5),
+    ])
+    conn.commit()
+    monkeypatch.undo()
+
+    with caplog.at_level(logging.INFO, logger="fiscal.migracoes"):
+        migracoes.aplicar_migracoes(conn)
+
+    linhas = conn.execute("SELECT numero, valor_total FROM notas ORDER BY valor_total").fetchall()
+    assert linhas == [(None, 1), (None, 2), (None, 3), (chave, 5)]
+    assert "1 nota(s) duplicada(s) removida(s)" in caplog.text
+
+
+def test_banco_mais_novo_que_o_codigo(conn):
+    conn.execute(f"PRAGMA user_version = {migracoes.MIGRACOES[-1][0] + 1}")
+    with pytest.raises(RuntimeError):
+        migracoes.aplicar_migracoes(conn)
@@ -0,0 +1,34 @@
+import pytest
+import requests
+from modules import sefaz_connector
+from modules.agendador_sefaz import AgendadorSefaz, ABERTO, MEIO_ABERTO, DIST_NSU
+
+CNPJ = "11222333000181"
+
+
+def _proibido(*args, **kwargs):
+    resposta = requests.Response()
+    resposta.status_code = 403
+    return resposta
+
+
+def _url_invalida(*args, **kwargs):
+    raise requests.exceptions.InvalidURL("url inválida")
+
+
+@pytest.mark.parametrize("falha", [_proibido, _url_invalida])
+def test_chamada_de_teste_que_falha_devolve_a_vez(monkeypatch, falha):
+    agendador = AgendadorSefaz(intervalo_minimo=0.01)
+    monkeypatch.setattr(sefaz_connector, "agendador", agendador)
+    monkeypatch.setattr(requests, "post", falha)
+    # Resfriamento vencido: a próxima chamada é a de teste
+    estado = agendador._estado(CNPJ, DIST_NSU)
+    estado["circuito"], estado["proxima"] = ABERTO, 0.0
+
+    with pytest.raises(requests.exceptions.RequestException):
+        sefaz_connector.requisitar_distribuicao_dfe("cert.pem", CNPJ, "<distNSU/>")
+
+    assert estado["circuito"] == MEIO_ABERTO and not estado["sondando"]
+    # Uma nova chamada de teste sai sem esperar o circuito
+    agendador.aguardar(CNPJ, DIST_NSU, espera_maxima=1.0)
+    assert estado["sondando"]